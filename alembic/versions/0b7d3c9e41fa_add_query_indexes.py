@@ -0,0 +1,71 @@
+"""add query indexes
+
+Revision ID: 0b7d3c9e41fa
+Revises: 6aefe162ae5d
+Create Date: 2026-10-19 14:03:27.118402
+
+"""
+from contextlib import nullcontext
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0b7d3c9e41fa"
+down_revision: Union[str, None] = "6aefe162ae5d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (名字, 表, 列, unique)
+# 唯一索引建之前先把已有的重复数据清掉，不然会失败。
+# PostgreSQL上CONCURRENTLY失败会留下一个INVALID的索引，DROP掉之后再跑一次
+INDEXES = [
+    ("ix_user_name", "user", ["name"], True),
+    ("ix_user_email", "user", ["email"], True),
+    ("ix_group_name", "group", ["name"], True),
+    ("ix_item_name", "item", ["name"], True),
+    ("ix_thread_name", "thread", ["name"], True),
+    ("ix_sign_user_id_year_month", "sign", ["user_id", "year", "month"], True),
+    ("ix_thread_auth_thread_id", "thread_auth", ["thread_id"], False),
+    # 下面这些是删除物品、用户组时加载关联的行用的
+    ("ix_thread_auth_item_id", "thread_auth", ["item_id"], False),
+    ("ix_read_auth_item_id", "read_auth", ["item_id"], False),
+    ("ix_user_group_link_group_id", "user_group_link", ["group_id"], False),
+    ("ix_read_thread_id_create_time", "read", ["thread_id", "create_time"], False),
+    ("ix_user_item_link_item_id", "user_item_link", ["item_id"], False),
+]
+
+
+def _concurrently() -> bool:
+    return op.get_context().dialect.name == "postgresql"
+
+
+def _block():
+    """CREATE INDEX CONCURRENTLY不锁表，但是不能在事务里执行"""
+    if _concurrently():
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade() -> None:
+    with _block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=unique,
+                if_not_exists=True,
+                postgresql_concurrently=_concurrently(),
+            )
+
+
+def downgrade() -> None:
+    with _block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                if_exists=True,
+                postgresql_concurrently=_concurrently(),
+            )
@@ -0,0 +1,62 @@
+"""add read counters
+
+Revision ID: 3f8a61c2e9b7
+Revises: 9c5e07b2d8a4
+Create Date: 2026-10-19 20:05:13.418207
+
+"""
+from contextlib import nullcontext
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3f8a61c2e9b7"
+down_revision: Union[str, None] = "9c5e07b2d8a4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _concurrently() -> bool:
+    return op.get_context().dialect.name == "postgresql"
+
+
+def _block():
+    """和0b7d3c9e41fa一样，PostgreSQL上在事务外CONCURRENTLY建"""
+    if _concurrently():
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade() -> None:
+    # 有server_default，PostgreSQL上加列不用重写整张表
+    with op.batch_alter_table("read") as batch_op:
+        batch_op.add_column(
+            sa.Column("views", sa.Integer(), nullable=False, server_default="0")
+        )
+        batch_op.add_column(
+            sa.Column("visitors", sa.Integer(), nullable=False, server_default="0")
+        )
+    with _block():
+        op.create_index(
+            "ix_read_auth_read_id",
+            "read_auth",
+            ["read_id"],
+            if_not_exists=True,
+            postgresql_concurrently=_concurrently(),
+        )
+
+
+def downgrade() -> None:
+    with _block():
+        op.drop_index(
+            "ix_read_auth_read_id",
+            table_name="read_auth",
+            if_exists=True,
+            postgresql_concurrently=_concurrently(),
+        )
+    with op.batch_alter_table("read") as batch_op:
+        batch_op.drop_column("visitors")
+        batch_op.drop_column("views")
@@ -0,0 +1,51 @@
+"""add unique address name
+
+Revision ID: 4e2a9f7c1d36
+Revises: 0b7d3c9e41fa
+Create Date: 2026-10-19 16:41:09.552031
+
+"""
+from contextlib import nullcontext
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4e2a9f7c1d36"
+down_revision: Union[str, None] = "0b7d3c9e41fa"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _concurrently() -> bool:
+    return op.get_context().dialect.name == "postgresql"
+
+
+def _block():
+    """和0b7d3c9e41fa一样，PostgreSQL上在事务外CONCURRENTLY建"""
+    if _concurrently():
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade() -> None:
+    # add_viewaddress靠这个索引判重，已有重名的地点要先处理掉
+    with _block():
+        op.create_index(
+            "ix_address_name",
+            "address",
+            ["name"],
+            unique=True,
+            if_not_exists=True,
+            postgresql_concurrently=_concurrently(),
+        )
+
+
+def downgrade() -> None:
+    with _block():
+        op.drop_index(
+            "ix_address_name",
+            table_name="address",
+            if_exists=True,
+            postgresql_concurrently=_concurrently(),
+        )
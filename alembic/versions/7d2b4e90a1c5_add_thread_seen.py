@@ -0,0 +1,41 @@
+"""add thread seen
+
+Revision ID: 7d2b4e90a1c5
+Revises: 3f8a61c2e9b7
+Create Date: 2026-10-19 21:12:40.127385
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7d2b4e90a1c5"
+down_revision: Union[str, None] = "3f8a61c2e9b7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "thread_seen",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("thread_id", sa.Integer(), nullable=False),
+        sa.Column("seen", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["thread_id"],
+            ["thread.id"],
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id", "thread_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("thread_seen")
@@ -0,0 +1,110 @@
+"""partition and archive sign
+
+Revision ID: 9c5e07b2d8a4
+Revises: 4e2a9f7c1d36
+Create Date: 2026-10-19 18:22:50.306114
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9c5e07b2d8a4"
+down_revision: Union[str, None] = "4e2a9f7c1d36"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# sign的主键从id换成(user_id, year, month)，PostgreSQL上改成按year分区的表。
+# 要重建整张表，数据多的话找个低峰期跑
+
+
+def _is_pg() -> bool:
+    return op.get_context().dialect.name == "postgresql"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sign_archive",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id", "year"),
+    )
+    op.rename_table("sign", "sign_old")
+    if _is_pg():  # 主键的索引名不会跟着表改名
+        op.execute("ALTER INDEX sign_pkey RENAME TO sign_old_pkey")
+    op.create_table(
+        "sign",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.Integer(), nullable=False),
+        sa.Column("data", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.id"],
+        ),
+        sa.PrimaryKeyConstraint("user_id", "year", "month"),
+        postgresql_partition_by="RANGE (year)",
+    )
+    if _is_pg():
+        # 已有的每一年和以后一年各一个分区，其余的见pyforum.signs.ensure_partitions
+        years = set()
+        if not op.get_context().as_sql:  # --sql时连不上数据库
+            years.update(
+                row[0]
+                for row in op.get_bind().execute(
+                    sa.text("SELECT DISTINCT year FROM sign_old")
+                )
+            )
+        years.update(range(datetime.now().year, datetime.now().year + 2))
+        op.execute("CREATE TABLE sign_default PARTITION OF sign DEFAULT")
+        for year in sorted(years):
+            op.execute(
+                f"CREATE TABLE sign_y{year} PARTITION OF sign "
+                f"FOR VALUES FROM ({year}) TO ({year + 1})"
+            )
+    op.execute(
+        "INSERT INTO sign (user_id, year, month, data) "
+        "SELECT user_id, year, month, data FROM sign_old"
+    )
+    op.drop_table("sign_old")
+
+
+def downgrade() -> None:
+    # 归档的数据不会还原回sign，先确认sign_archive里没有要的
+    op.rename_table("sign", "sign_new")
+    if _is_pg():
+        op.execute("ALTER INDEX sign_pkey RENAME TO sign_new_pkey")
+    op.create_table(
+        "sign",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("year", sa.Integer(), nullable=False),
+        sa.Column("month", sa.Integer(), nullable=False),
+        sa.Column("data", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["user.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute(
+        "INSERT INTO sign (user_id, year, month, data) "
+        "SELECT user_id, year, month, data FROM sign_new"
+    )
+    op.drop_table("sign_new")  # PostgreSQL上分区跟着一起删
+    op.create_index(
+        "ix_sign_user_id_year_month",
+        "sign",
+        ["user_id", "year", "month"],
+        unique=True,
+    )
+    op.drop_table("sign_archive")
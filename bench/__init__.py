@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+进程内的压测，不需要起服务器
+
+    python -m bench --users 1000 --threads 50 --concurrency 32 --requests 500 --out result.json
+
+app通过asgi直接调用，数据库用临时的sqlite，redis默认用fakeredis（--redis-url 可以换成真的redis-server），
+结果是json，包含每个场景的p50/p95/p99延迟、吞吐和每个请求的sql条数，方便不同commit之间对比
+"""
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+python -m bench --help
+"""
+import argparse
+import asyncio
+import platform
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import orjson
+
+from bench import env
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="pyforum进程内压测")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--items-per-user", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--auths-per-thread", type=int, default=2)
+    parser.add_argument("--sign-months", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("--warmup", type=int, default=10, help="每个场景先不计时跑几次")
+    parser.add_argument("--scenario", action="append", help="只跑这些场景，可多次指定")
+    parser.add_argument("--redis-url", default=None, help="不给就用fakeredis")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-query-count", action="store_true", help="关掉query_debug")
+    parser.add_argument("--out", default=None, help="结果写到文件，默认stdout")
+    return parser.parse_args()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return ""
+
+
+async def main(args) -> dict:
+    # 这些import必须在env.prepare之后
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from bench.runner import run_scenario
+    from bench.scenarios import build
+    from bench.seed import Volume, create_tables, seed
+    from pyforum import app
+    from pyforum.config import settings
+    from pyforum.db import lifespan
+
+    rng = random.Random(args.seed)
+    volume = Volume(
+        users=args.users,
+        items=args.items,
+        items_per_user=args.items_per_user,
+        threads=args.threads,
+        auths_per_thread=args.auths_per_thread,
+        sign_months=args.sign_months,
+    )
+    engine = create_async_engine(settings.sqlite)
+    await create_tables(engine)
+    await seed(engine, volume, rng)
+    await engine.dispose()
+
+    scenarios = build(volume, rng)
+    selected = args.scenario or list(scenarios)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "volume": vars(volume),
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "scenarios": {},
+    }
+    async with lifespan(app) as state:
+
+        async def asgi(scope, receive, send):
+            # ASGITransport不跑lifespan，这里代替服务器把state放进去
+            scope["state"] = dict(state)
+            await app(scope, receive, send)
+
+        transport = ASGITransport(app=asgi, client=("127.0.0.1", 12345))
+
+        def client_factory():
+            return AsyncClient(
+                transport=transport, base_url="https://bench"
+            )  # session的cookie带secure
+
+        for name in selected:
+            setup, scenario = scenarios[name]
+            if args.warmup:
+                await run_scenario(client_factory, scenario, 1, args.warmup, setup)
+            result = await run_scenario(
+                client_factory, scenario, args.concurrency, args.requests, setup
+            )
+            report["scenarios"][name] = result.dump()
+            print(
+                f"{name}: {result.dump()['latency_ms']['p50']:.2f}ms p50",
+                file=sys.stderr,
+            )
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    env.prepare(args.redis_url, not args.no_query_count)
+    report = asyncio.run(main(args))
+    data = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.out:
+        Path(args.out).write_bytes(data)
+    else:
+        sys.stdout.buffer.write(data + b"\n")
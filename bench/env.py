@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+在import pyforum之前准备好环境变量和redis
+"""
+import os
+import tempfile
+from typing import Optional
+
+
+def prepare(redis_url: Optional[str] = None, query_count: bool = True) -> str:
+    """
+    :param redis_url: 不给就用fakeredis
+    :param query_count: 打开query_debug，从X-Query-Count头拿到每个请求的sql条数
+    :return: sqlite文件路径
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix="pyforum-bench-"), "bench.db")
+    os.environ["sqlite"] = f"sqlite+aiosqlite:///{path}"
+    os.environ["use_captcha"] = "false"  # 登录场景不先拿验证码，验证码生成单独压
+    os.environ["debug"] = "false"
+    os.environ["ratelimit_enabled"] = "false"  # 压测的请求全部来自同一个ip
+    os.environ["query_debug"] = "true" if query_count else "false"
+    if redis_url is not None:
+        os.environ["redis_url"] = redis_url
+    else:
+        _use_fakeredis()
+    return path
+
+
+def _use_fakeredis():
+    """pyforum.db和session的RedisStore都是通过from_url拿连接，这里全部换成同一个FakeServer"""
+    import fakeredis
+    import redis.asyncio
+    from redis.asyncio.client import Redis
+
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server)
+
+    redis.asyncio.from_url = from_url
+    Redis.from_url = classmethod(lambda cls, url, **kwargs: from_url(url))
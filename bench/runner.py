@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+并发压测和统计
+"""
+import asyncio
+from collections import Counter
+from time import perf_counter_ns
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from httpx import AsyncClient, Response
+
+Scenario = Callable[[AsyncClient, int], Awaitable[Response]]
+Setup = Callable[[AsyncClient, int], Awaitable[None]]
+
+
+def percentile(sorted_values: List[int], p: float) -> float:
+    """nearest-rank"""
+    if not sorted_values:
+        return 0.0
+    k = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+class Result:
+    def __init__(self):
+        self.latencies: List[int] = []
+        self.queries: List[int] = []
+        self.status: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.elapsed_ns = 0
+
+    def dump(self) -> Dict:
+        lat = sorted(self.latencies)
+        n = len(lat)
+        return {
+            "requests": n,
+            "throughput": n / (self.elapsed_ns / 1e9) if self.elapsed_ns else 0.0,
+            "latency_ms": {
+                "mean": sum(lat) / n / 1e6 if n else 0.0,
+                "p50": percentile(lat, 50) / 1e6,
+                "p95": percentile(lat, 95) / 1e6,
+                "p99": percentile(lat, 99) / 1e6,
+                "max": lat[-1] / 1e6 if n else 0.0,
+            },
+            "queries": {
+                "mean": sum(self.queries) / len(self.queries) if self.queries else None,
+                "max": max(self.queries) if self.queries else None,
+            },
+            "status": {str(k): v for k, v in sorted(self.status.items())},
+            "errors": dict(self.errors),
+        }
+
+
+async def run_scenario(
+    client_factory: Callable[[], AsyncClient],
+    scenario: Scenario,
+    concurrency: int,
+    total: int,
+    setup: Optional[Setup] = None,
+) -> Result:
+    """
+    concurrency个虚拟用户，每个有自己的cookie，一共发total个请求
+    setup在计时之前对每个虚拟用户调用一次（比如先登录）
+    """
+    result = Result()
+    remaining = total
+    clients = [client_factory() for _ in range(concurrency)]
+    try:
+        if setup is not None:
+            await asyncio.gather(*(setup(c, i) for i, c in enumerate(clients)))
+
+        async def worker(client: AsyncClient, wid: int):
+            nonlocal remaining
+            seq = 0
+            while remaining > 0:
+                remaining -= 1
+                seq += 1
+                start = perf_counter_ns()
+                try:
+                    resp = await scenario(client, wid * total + seq)
+                except Exception as e:
+                    result.errors[type(e).__name__] += 1
+                    continue
+                result.latencies.append(perf_counter_ns() - start)
+                result.status[resp.status_code] += 1
+                if (q := resp.headers.get("x-query-count")) is not None:
+                    result.queries.append(int(q))
+
+        start = perf_counter_ns()
+        await asyncio.gather(*(worker(c, i) for i, c in enumerate(clients)))
+        result.elapsed_ns = perf_counter_ns() - start
+    finally:
+        for c in clients:
+            await c.aclose()
+    return result
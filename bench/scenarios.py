@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+压测场景，每个场景是 (setup, request)
+"""
+import random
+
+from httpx import AsyncClient
+
+from bench.seed import ADMIN, PASSWORD, Volume
+
+
+def build(volume: Volume, rng: random.Random) -> dict:
+    def random_user() -> str:
+        return f"user{rng.randint(2, max(volume.users, 2))}"
+
+    async def login_as(client: AsyncClient, name: str):
+        resp = await client.post(
+            "/api/v1/user/login", json={"name": name, "password": PASSWORD}
+        )
+        resp.raise_for_status()
+
+    async def login(client: AsyncClient, seq: int):
+        client.cookies.clear()  # 每次都是新访客
+        return await client.post(
+            "/api/v1/user/login", json={"name": random_user(), "password": PASSWORD}
+        )
+
+    async def thread_list_anonymous(client: AsyncClient, seq: int):
+        return await client.get("/api/v1/thread/")
+
+    async def thread_list_user(client: AsyncClient, seq: int):
+        return await client.get("/api/v1/thread/")
+
+    async def sign(client: AsyncClient, seq: int):
+        # 补签不同的日子，避免全部落在同一行
+        day = seq % 28 + 1
+        return await client.post(
+            "/api/v1/user/sign", params={"year": 2023, "month": 6, "day": day}
+        )
+
+    async def get_sign(client: AsyncClient, seq: int):
+        return await client.get("/api/v1/user/sign")
+
+    async def captcha(client: AsyncClient, seq: int):
+        return await client.get("/api/v1/secure/captcha")
+
+    async def admin_search(client: AsyncClient, seq: int):
+        return await client.post(
+            "/api/v1/admin/search",
+            params={"type": "user", "op": "or"},
+            json={"name": f"user{seq % 100}"},
+        )
+
+    async def setup_user(client: AsyncClient, wid: int):
+        await login_as(client, f"user{wid % max(volume.users - 1, 1) + 2}")
+
+    async def setup_admin(client: AsyncClient, wid: int):
+        await login_as(client, ADMIN)
+
+    return {
+        "login": (None, login),
+        "thread_list_anonymous": (None, thread_list_anonymous),
+        "thread_list_user": (setup_user, thread_list_user),
+        "sign": (setup_user, sign),
+        "get_sign": (setup_user, get_sign),
+        "captcha": (None, captcha),
+        "admin_search": (setup_admin, admin_search),
+    }
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+灌数据，全部用批量insert
+"""
+import random
+from dataclasses import dataclass
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import SQLModel
+
+from pyforum.models import (
+    Group,
+    Item,
+    Sign,
+    Thread,
+    ThreadAuth,
+    User,
+    UserGroupLink,
+    UserItemLink,
+)
+from pyforum.utils import pwd_context
+
+PASSWORD = "bench-password"
+ADMIN = "admin"
+
+
+@dataclass
+class Volume:
+    users: int = 1000
+    items: int = 20
+    items_per_user: int = 5
+    threads: int = 50
+    auths_per_thread: int = 2
+    sign_months: int = 12
+
+
+async def create_tables(engine: AsyncEngine):
+    # address用的是postgis的Geometry，sqlite建不了
+    tables = [t for name, t in SQLModel.metadata.tables.items() if name != "address"]
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+
+
+async def seed(engine: AsyncEngine, volume: Volume, rng: random.Random):
+    """用户名是user{id}，id=1是管理员admin，全部用户同一个密码，只hash一次"""
+    hashed = pwd_context.hash(PASSWORD)
+    users = [
+        {
+            "id": i,
+            "name": ADMIN if i == 1 else f"user{i}",
+            "email": f"user{i}@example.com",
+            "password": hashed,
+            "activated": True,
+        }
+        for i in range(1, volume.users + 1)
+    ]
+    items = [{"id": i, "name": f"item{i}"} for i in range(1, volume.items + 1)]
+    links = []
+    for uid in range(1, volume.users + 1):
+        for item_id in rng.sample(
+            range(1, volume.items + 1), min(volume.items_per_user, volume.items)
+        ):
+            links.append(
+                {"user_id": uid, "item_id": item_id, "count": rng.randint(0, 10)}
+            )
+    threads = [
+        {"id": i, "name": f"thread{i}", "description": f"board {i}"}
+        for i in range(1, volume.threads + 1)
+    ]
+    auths = []
+    for tid in range(1, volume.threads + 1):
+        for item_id in rng.sample(
+            range(1, volume.items + 1), min(volume.auths_per_thread, volume.items)
+        ):
+            auths.append(
+                {"thread_id": tid, "item_id": item_id, "count": rng.randint(0, 5)}
+            )
+    signs = []
+    for uid in range(1, volume.users + 1):
+        for m in range(volume.sign_months):
+            signs.append(
+                {
+                    "user_id": uid,
+                    "year": 2023 + m // 12,
+                    "month": m % 12 + 1,
+                    "data": rng.getrandbits(31),
+                }
+            )
+    async with engine.begin() as conn:
+        for model, rows in (
+            (User, users),
+            (Group, [{"id": 1, "name": "user"}, {"id": 2, "name": "admin"}]),
+            (UserGroupLink, [{"user_id": 1, "group_id": 2}]),
+            (Item, items),
+            (UserItemLink, links),
+            (Thread, threads),
+            (ThreadAuth, auths),
+            (Sign, signs),
+        ):
+            if rows:
+                await conn.execute(insert(model.__table__), rows)
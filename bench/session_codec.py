@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+session编码的体积和耗时，json和二进制对比
+
+    python -m bench.session_codec
+    python -m bench.session_codec --redis-url redis://localhost:6379/15
+
+给了--redis-url时各写一份进redis，用MEMORY USAGE看实际占用（包括key和redis自己的开销）
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import orjson
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from pyforum.sessions import SessionCodec
+
+METADATA = {
+    "lifetime": 15552000,
+    "created": 1700000000.123,
+    "last_access": 1700000100.456,
+}
+TOKEN = "0123456789abcdef0123456789abcdef"
+
+# 线上常见的几种session
+SESSIONS = {
+    "anonymous": {"__metadata__": METADATA},
+    "captcha": {"captcha_id": TOKEN, "__metadata__": METADATA},
+    "login": {"user_id": 12345, "__metadata__": METADATA},
+    "login+email": {"user_id": 12345, "email_id": TOKEN, "__metadata__": METADATA},
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.session_codec", description="session编码对比"
+    )
+    parser.add_argument("--number", type=int, default=100000, help="每项计时调用多少次")
+    parser.add_argument("--redis-url", default=None, help="不给就不测MEMORY USAGE")
+    return parser.parse_args()
+
+
+def measure(number: int) -> dict:
+    codec = SessionCodec()
+    encoders = {"json": orjson.dumps, "binary": codec.serialize}
+    report = {}
+    for name, session in SESSIONS.items():
+        row = report[name] = {}
+        for kind, encode in encoders.items():
+            data = encode(session)
+            assert codec.deserialize(data) == session
+            row[kind] = {
+                "bytes": len(data),
+                "encode_us": timeit.timeit(lambda: encode(session), number=number)
+                / number
+                * 1e6,
+                "decode_us": timeit.timeit(
+                    lambda: codec.deserialize(data), number=number
+                )
+                / number
+                * 1e6,
+            }
+    return report
+
+
+def memory_usage(redis_url: str, report: dict):
+    from redis import Redis
+
+    from pyforum.config import settings
+
+    codec = SessionCodec()
+    redis = Redis.from_url(redis_url)
+    # 和线上一样的key长度，session id是secrets.token_hex(16)
+    key = f"{settings.session_prefix}{TOKEN}"
+    try:
+        for name, session in SESSIONS.items():
+            for kind, data in (
+                ("json", orjson.dumps(session)),
+                ("binary", codec.serialize(session)),
+            ):
+                redis.set(key, data, ex=60)
+                report[name][kind]["redis_bytes"] = redis.memory_usage(key, samples=0)
+    finally:
+        redis.delete(key)
+        redis.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = measure(args.number)
+    if args.redis_url:
+        memory_usage(args.redis_url, report)
+    for name, row in report.items():
+        json, binary = row["json"], row["binary"]
+        print(
+            f"{name}: {json['bytes']}B -> {binary['bytes']}B, "
+            f"encode {json['encode_us']:.2f}us -> {binary['encode_us']:.2f}us, "
+            f"decode {json['decode_us']:.2f}us -> {binary['decode_us']:.2f}us",
+            file=sys.stderr,
+        )
+    sys.stdout.buffer.write(orjson.dumps(report, option=orjson.OPT_INDENT_2) + b"\n")
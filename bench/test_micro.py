@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+模型层热点函数的微基准，每个都顺便校验结果
+
+    pip install pytest-benchmark
+    python -m pytest bench/test_micro.py --benchmark-json=micro.json
+"""
+import os
+
+import orjson
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from pyforum.models import Item, Sign, Thread, User, ViewAddress
+from pyforum.routers.user.models import UserGetProfile, UserLogin, UserRegister
+from pyforum.sessions import SessionCodec
+from pyforum.utils import ensure_str, generate_captcha, generate_token, seed
+
+
+def test_sign_set_sign(benchmark):
+    sign = Sign(user_id=1, year=2024, month=1, data=0)
+
+    def run():
+        for day in (1, 15, 31):
+            sign.set_sign(day)
+
+    benchmark(run)
+    assert sign.data == (1 << 0) | (1 << 14) | (1 << 30)
+
+
+def test_sign_to_list(benchmark):
+    sign = Sign(user_id=1, year=2024, month=1, data=0b101)
+    result = benchmark(sign.to_list)
+    assert len(result) == 32
+    assert result[:3] == [1, 0, 1] and sum(result) == 2
+
+
+def test_sign_get_sign(benchmark):
+    sign = Sign(user_id=1, year=2024, month=1, data=1 << 9)
+    assert benchmark(sign.get_sign, 10)
+    assert not sign.get_sign(11)
+
+
+def test_viewaddress_pos(benchmark):
+    addr = ViewAddress(id=1, name="a", position="POINT(120.5 30.25)", description="d")
+    assert benchmark(lambda: addr.pos) == (120.5, 30.25)
+
+
+def test_viewaddress_dump(benchmark):
+    addr = ViewAddress(
+        id=1, name="a", position="POINT(120.5 30.25)", description="d", status=1
+    )
+    result = benchmark(addr.dump)
+    assert result == {
+        "id": 1,
+        "name": "a",
+        "position": (120.5, 30.25),
+        "description": "d",
+        "status": 1,
+    }
+
+
+def test_generate_captcha(benchmark):
+    buffer, answer = benchmark(generate_captcha, 4)
+    assert len(answer) == 4 and all(c in seed for c in answer)
+    assert buffer.getvalue()[:2] == b"\xff\xd8"  # jpeg
+
+
+def test_generate_token(benchmark):
+    token = benchmark(generate_token, 6)
+    assert len(token) == 6 and all(c in seed for c in token)
+
+
+@pytest.mark.parametrize(
+    "data", ["abc", b"abc", bytearray(b"abc")], ids=["str", "bytes", "bytearray"]
+)
+def test_ensure_str(benchmark, data):
+    assert benchmark(ensure_str, data) == "abc"
+
+
+SESSION = {
+    "user_id": 12345,
+    "captcha_id": "0123456789abcdef0123456789abcdef",
+    "email_id": "fedcba9876543210fedcba9876543210",
+    "__metadata__": {
+        "lifetime": 15552000,
+        "created": 1700000000.123,
+        "last_access": 1700000100.456,
+    },
+}
+
+
+def test_session_serialize(benchmark):
+    serializer = SessionCodec()
+    data = benchmark(serializer.serialize, SESSION)
+    assert serializer.deserialize(data) == SESSION
+
+
+def test_session_deserialize(benchmark):
+    serializer = SessionCodec()
+    data = serializer.serialize(SESSION)
+    assert benchmark(serializer.deserialize, data) == SESSION
+
+
+def test_session_deserialize_json(benchmark):
+    """迁移期间redis里还有旧的json格式"""
+    serializer = SessionCodec()
+    data = orjson.dumps(SESSION)
+    assert benchmark(serializer.deserialize, data) == SESSION
+
+
+def test_user_login_validate(benchmark):
+    body = {"email": "abc@example.com", "password": "secret", "captcha": "AbCd"}
+    login = benchmark(UserLogin.model_validate, body)
+    assert login.email == "abc@example.com" and login.name is None
+
+
+def test_user_register_validate(benchmark):
+    body = {"name": "abc", "password": "secret", "captcha": "", "email_code": "1234"}
+    register = benchmark(UserRegister.model_validate, body)
+    assert register.email_code == "1234"
+
+
+def test_profile_dump(benchmark):
+    user = User(id=1, name="abc", email="abc@example.com", password="x", sign="hi")
+
+    def run():
+        return UserGetProfile.model_validate(user).model_dump(exclude_none=True)
+
+    assert benchmark(run) == {
+        "id": 1,
+        "name": "abc",
+        "email": "abc@example.com",
+        "sign": "hi",
+    }
+
+
+def test_thread_list_dump(benchmark):
+    threads = [Thread(id=i, name=f"thread{i}", description="board") for i in range(50)]
+
+    def run():
+        return [t.model_dump(exclude_none=True, exclude={"auths"}) for t in threads]
+
+    result = benchmark(run)
+    assert len(result) == 50
+    assert result[1] == {"id": 1, "name": "thread1", "description": "board"}
+
+
+def test_item_list_dump(benchmark):
+    items = [Item(id=i, name=f"item{i}", description=None) for i in range(50)]
+    result = benchmark(lambda: [i.model_dump() for i in items])
+    assert result[0] == {"id": 0, "name": "item0", "description": None}
@@ -0,0 +1,18 @@
+"""
+gunicorn -c gunicorn.conf.py pyforum:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True  # master里import pyforum，worker fork后共享
+
+
+def when_ready(server):
+    """master准备好监听之后、fork第一个worker之前"""
+    from pyforum import app
+    from pyforum.prefork import warmup
+
+    warmup(app)
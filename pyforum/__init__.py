@@ -1,61 +1,73 @@
 """
 Copyright (c) 2008-2023 synodriver <diguohuangjiajinweijun@gmail.com>
 """
-import time
-from typing import Any
-
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI
 from fastapi.responses import ORJSONResponse, RedirectResponse
+from redis.asyncio import Redis
 from sqlalchemy.exc import NoResultFound
 from starlette.responses import JSONResponse
-from starsessions import SessionAutoloadMiddleware, SessionMiddleware
-from starsessions.stores.redis import RedisStore
+from starsessions import SessionMiddleware
 
 from pyforum.config import settings
 from pyforum.db import lifespan
+from pyforum.depends import load_session
 from pyforum.exceptions import RedirectException
-from pyforum.routers import admin, secure, user
-
+from pyforum.metrics import MetricsMiddleware, instrument_redis
+from pyforum.profiler import ProfilerMiddleware
+from pyforum.querybudget import QueryBudgetMiddleware
+from pyforum.respcache import ResponseCacheMiddleware
+from pyforum.routers import admin, metrics, realtime, secure, thread, user
+from pyforum.sessions import SessionCodec, TieredRedisStore
+
+# session在路由匹配之后按路由声明的session_policy加载，见pyforum.sessions
 app = FastAPI(
-    title=settings.site_name, description="论坛后端", version="0.0.1", lifespan=lifespan
+    title=settings.site_name,
+    description="论坛后端",
+    version="0.0.1",
+    lifespan=lifespan,
+    dependencies=[Depends(load_session)],
 )
 
 app.include_router(user.router)
 app.include_router(secure.router)
 app.include_router(admin.router)
+app.include_router(thread.router)
+app.include_router(realtime.router)
+if settings.metrics_enabled:
+    app.include_router(metrics.router)
 
 #### 加session中间件
-from starsessions.serializers import Serializer
-
-
-class ORJsonSerializer(Serializer):
-    def serialize(self, data: Any) -> bytes:
-        return orjson.dumps(data)
-
-    def deserialize(self, data: bytes):
-        if not data:
-            return {}
-        return orjson.loads(data)  # type: ignore[no-any-return]
-
-
-app.add_middleware(SessionAutoloadMiddleware)
+# 响应缓存要知道是不是匿名用户，放在session中间件里面
+if settings.respcache_enabled:
+    app.add_middleware(ResponseCacheMiddleware)
+
+session_serializer = SessionCodec()
+session_redis = Redis.from_url(str(settings.redis_dsn))
+if settings.metrics_enabled:  # 读写session的命令也计入指标
+    instrument_redis(session_redis)
 app.add_middleware(
     SessionMiddleware,
-    store=RedisStore(url=str(settings.redis_dsn), prefix=settings.session_prefix),
+    store=TieredRedisStore(
+        connection=session_redis,
+        prefix=settings.session_prefix,
+        serializer=session_serializer,
+    ),
     lifetime=3600 * 24 * 180,  # cookie有效期半年,如果登录会延长
     rolling=True,
-    serializer=ORJsonSerializer(),
+    serializer=session_serializer,
 )
 
+# 开发/CI时检查每个请求的sql条数
+if settings.query_debug:
+    app.add_middleware(QueryBudgetMiddleware)
+
+# 抽样分析慢请求，调用栈在 /api/v1/admin/profile 下载
+if settings.profile_rate:
+    app.add_middleware(ProfilerMiddleware)
 
-# 后端处理时间，debug only
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+# 请求耗时等指标，放在最外层，session的加载也算进去；debug时仍然带X-Process-Time头
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
 
 
 @app.exception_handler(RedirectException)
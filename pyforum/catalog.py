@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+进程内的目录缓存：板块、板块权限、物品、用户组
+
+这些表只有管理员会改，每个请求都查一遍不值得。
+管理员修改后INCR redis里的版本号，各worker最多每catalog_check_interval秒看一次版本号，变了就整个重新加载。
+gunicorn preload时master在fork之前先加载一次（见pyforum.prefork），worker直接共享这些页面。
+存的是只读的Row（见pyforum.rows），不是orm对象。
+"""
+from time import monotonic
+from typing import Dict, List, Optional
+
+from redis.asyncio import Redis
+from sqlalchemy import Row
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import push
+from pyforum.config import settings
+from pyforum.models import Group, Item, Thread, ThreadAuth
+from pyforum.respcache import invalidate_tags
+from pyforum.rows import columns
+
+
+class Catalog:
+    def __init__(
+        self,
+        version: int,
+        threads: List[Row],
+        thread_auths: List[Row],
+        items: List[Row],
+        groups: List[Row],
+    ):
+        self.version = version
+        self.threads: Dict[int, Row] = {t.id: t for t in threads}
+        self.thread_auths: Dict[int, List[Row]] = {}
+        for auth in thread_auths:
+            self.thread_auths.setdefault(auth.thread_id, []).append(auth)
+        self.items: Dict[int, Row] = {i.id: i for i in items}
+        self.groups: Dict[int, Row] = {g.id: g for g in groups}
+
+    def auths_for(self, threads: List[Row]) -> List[Row]:
+        return [auth for t in threads for auth in self.thread_auths.get(t.id, ())]
+
+
+_catalog: Optional[Catalog] = None
+_checked_at = 0.0
+
+
+async def get_version(redis: Redis) -> int:
+    return int(await redis.get(settings.catalog_key) or 0)
+
+
+async def load_catalog(session: AsyncSession, version: int) -> Catalog:
+    threads = (await session.exec(select(*columns(Thread)).order_by(Thread.id))).all()
+    thread_auths = (await session.exec(select(*columns(ThreadAuth)))).all()
+    items = (await session.exec(select(*columns(Item)).order_by(Item.id))).all()
+    groups = (await session.exec(select(*columns(Group)).order_by(Group.id))).all()
+    return Catalog(version, threads, thread_auths, items, groups)
+
+
+def set_catalog(catalog: Catalog):
+    global _catalog, _checked_at
+    _catalog = catalog
+    _checked_at = monotonic()
+
+
+async def get_catalog(session: AsyncSession, redis: Redis) -> Catalog:
+    global _checked_at
+    if (
+        _catalog is not None
+        and monotonic() - _checked_at < settings.catalog_check_interval
+    ):
+        return _catalog
+    version = await get_version(redis)
+    if _catalog is None or _catalog.version != version:
+        set_catalog(await load_catalog(session, version))
+    else:
+        _checked_at = monotonic()
+    return _catalog
+
+
+async def invalidate_catalog(redis: Redis):
+    """管理员改了板块、物品、用户组之后调用，本worker立刻失效，其他worker下次检查时失效"""
+    global _catalog
+    await redis.incr(settings.catalog_key)
+    _catalog = None
+    await invalidate_tags(redis, "catalog")  # 依赖目录的响应缓存
+    await push.publish(redis, push.all_channel(), {"type": "catalog"})
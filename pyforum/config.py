@@ -2,7 +2,7 @@
 Copyright (c) 2008-2023 synodriver <diguohuangjiajinweijun@gmail.com>
 """
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Literal, Optional, Tuple
 
 from pydantic import AliasChoices, Field, PostgresDsn, RedisDsn, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -20,7 +20,29 @@ class Settings(BaseSettings):
         validation_alias=AliasChoices("service_redis_dsn", "redis_url"),
     )
     sqlite: Optional[str] = Field(None, description="可选的sqlite存储")
+    sqlite_production_mode: Optional[bool] = Field(
+        False, description="sqlite开WAL，写操作排队用一个连接并合并提交，读用只读连接池，见pyforum.sqlite"
+    )
+    sqlite_read_pool_size: Optional[int] = Field(8, description="生产模式下只读连接池的大小")
+    sqlite_group_commit_size: Optional[int] = Field(
+        64, description="生产模式下最多合并多少个事务一起提交"
+    )
+    sqlite_mmap_size: Optional[int] = Field(
+        256 * 1024 * 1024, description="PRAGMA mmap_size，字节"
+    )
+    sqlite_cache_size: Optional[int] = Field(
+        -64 * 1024, description="PRAGMA cache_size，负数表示KiB"
+    )
+    sqlite_busy_timeout: Optional[int] = Field(
+        5000, description="PRAGMA busy_timeout，毫秒，多个worker进程抢写锁时等待"
+    )
     pg_dsn: Optional[PostgresDsn] = Field(None, description="可选的postgresql存储")
+    replica_dsns: Optional[List[str]] = Field(
+        [], description="只读副本，和主库同一种数据库，只读的路由会把查询发到这里"
+    )
+    replica_max_lag: Optional[float] = Field(5.0, description="复制延迟超过多少秒的副本先不用")
+    replica_check_interval: Optional[float] = Field(5.0, description="每隔多少秒检查一次副本")
+    replica_check_timeout: Optional[float] = Field(1.0, description="检查副本的超时时间，秒")
     captcha_ttl: Optional[int] = Field(600, description="验证码超时时间")
     captcha_num: Optional[int] = Field(4, description="验证码位数")
 
@@ -35,10 +57,167 @@ class Settings(BaseSettings):
     session_prefix: Optional[str] = Field(
         "starsessions:", description="在redis中session的前缀"
     )
+    session_local_ttl: Optional[float] = Field(
+        30, description="worker进程内缓存session多少秒，其他worker修改时会通过pub/sub通知失效"
+    )
+    session_local_size: Optional[int] = Field(
+        10000, description="每个worker进程内最多缓存多少个session"
+    )
+    session_touch_interval: Optional[int] = Field(
+        600, description="session内容没变时最多每隔多少秒EXPIRE续期一次"
+    )
+    session_channel: Optional[str] = Field(
+        "session:invalidate", description="通知各worker丢掉本地session副本的频道"
+    )
+    session_codec: Optional[Literal["binary", "json"]] = Field(
+        "binary", description="session写进redis的格式，两种都能读，回滚时改成json"
+    )
 
     debug: Optional[bool] = Field(False, description="开启后sqlmodel将会debug，启用debug的路由")
     use_captcha: Optional[bool] = Field(True, description="是否开启captcha")
 
+    metrics_enabled: Optional[bool] = Field(True, description="是否收集指标并开放/metrics")
+    metrics_prefix: Optional[str] = Field(
+        "metrics:", description="在redis中各worker指标快照的前缀"
+    )
+    metrics_flush_interval: Optional[int] = Field(
+        5, description="worker把本进程的指标快照写入redis的间隔，秒"
+    )
+    metrics_token: Optional[str] = Field(
+        None,
+        description="抓取/metrics时带Authorization: Bearer <token>，不设只按metrics_allow判断",
+    )
+    metrics_allow: Optional[List[str]] = Field(
+        ["127.0.0.1", "::1"],
+        description="不带token也能抓取/metrics的ip或网段，放在反向代理后面时要开proxy headers",
+    )
+
+    query_debug: Optional[bool] = Field(
+        False, description="开发/CI用 记录每个请求的sql 检测N+1并检查路由声明的sql预算"
+    )
+    query_budget_strict: Optional[bool] = Field(
+        False, description="超出sql预算时抛异常而不是只写日志，CI用"
+    )
+    query_repeat_threshold: Optional[int] = Field(
+        3, description="同一个请求内同样的sql出现多少次算N+1"
+    )
+
+    profile_rate: Optional[float] = Field(
+        0.0, ge=0, le=1, description="抽多少比例的请求做采样分析，0关闭"
+    )
+    profile_threshold: Optional[int] = Field(500, description="被抽中的请求超过多少毫秒才保存调用栈")
+    profile_interval: Optional[float] = Field(5, description="采样间隔，毫秒")
+    profile_dir: Optional[str] = Field(
+        str(Path(__file__).parent.parent.resolve() / "profiles"),
+        description="保存collapsed stacks的目录",
+    )
+    profile_keep: Optional[int] = Field(100, description="最多保留多少份，超出的删掉最旧的")
+
+    catalog_key: Optional[str] = Field(
+        "catalog:version", description="板块/物品/用户组目录缓存的版本号在redis中的key"
+    )
+    catalog_check_interval: Optional[float] = Field(
+        1.0, description="worker最多每隔多少秒检查一次目录缓存的版本号"
+    )
+
+    gc_threshold: Optional[Tuple[int, int, int]] = Field(
+        None, description="gc各代阈值，例如[50000, 20, 20]，不设置用python默认的"
+    )
+    memory_channel: Optional[str] = Field(
+        "memory:command", description="管理员内存观测命令广播给各worker的频道"
+    )
+    memory_timeout: Optional[float] = Field(5.0, description="等待各worker回复的超时时间，秒")
+    tracemalloc_frames: Optional[int] = Field(1, description="tracemalloc每次分配记录几层调用栈")
+
+    respcache_enabled: Optional[bool] = Field(True, description="是否开启GET接口的响应缓存")
+    respcache_prefix: Optional[str] = Field("respcache:", description="在redis中响应缓存的前缀")
+    respcache_ttl: Optional[float] = Field(10, description="响应缓存多少秒内算新鲜的")
+    respcache_stale: Optional[float] = Field(60, description="过期后多少秒内仍然先返回旧的，同时后台刷新")
+    respcache_local_size: Optional[int] = Field(512, description="每个worker进程内最多缓存多少个响应")
+    respcache_check_interval: Optional[float] = Field(
+        1.0, description="worker最多每隔多少秒检查一次响应缓存的tag版本号"
+    )
+
+    singleflight_redis: Optional[bool] = Field(
+        False, description="板块列表等热点查询是否在worker之间也合并（用redis锁）"
+    )
+    singleflight_prefix: Optional[str] = Field(
+        "singleflight:", description="在redis中合并调用的锁和结果的前缀"
+    )
+    singleflight_lock_ttl: Optional[int] = Field(2000, description="合并调用的锁和结果的过期时间，毫秒")
+    singleflight_poll_interval: Optional[int] = Field(
+        10, description="等其他worker结果时的轮询间隔，毫秒"
+    )
+
+    ratelimit_enabled: Optional[bool] = Field(True, description="是否开启验证码、邮件、登录等接口的限流")
+    ratelimit_prefix: Optional[str] = Field("ratelimit:", description="在redis中限流计数的前缀")
+    ratelimit_rules: Optional[Dict[str, str]] = Field(
+        {
+            "captcha": "ip:30/60,session:10/60",
+            "email": "ip:5/600,session:3/600,account:3/3600",
+            "login": "ip:30/60,session:10/60,account:10/600",
+            "reset_password_email": "ip:5/600,session:3/600,account:3/3600",
+        },
+        description="每个路由的限流规则 维度:次数/秒 逗号分隔，维度有ip session account",
+    )
+    ratelimit_local_size: Optional[int] = Field(
+        10000, description="每个worker进程内最多记住多少个被封禁的客户端"
+    )
+
+    login_flush_interval: Optional[float] = Field(
+        5.0, description="每隔多少秒把登录记录和last_login批量写进数据库"
+    )
+    login_flush_size: Optional[int] = Field(1000, description="攒够多少条登录记录时提前写")
+    login_buffer_size: Optional[int] = Field(
+        100000, description="数据库写不进去时每个worker最多留多少条登录记录，超出的丢掉最旧的"
+    )
+
+    counter_prefix: Optional[str] = Field("counter:", description="在redis中帖子浏览计数的前缀")
+    counter_flush_interval: Optional[float] = Field(
+        10.0, description="每隔多少秒把redis里的浏览数写回数据库"
+    )
+    counter_flush_batch: Optional[int] = Field(1000, description="每条UPDATE最多写回多少个帖子")
+
+    hot_prefix: Optional[str] = Field("hot:", description="在redis中热门帖子zset的前缀")
+    hot_half_life: Optional[float] = Field(21600.0, description="热度的半衰期，秒，越小越偏向新的")
+    hot_epoch: Optional[float] = Field(
+        1704067200.0, description="热度从这个时间戳开始算，改了要清空热门的zset"
+    )
+    hot_size: Optional[int] = Field(1000, description="每个热门zset最多留多少个帖子")
+    hot_post_weight: Optional[float] = Field(10.0, description="发一个帖子加多少热度")
+    hot_view_weight: Optional[float] = Field(1.0, description="浏览一次加多少热度")
+
+    push_prefix: Optional[str] = Field("push:", description="在redis中实时推送频道的前缀")
+    push_queue_size: Optional[int] = Field(64, description="每个连接最多积压多少条消息，再多就断开")
+    push_send_timeout: Optional[float] = Field(5.0, description="一次发送超过多少秒就断开")
+    push_heartbeat: Optional[float] = Field(
+        30.0, description="每隔多少秒给所有连接发一次心跳，顺便发现断掉的连接"
+    )
+    push_max_connections: Optional[int] = Field(50000, description="每个worker最多多少个推送连接")
+
+    unread_prefix: Optional[str] = Field("unread:", description="在redis中未读状态的前缀")
+    unread_ttl: Optional[int] = Field(
+        7 * 24 * 3600, description="用户看过的板块在redis里保留多少秒，过期了从数据库加载"
+    )
+    unread_flush_interval: Optional[float] = Field(
+        30.0, description="每隔多少秒把用户看过的板块写回数据库"
+    )
+    unread_flush_batch: Optional[int] = Field(500, description="每个事务最多写回多少个用户")
+
+    sign_hot_years: Optional[int] = Field(
+        2, description="签到表里保留最近几年（包括今年），更早的压缩进sign_archive"
+    )
+    sign_partitions_ahead: Optional[int] = Field(
+        1, description="PostgreSQL上提前建好以后几年的签到分区"
+    )
+    sign_maintain_interval: Optional[float] = Field(
+        3600.0, description="每隔多少秒检查一次签到的分区和归档，多个worker只有一个在做"
+    )
+    sign_archive_batch: Optional[int] = Field(1000, description="归档时每个事务处理多少个用户")
+    sign_maintain_key: Optional[str] = Field(
+        "sign:maintain:lock", description="签到维护任务的redis锁"
+    )
+
     @model_validator(mode="after")
     def check_db(self) -> "Settings":
         if self.pg_dsn is None and self.sqlite is None:
@@ -2,13 +2,27 @@
 """
 各种数据库连接
 """
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
 from redis.asyncio import from_url
 from sqlalchemy.ext.asyncio import create_async_engine
 
+from pyforum import (
+    counters,
+    loginlog,
+    memory,
+    metrics,
+    push,
+    querybudget,
+    signs,
+    sqlite,
+    unread,
+)
 from pyforum.config import settings
+from pyforum.pubsub import hub
+from pyforum.replicas import ReplicaRouter
 
 gallib = None
 redis = None
@@ -19,13 +33,76 @@ else:
     HOST = "127.0.0.1"
 
 
+def make_engine(dsn: str, **kwargs):
+    engine = create_async_engine(dsn, echo=settings.debug, **kwargs)
+    if settings.metrics_enabled:
+        metrics.instrument_engine(engine)
+    if settings.query_debug:
+        querybudget.instrument_engine(engine)
+    return engine
+
+
 @asynccontextmanager
 async def lifespan(app):
     global gallib
     global redis
     redis = await from_url(str(settings.redis_dsn))
-    gallib = create_async_engine(
-        settings.sqlite or settings.pg_dsn, echo=settings.debug
-    )
-    yield {"redis": redis, "sqla": gallib}  # request.state
+    writer = None
+    if settings.sqlite and settings.sqlite_production_mode:
+        gallib = make_engine(settings.sqlite, pool_size=1, max_overflow=0)
+        reader = make_engine(
+            sqlite.read_only_dsn(settings.sqlite),
+            pool_size=settings.sqlite_read_pool_size,
+        )
+        sqlite.setup_engines(gallib, reader)
+        async with gallib.connect():  # 先切换到WAL，只读连接才能打开
+            pass
+        replicas = ReplicaRouter(gallib, [reader], fallback=reader)
+        writer = sqlite.SQLiteWriter(gallib)
+        writer.start()
+    else:
+        gallib = make_engine(settings.sqlite or str(settings.pg_dsn))
+        replicas = ReplicaRouter(
+            gallib, [make_engine(dsn) for dsn in settings.replica_dsns]
+        )
+    await replicas.check()
+    checker = asyncio.create_task(replicas.check_forever())
+    flusher = None
+    if settings.metrics_enabled:
+        metrics.instrument_redis(redis)
+        flusher = asyncio.create_task(metrics.flush_forever(redis))
+    memory.apply_gc_threshold()
+    hub.start(redis)
+    background = writer or gallib  # sqlite生产模式下后台任务也排队用写连接
+    login_flusher = asyncio.create_task(loginlog.flush_forever(background))
+    sign_maintainer = asyncio.create_task(signs.maintain_forever(background, redis))
+    counter_flusher = asyncio.create_task(counters.flush_forever(redis, background))
+    unread_flusher = asyncio.create_task(unread.flush_forever(redis, background))
+    heartbeat = asyncio.create_task(push.heartbeat_forever())
+    # request.state
+    yield {"redis": redis, "sqla": gallib, "replicas": replicas, "writer": writer}
+    checker.cancel()
+    login_flusher.cancel()
+    sign_maintainer.cancel()
+    counter_flusher.cancel()
+    unread_flusher.cancel()
+    heartbeat.cancel()
+    try:
+        await counters.flush(redis, background)  # 还没写回的浏览数
+    except Exception:
+        pass
+    try:
+        await unread.flush(redis, background)  # 还没写回的看过的板块
+    except Exception:
+        pass
+    try:
+        await loginlog.flush(background)  # 还没写的登录记录
+    except Exception:
+        pass
+    if writer is not None:  # 最后的写回也要排队，所以在这之后才停
+        await writer.stop()
+    await replicas.dispose()
+    await hub.stop()
+    if flusher is not None:
+        flusher.cancel()
     await redis.close()
@@ -1,42 +1,85 @@
 """
 全局的依赖
 """
-from typing import AsyncGenerator, List, Optional, cast
+from types import MappingProxyType
+from typing import Any, AsyncGenerator, List, Mapping, Optional, Set, cast
 
 from fastapi import Depends, HTTPException
-from fastapi.requests import Request
+from fastapi.requests import HTTPConnection, Request
 from redis.asyncio import Redis
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
+from starsessions import load_session as load_session_rw
 
 from pyforum.exceptions import RedirectException
-from pyforum.models import Thread, ThreadAuth, UserGroupLink, UserItemLink
-
-
-async def get_user_or_jump(request: Request) -> int:
+from pyforum.models import (
+    ReadAuth,
+    Thread,
+    ThreadAuth,
+    UserGroupLink,
+    UserItemLink,
+)
+from pyforum.replicas import RoutingSession
+from pyforum.sessions import read_session
+from pyforum.sqlite import WriterSession
+
+
+async def load_session(request: HTTPConnection) -> Mapping[str, Any]:
+    """
+    按路由的session_policy加载session，app上挂了一个给直接用request.session的路由，
+    路由没匹配上（404）时不会执行，也就不访问redis；websocket路由也走这里
+    """
+    policy = getattr(
+        getattr(request.scope.get("route"), "endpoint", None),
+        "__session_policy__",
+        "write",
+    )
+    if policy == "none":
+        return MappingProxyType({})  # 当作匿名用户
+    if policy == "read":
+        return await read_session(request.scope)
+    await load_session_rw(request)
+    return request.session
+
+
+async def get_user_or_jump(session: Mapping[str, Any] = Depends(load_session)) -> int:
     """没登陆就跳转，通过查询redis中的session"""
-    uid = request.session.get("user_id", None)
+    uid = session.get("user_id", None)
     if uid is not None:  # fixme 为什么会得到True？
         return uid
     else:
         raise RedirectException(307, "/")
 
 
-async def get_user(request: Request) -> Optional[int]:
-    return request.session.get("user_id", None)
+async def get_user(session: Mapping[str, Any] = Depends(load_session)) -> Optional[int]:
+    return session.get("user_id", None)
 
 
 async def get_db_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    if request.state.writer is not None:  # sqlite生产模式，写操作排队合并提交
+        async with WriterSession(request.state.writer) as session:
+            yield session
+        return
     async with AsyncSession(request.state.sqla) as session:
         yield session
 
 
+async def get_read_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """只读的路由用，查询发到副本，见pyforum.replicas；没有配置副本时和get_db_session一样"""
+    async with AsyncSession(
+        request.state.sqla,
+        sync_session_class=RoutingSession,
+        router=request.state.replicas,
+    ) as session:
+        yield session
+
+
 def get_redis(request: Request) -> Redis:
     return cast(Redis, request.state.redis)
 
 
 async def get_groups(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     user_id: int = Depends(get_user_or_jump),
 ) -> List[int]:
     links: List[UserGroupLink] = (
@@ -53,34 +96,83 @@ async def check_admin_or_raise(group_ids: List[int] = Depends(get_groups)):
 
 
 async def check_user_auth_for_threads(
-    session: AsyncSession, threads: List[Thread], user_id: Optional[int] = None
+    session: AsyncSession,
+    threads: List[Thread],
+    user_id: Optional[int] = None,
+    auths: Optional[List[ThreadAuth]] = None,
 ) -> List[Thread]:
-    invalid_threads: List[int] = []
+    """
+    过滤掉用户没有权限看的板块，板块的权限和用户的物品都只查一次，不随板块数量增加
+    :param auths: 这些板块的全部权限要求，已经有了（比如目录缓存）就不用再查
+    """
+    if not threads:
+        return threads
+    if auths is None:
+        auths = (
+            await session.exec(
+                select(ThreadAuth).where(
+                    ThreadAuth.thread_id.in_([thread.id for thread in threads])
+                )
+            )
+        ).all()
+    invalid_threads: Set[int] = set()
     if user_id is not None:
-        for thread in threads:
-            await session.refresh(thread, ["id", "title", "description", "auths"])
-
-            itemlinks: List[UserItemLink] = (
+        owned = dict(
+            (
                 await session.exec(
-                    select(UserItemLink).where(UserItemLink.user_id == user_id)
+                    select(UserItemLink.item_id, UserItemLink.count).where(
+                        UserItemLink.user_id == user_id
+                    )
                 )
             ).all()
-            for auth in thread.auths:  # 里面的每一项必须满足
-                for itemlink in itemlinks:
-                    if (
-                        itemlink.item_id == auth.item_id
-                        and itemlink.count >= auth.count
-                    ):
-                        break
-                else:
-                    # auth.item_id auth.count 这项不满足 要么没有要么数量不够
-                    invalid_threads.append(thread.id)
-                    break
+        )
+        for auth in auths:  # 里面的每一项必须满足
+            count = owned.get(auth.item_id)
+            if count is None or count < auth.count:
+                # auth.item_id auth.count 这项不满足 要么没有要么数量不够
+                invalid_threads.add(auth.thread_id)
     else:
-        for thread in threads:
-            await session.refresh(thread, ["id", "title", "description", "auths"])
-            for auth in thread.auths:  # 里面的每一项必须满足
-                if auth.count > 0:  # 因为用户没登录，认为啥也没有
-                    invalid_threads.append(thread.id)
-                    break
+        for auth in auths:
+            if auth.count > 0:  # 因为用户没登录，认为啥也没有
+                invalid_threads.add(auth.thread_id)
     return [thread for thread in threads if thread.id not in invalid_threads]
+
+
+async def check_user_auth_for_reads(
+    session: AsyncSession, reads: List[Any], user_id: Optional[int] = None
+) -> List[Any]:
+    """
+    过滤掉用户没有权限看的帖子，规则和check_user_auth_for_threads一样；
+    帖子一般没有权限要求，这时只查一次read_auth
+    """
+    if not reads:
+        return reads
+    auths = (
+        await session.exec(
+            select(ReadAuth.read_id, ReadAuth.item_id, ReadAuth.count).where(
+                ReadAuth.read_id.in_([read.id for read in reads])
+            )
+        )
+    ).all()
+    if not auths:
+        return reads
+    invalid_reads: Set[int] = set()
+    if user_id is not None:
+        owned = dict(
+            (
+                await session.exec(
+                    select(UserItemLink.item_id, UserItemLink.count).where(
+                        UserItemLink.user_id == user_id
+                    )
+                )
+            ).all()
+        )
+        for auth in auths:
+            count = owned.get(auth.item_id)
+            if count is None or count < auth.count:
+                invalid_reads.add(auth.read_id)
+    else:
+        for auth in auths:
+            if auth.count > 0:  # 没登录，认为啥也没有
+                invalid_reads.add(auth.read_id)
+    return [read for read in reads if read.id not in invalid_reads]
@@ -7,3 +7,7 @@ class RedirectException(Exception):
     def __init__(self, status_code: int = 307, url: str = "/"):
         self.status_code = status_code
         self.url = url
+
+
+class QueryBudgetExceeded(Exception):
+    """路由执行的sql条数超过了用query_budget声明的预算，只在query_budget_strict时抛出"""
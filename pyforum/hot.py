@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+热门帖子
+
+每个板块一个zset {hot_prefix}thread:{id}，外加全站的 {hot_prefix}all，member是read_id。
+热度是按时间衰减的和：发帖、浏览各加一次 weight * 2^((t - hot_epoch) / hot_half_life)，
+过一个半衰期，以前的贡献相对现在的就减半。因为所有帖子衰减得一样快，比较这个不随时间缩小的和就等于比较当下的热度，
+不用定时重算。直接存这个和很快会溢出，存的是它的log2，加一次就是logaddexp：
+    log2(2^a + 2^b) = max(a, b) + log2(1 + 2^-|a - b|)
+一个lua脚本读ZSCORE、算完ZADD，两个zset一次往返更新，顺便ZREMRANGEBYRANK只留前hot_size个。
+"""
+import math
+from time import time
+from typing import List, Optional, Sequence
+
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+
+from pyforum.config import settings
+
+# KEYS 板块的zset、全站的zset
+# ARGV read_id、这次加的热度的log2、每个zset留多少个
+_LUA = """
+local x = tonumber(ARGV[2])
+for i = 1, #KEYS do
+    local old = redis.call('ZSCORE', KEYS[i], ARGV[1])
+    local score = x
+    if old then
+        old = tonumber(old)
+        local hi, lo = math.max(old, x), math.min(old, x)
+        score = hi + math.log(1 + 2 ^ (lo - hi)) / math.log(2)
+    end
+    redis.call('ZADD', KEYS[i], score, ARGV[1])
+    redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -tonumber(ARGV[3]) - 1)
+end
+return 0
+"""
+
+_script: Optional[AsyncScript] = None
+
+
+def _key(thread_id: Optional[int]) -> str:
+    if thread_id is None:
+        return f"{settings.hot_prefix}all"
+    return f"{settings.hot_prefix}thread:{thread_id}"
+
+
+def score_of(weight: float, now: Optional[float] = None) -> float:
+    """now时刻加weight的热度，取log2之后的"""
+    if now is None:
+        now = time()
+    return math.log2(weight) + (now - settings.hot_epoch) / settings.hot_half_life
+
+
+async def record(
+    redis: Redis,
+    read_id: int,
+    thread_id: int,
+    weight: float,
+    now: Optional[float] = None,
+):
+    """发帖、浏览的时候调用，板块的和全站的一起加"""
+    global _script
+    if _script is None:
+        _script = redis.register_script(_LUA)
+    await _script(
+        keys=[_key(thread_id), _key(None)],
+        args=[read_id, score_of(weight, now), settings.hot_size],
+        client=redis,
+    )
+
+
+async def top(redis: Redis, thread_id: Optional[int], limit: int) -> List[int]:
+    """最热的limit个read_id，thread_id是None时是全站的"""
+    return [int(i) for i in await redis.zrevrange(_key(thread_id), 0, limit - 1)]
+
+
+async def discard(redis: Redis, thread_id: Optional[int], read_ids: Sequence[int]):
+    """已经删掉的帖子"""
+    if read_ids:
+        await redis.zrem(_key(thread_id), *read_ids)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+登录记录的write-behind
+
+登录时只把(user_id, ip, 时间)放进本进程的缓冲区，不再同步UPDATE user。后台每login_flush_interval秒写一次：
+    全部记录一条INSERT写进login_history，给安全审查用
+    每个用户只取最新的一条，用UPDATE ... CASE一次更新user.last_login和last_ip
+缓冲区攒到login_flush_size条时提前写。写失败的放回缓冲区下次再试，lifespan结束时再写一次。
+worker被kill掉的话最多丢几秒的记录，这些只是审计数据，不影响登录。
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, insert, literal, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from pyforum.config import settings
+from pyforum.models import LoginHistory, User, tz
+
+logger = logging.getLogger(__name__)
+
+LoginEvent = Tuple[int, Optional[str], datetime]
+
+_buffer: List[LoginEvent] = []
+_wakeup: Optional[asyncio.Event] = None
+_CHUNK = 500  # 一条UPDATE最多更新多少个用户，别超过sqlite的参数个数上限
+
+
+def record_login(user_id: int, ip: Optional[str]):
+    _buffer.append((user_id, ip, datetime.now(tz=tz)))
+    if len(_buffer) >= settings.login_flush_size and _wakeup is not None:
+        _wakeup.set()
+
+
+async def flush(engine: AsyncEngine) -> int:
+    """把缓冲区写进数据库，返回写了多少条"""
+    global _buffer
+    events, _buffer = _buffer, []
+    if not events:
+        return 0
+    latest: Dict[int, Tuple[Optional[str], datetime]] = {}
+    for user_id, ip, login_time in events:  # 按时间顺序，后面的覆盖前面的
+        latest[user_id] = (ip, login_time)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                insert(LoginHistory),
+                [
+                    {"user_id": user_id, "ip": ip, "login_time": login_time}
+                    for user_id, ip, login_time in events
+                ],
+            )
+            users = list(latest)
+            for i in range(0, len(users), _CHUNK):
+                chunk = users[i : i + _CHUNK]
+                await conn.execute(
+                    update(User)
+                    .where(User.id.in_(chunk))
+                    .values(
+                        # 绑定参数要带上列的类型，不然sqlite按字符串存，时区不对
+                        last_login=case(
+                            {
+                                u: literal(latest[u][1], User.last_login.type)
+                                for u in chunk
+                            },
+                            value=User.id,
+                        ),
+                        last_ip=case({u: latest[u][0] for u in chunk}, value=User.id),
+                    )
+                )
+    except Exception:
+        _buffer = events + _buffer  # 下次再试
+        if len(_buffer) > settings.login_buffer_size:
+            logger.warning(
+                "drop %d login events", len(_buffer) - settings.login_buffer_size
+            )
+            del _buffer[: len(_buffer) - settings.login_buffer_size]
+        raise
+    return len(events)
+
+
+async def flush_forever(engine: AsyncEngine):
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), settings.login_flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await flush(engine)
+        except Exception:  # 数据库临时不可用时不要让后台任务退出
+            logger.exception("failed to flush login history")
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+内存观测
+
+每个worker通过pyforum.pubsub订阅settings.memory_channel，管理员的请求publish一条命令，
+PUBLISH的返回值就是收到命令的worker数，各worker把结果RPUSH到这次命令专属的list里，
+发命令的worker BLPOP收齐（或者超时）之后汇总返回。
+
+命令:
+    stats     rss、gc各代计数和阈值、tracemalloc状态
+    collect   gc.collect()，返回回收数量和前后rss
+    snapshot  tracemalloc快照的top N分配位置，和上一次快照的差值（找泄漏用），第一次会先开启tracemalloc
+    stop      关掉tracemalloc，它本身很占内存和cpu
+"""
+import asyncio
+import gc
+import os
+import secrets
+import sys
+import tracemalloc
+from typing import List, Optional, Set
+
+import orjson
+from redis.asyncio import Redis
+
+from pyforum.config import settings
+from pyforum.metrics import worker_id
+from pyforum.pubsub import hub
+
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def rss() -> Optional[int]:
+    """当前常驻内存 字节，没有/proc的系统退而求其次用峰值，都没有（Windows）时是None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    try:
+        import resource  # 只有POSIX有，pyforum.db会导入这个模块
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def apply_gc_threshold():
+    if settings.gc_threshold:
+        gc.set_threshold(*settings.gc_threshold)
+
+
+def _stats() -> dict:
+    return {
+        "rss": rss(),
+        "gc_count": gc.get_count(),
+        "gc_threshold": gc.get_threshold(),
+        "gc_frozen": gc.get_freeze_count(),
+        "tracemalloc": tracemalloc.is_tracing(),
+        "traced": tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None,
+    }
+
+
+def _collect() -> dict:
+    before = rss()
+    collected = gc.collect()
+    return {"collected": collected, "rss_before": before, "rss": rss()}
+
+
+def _snapshot(top: int) -> dict:
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(settings.tracemalloc_frames)
+        _last_snapshot = None
+        return {"tracemalloc": "started, take another snapshot later", "rss": rss()}
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    ret = {
+        "rss": rss(),
+        "top": [
+            {"site": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:top]
+        ],
+    }
+    if _last_snapshot is not None:
+        ret["diff"] = [
+            {
+                "site": str(stat.traceback),
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+            }
+            for stat in snapshot.compare_to(_last_snapshot, "lineno")[:top]
+        ]
+    _last_snapshot = snapshot
+    return ret
+
+
+def _stop() -> dict:
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    return {"tracemalloc": False, "rss": rss()}
+
+
+async def run_local(action: str, top: int = 20) -> dict:
+    if action == "stats":
+        data = _stats()
+    elif action == "collect":
+        data = _collect()
+    elif action == "snapshot":
+        data = await asyncio.to_thread(_snapshot, top)  # 统计很慢，别卡住事件循环
+    elif action == "stop":
+        data = _stop()
+    else:
+        raise ValueError(f"unknown action {action}")
+    data["worker"] = worker_id()
+    return data
+
+
+async def _reply(command: dict):
+    try:
+        data = await run_local(command["action"], command["top"])
+    except Exception as e:
+        data = {"worker": worker_id(), "error": repr(e)}
+    await hub.redis.rpush(command["reply"], orjson.dumps(data))
+    await hub.redis.expire(command["reply"], int(settings.memory_timeout) + 5)
+
+
+_tasks: Set[asyncio.Task] = set()
+
+
+def _handle(data: bytes):
+    task = asyncio.create_task(_reply(orjson.loads(data)))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+hub.subscribe(settings.memory_channel, _handle)
+
+
+async def broadcast(redis: Redis, action: str, top: int = 20) -> List[dict]:
+    """发给所有worker（包括自己），收集结果"""
+    reply = f"{settings.memory_channel}:reply:{secrets.token_hex(8)}"
+    expected = await redis.publish(
+        settings.memory_channel,
+        orjson.dumps({"action": action, "top": top, "reply": reply}),
+    )
+    results = []
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.memory_timeout
+    while len(results) < expected:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        item = await redis.blpop([reply], timeout=max(remaining, 0.01))
+        if item is None:
+            break
+        results.append(orjson.loads(item[1]))
+    await redis.delete(reply)
+    return results
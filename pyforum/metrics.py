@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+"""
+应用指标：按路由的请求延迟直方图、每个请求的数据库/redis开销、进行中的请求数
+
+每个worker只在本进程内累加（没有锁，开销只有几次dict查找），
+后台任务定时把快照写进redis，/metrics 读出全部worker的快照相加后输出prometheus文本格式。
+gunicorn多进程时每个worker的计数互不干扰，worker退出后其快照随ttl过期。
+"""
+import asyncio
+import os
+import socket
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from redis.asyncio import Redis
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from pyforum.config import settings
+
+# 直方图的桶，单位秒
+BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+_BUCKETS_NS = tuple(int(b * 1e9) for b in BUCKETS)
+
+
+def worker_id() -> str:
+    """每次现算，gunicorn preload时import发生在master里，pid要fork之后才对"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class RequestStats:
+    """一个请求内的数据库和redis开销，由中间件放进contextvar"""
+
+    __slots__ = ("db_count", "db_time_ns", "redis_count", "redis_time_ns")
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_time_ns = 0
+        self.redis_count = 0
+        self.redis_time_ns = 0
+
+
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_stats", default=None
+)
+
+
+class Histogram:
+    """不累加的桶计数，最后一个桶是+Inf，输出的时候再累加"""
+
+    __slots__ = ("buckets", "sum_ns", "count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(_BUCKETS_NS) + 1)
+        self.sum_ns = 0
+        self.count = 0
+
+    def observe(self, ns: int):
+        self.buckets[bisect_left(_BUCKETS_NS, ns)] += 1
+        self.sum_ns += ns
+        self.count += 1
+
+    def dump(self) -> list:
+        return [self.buckets, self.sum_ns, self.count]
+
+    def merge(self, data: list):
+        buckets, sum_ns, count = data
+        for i, v in enumerate(buckets):
+            self.buckets[i] += v
+        self.sum_ns += sum_ns
+        self.count += count
+
+
+class Registry:
+    """
+    本进程的全部指标
+    key都是tuple，快照时转成list以便orjson
+    """
+
+    def __init__(self):
+        self.inflight = 0
+        # (method, route) -> Histogram
+        self.http_latency: Dict[Tuple[str, ...], Histogram] = {}
+        # (method, route, status) -> count
+        self.http_requests: Dict[Tuple[str, ...], int] = {}
+        # (method, route) -> count 5xx或者未处理的异常
+        self.http_errors: Dict[Tuple[str, ...], int] = {}
+        # (method, route) -> sql条数和总耗时
+        self.db_queries: Dict[Tuple[str, ...], int] = {}
+        self.db_time_ns: Dict[Tuple[str, ...], int] = {}
+        # (method, route) -> 单个请求内数据库总耗时
+        self.db_latency: Dict[Tuple[str, ...], Histogram] = {}
+        # (method, route) -> redis命令条数和总耗时
+        self.redis_commands: Dict[Tuple[str, ...], int] = {}
+        self.redis_time_ns: Dict[Tuple[str, ...], int] = {}
+        # (command,) -> Histogram
+        self.redis_latency: Dict[Tuple[str, ...], Histogram] = {}
+        # (function, outcome) -> count 见pyforum.singleflight
+        self.singleflight: Dict[Tuple[str, ...], int] = {}
+
+    def observe_request(
+        self, method: str, route: str, status: int, ns: int, stats: RequestStats
+    ):
+        key = (method, route)
+        hist = self.http_latency.get(key)
+        if hist is None:
+            hist = self.http_latency[key] = Histogram()
+        hist.observe(ns)
+        status_key = (method, route, str(status))
+        self.http_requests[status_key] = self.http_requests.get(status_key, 0) + 1
+        if status >= 500:
+            self.http_errors[key] = self.http_errors.get(key, 0) + 1
+        if stats.db_count:
+            self.db_queries[key] = self.db_queries.get(key, 0) + stats.db_count
+            self.db_time_ns[key] = self.db_time_ns.get(key, 0) + stats.db_time_ns
+            hist = self.db_latency.get(key)
+            if hist is None:
+                hist = self.db_latency[key] = Histogram()
+            hist.observe(stats.db_time_ns)
+        if stats.redis_count:
+            self.redis_commands[key] = (
+                self.redis_commands.get(key, 0) + stats.redis_count
+            )
+            self.redis_time_ns[key] = (
+                self.redis_time_ns.get(key, 0) + stats.redis_time_ns
+            )
+
+    def observe_redis(self, command: str, ns: int):
+        key = (command,)
+        hist = self.redis_latency.get(key)
+        if hist is None:
+            hist = self.redis_latency[key] = Histogram()
+        hist.observe(ns)
+
+    def observe_singleflight(self, function: str, outcome: str):
+        key = (function, outcome)
+        self.singleflight[key] = self.singleflight.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "http_latency": [[*k, v.dump()] for k, v in self.http_latency.items()],
+            "http_requests": [[*k, v] for k, v in self.http_requests.items()],
+            "http_errors": [[*k, v] for k, v in self.http_errors.items()],
+            "db_queries": [[*k, v] for k, v in self.db_queries.items()],
+            "db_time_ns": [[*k, v] for k, v in self.db_time_ns.items()],
+            "db_latency": [[*k, v.dump()] for k, v in self.db_latency.items()],
+            "redis_commands": [[*k, v] for k, v in self.redis_commands.items()],
+            "redis_time_ns": [[*k, v] for k, v in self.redis_time_ns.items()],
+            "redis_latency": [[*k, v.dump()] for k, v in self.redis_latency.items()],
+            "singleflight": [[*k, v] for k, v in self.singleflight.items()],
+        }
+
+    def merge(self, snapshot: dict):
+        """把另一个worker的快照加到自己身上"""
+        self.inflight += snapshot["inflight"]
+        for name in ("http_latency", "db_latency", "redis_latency"):
+            target: Dict[Tuple[str, ...], Histogram] = getattr(self, name)
+            for *k, v in snapshot[name]:
+                key = tuple(k)
+                hist = target.get(key)
+                if hist is None:
+                    hist = target[key] = Histogram()
+                hist.merge(v)
+        for name in (
+            "http_requests",
+            "http_errors",
+            "db_queries",
+            "db_time_ns",
+            "redis_commands",
+            "redis_time_ns",
+            "singleflight",
+        ):
+            target: Dict[Tuple[str, ...], int] = getattr(self, name)
+            for *k, v in snapshot.get(name, ()):  # 滚动升级时旧worker的快照没有新指标
+                key = tuple(k)
+                target[key] = target.get(key, 0) + v
+
+
+registry = Registry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _render_histogram(
+    lines: List[str],
+    name: str,
+    doc: str,
+    label_names: Tuple[str, ...],
+    data: Dict[Tuple[str, ...], Histogram],
+):
+    lines.append(f"# HELP {name} {doc}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, hist in sorted(data.items()):
+        acc = 0
+        for bound, v in zip(BUCKETS, hist.buckets):
+            acc += v
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_labels(label_names, key, le)} {acc}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels(label_names, key, le)} {hist.count}")
+        lines.append(f"{name}_sum{_labels(label_names, key)} {hist.sum_ns / 1e9}")
+        lines.append(f"{name}_count{_labels(label_names, key)} {hist.count}")
+
+
+def _render_counter(
+    lines: List[str],
+    name: str,
+    doc: str,
+    label_names: Tuple[str, ...],
+    data: Dict[Tuple[str, ...], int],
+    scale: float = 1,
+):
+    lines.append(f"# HELP {name} {doc}")
+    lines.append(f"# TYPE {name} counter")
+    for key, v in sorted(data.items()):
+        lines.append(f"{name}{_labels(label_names, key)} {v * scale}")
+
+
+def render(reg: Registry) -> str:
+    """prometheus text exposition format 0.0.4"""
+    route = ("method", "route")
+    lines: List[str] = [
+        "# HELP pyforum_http_requests_in_flight 正在处理的请求数",
+        "# TYPE pyforum_http_requests_in_flight gauge",
+        f"pyforum_http_requests_in_flight {reg.inflight}",
+    ]
+    _render_histogram(
+        lines,
+        "pyforum_http_request_duration_seconds",
+        "请求处理耗时",
+        route,
+        reg.http_latency,
+    )
+    _render_counter(
+        lines,
+        "pyforum_http_requests_total",
+        "请求数",
+        ("method", "route", "status"),
+        reg.http_requests,
+    )
+    _render_counter(
+        lines, "pyforum_http_errors_total", "5xx和未处理异常", route, reg.http_errors
+    )
+    _render_counter(
+        lines, "pyforum_db_queries_total", "执行的sql条数", route, reg.db_queries
+    )
+    _render_counter(
+        lines,
+        "pyforum_db_seconds_total",
+        "sql总耗时",
+        route,
+        reg.db_time_ns,
+        1e-9,
+    )
+    _render_histogram(
+        lines,
+        "pyforum_db_request_duration_seconds",
+        "单个请求内sql的总耗时",
+        route,
+        reg.db_latency,
+    )
+    _render_counter(
+        lines,
+        "pyforum_redis_commands_total",
+        "执行的redis命令条数，pipeline按里面的命令数算",
+        route,
+        reg.redis_commands,
+    )
+    _render_counter(
+        lines,
+        "pyforum_redis_seconds_total",
+        "redis命令总耗时",
+        route,
+        reg.redis_time_ns,
+        1e-9,
+    )
+    _render_histogram(
+        lines,
+        "pyforum_redis_command_duration_seconds",
+        "redis命令耗时",
+        ("command",),
+        reg.redis_latency,
+    )
+    _render_counter(
+        lines,
+        "pyforum_singleflight_calls_total",
+        "合并调用 leader自己执行 merged等本进程的结果 remote等其他worker的结果",
+        ("function", "outcome"),
+        reg.singleflight,
+    )
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _worker_key() -> str:
+    return f"{settings.metrics_prefix}worker:{worker_id()}"
+
+
+async def flush(redis: Redis):
+    """把本进程的快照写进redis，ttl是刷新间隔的3倍，worker挂了之后自然消失"""
+    await redis.set(
+        _worker_key(),
+        orjson.dumps(registry.snapshot()),
+        ex=settings.metrics_flush_interval * 3,
+    )
+
+
+async def flush_forever(redis: Redis):
+    while True:
+        await asyncio.sleep(settings.metrics_flush_interval)
+        try:
+            await flush(redis)
+        except Exception:  # redis临时不可用时不要让后台任务退出
+            pass
+
+
+async def collect(redis: Redis) -> str:
+    """汇总全部worker的指标"""
+    await flush(redis)  # 自己的先写进去，保证本worker的数据是最新的
+    merged = Registry()
+    keys = [key async for key in redis.scan_iter(settings.metrics_prefix + "worker:*")]
+    if keys:
+        for raw in await redis.mget(keys):
+            if raw:
+                merged.merge(orjson.loads(raw))
+    return render(merged)
+
+
+class MetricsMiddleware:
+    """
+    纯asgi中间件，不经过BaseHTTPMiddleware，尽量少的额外开销
+    debug时还会带上以前的X-Process-Time头
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        status = 500  # 没发出响应头就抛异常了
+        start = perf_counter_ns()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.debug:
+                    MutableHeaders(scope=message)["X-Process-Time"] = str(
+                        (perf_counter_ns() - start) / 1e9
+                    )
+            await send(message)
+
+        registry.inflight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter_ns() - start
+            registry.inflight -= 1
+            current_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"  # 404不按path区分，免得被刷爆
+            registry.observe_request(scope["method"], path, status, elapsed, stats)
+
+
+def instrument_engine(engine):
+    """给AsyncEngine挂上sql计时"""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start_ns = perf_counter_ns()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter_ns() - context._metrics_start_ns
+        stats = current_stats.get()
+        if stats is not None:
+            stats.db_count += 1
+            stats.db_time_ns += elapsed
+
+
+def _observe_redis(command: str, count: int, elapsed: int):
+    registry.observe_redis(command, elapsed)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.redis_count += count
+        stats.redis_time_ns += elapsed
+
+
+def instrument_redis(client: Redis):
+    """
+    包一层execute_command和pipeline的execute，记录每条redis命令的耗时
+    pipeline整个算一次PIPELINE，计入请求的条数按里面的命令数算
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def timed_execute_command(*args, **options):
+        start = perf_counter_ns()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            command = args[0]
+            if not isinstance(command, str):
+                command = command.decode()
+            _observe_redis(command.upper(), 1, perf_counter_ns() - start)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*args, **kwargs):
+            count = len(pipe.command_stack)  # execute之后会清空
+            if not count:
+                return await execute(*args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return await execute(*args, **kwargs)
+            finally:
+                _observe_redis("PIPELINE", count, perf_counter_ns() - start)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
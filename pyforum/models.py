@@ -8,11 +8,8 @@ from typing import List, Optional
 
 from bitarray import bitarray
 from geoalchemy2 import Geometry
-from pydantic import FilePath
-from sqlalchemy import Column, DateTime, func
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlmodel import Field, Relationship, SQLModel, create_engine
-from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Column, DateTime, Index, LargeBinary
+from sqlmodel import Field, Relationship, SQLModel
 
 from pyforum.config import settings
 
@@ -26,15 +23,17 @@ class UserGroupLink(SQLModel, table=True):
 
     __tablename__ = "user_group_link"
     user_id: Optional[int] = Field(None, foreign_key="user.id", primary_key=True)
-    group_id: Optional[int] = Field(None, foreign_key="group.id", primary_key=True)
+    group_id: Optional[int] = Field(
+        None, foreign_key="group.id", primary_key=True, index=True
+    )
 
 
 class User(SQLModel, table=True):
     __tablename__ = "user"
     id: Optional[int] = Field(None, primary_key=True)
-    name: str = Field(...)
+    name: str = Field(..., unique=True, index=True)
     age: Optional[int] = Field(None, gt=0, lt=200)
-    email: Optional[str] = Field(None)
+    email: Optional[str] = Field(None, unique=True, index=True)
     password: str = Field(..., description="hashed password")
     logo: Optional[str] = Field(None, description="头像")
     sign: Optional[str] = Field(None, description="签名")
@@ -62,21 +61,24 @@ class Group(SQLModel, table=True):
 
     __tablename__ = "group"
     id: Optional[int] = Field(None, primary_key=True)
-    name: str = Field(...)
+    name: str = Field(..., unique=True, index=True)
     description: Optional[str] = Field(None, description="本用户组的描述")
     users: List[User] = Relationship(back_populates="groups", link_model=UserGroupLink)
 
 
 class Sign(SQLModel, table=True):
     """
-    签到表 todo 这东西要加锁吗？
+    签到表，每个用户每月一行，只放最近的几年，更早的压缩进SignArchive，见pyforum.signs
+    PostgreSQL上按year分区，主键要包含分区键
     """
 
     __tablename__ = "sign"
-    id: Optional[int] = Field(None, primary_key=True)
-    user_id: int = Field(..., description="那个用户", foreign_key="user.id")
-    year: int = Field(..., description="年份")
-    month: int = Field(..., description="月份")
+    __table_args__ = {"postgresql_partition_by": "RANGE (year)"}
+    user_id: int = Field(
+        ..., description="那个用户", foreign_key="user.id", primary_key=True
+    )
+    year: int = Field(..., description="年份", primary_key=True)
+    month: int = Field(..., description="月份", primary_key=True)
     data: Optional[int] = Field(
         0, description="一个4字节的int一共有32位，存储一个月至多31天的签到数据，对应的位如果是1就表示当天有签到"
     )
@@ -119,6 +121,17 @@ class Sign(SQLModel, table=True):
         return a.tolist()
 
 
+class SignArchive(SQLModel, table=True):
+    """
+    归档的签到，每个用户每年一行，366位按一年中的第几天存
+    """
+
+    __tablename__ = "sign_archive"
+    user_id: int = Field(..., foreign_key="user.id", primary_key=True)
+    year: int = Field(..., primary_key=True)
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
 class Item(SQLModel, table=True):
     """
     用户拥有的物品（权限也是
@@ -126,7 +139,7 @@ class Item(SQLModel, table=True):
 
     __tablename__ = "item"
     id: Optional[int] = Field(None, primary_key=True)
-    name: str = Field(...)
+    name: str = Field(..., unique=True, index=True)
     description: Optional[str] = Field(None, description="对物品的描述")
 
     user_item_link: List["UserItemLink"] = Relationship(
@@ -146,7 +159,7 @@ class UserItemLink(SQLModel, table=True):
         default=None, foreign_key="user.id", primary_key=True
     )
     item_id: Optional[int] = Field(
-        default=None, foreign_key="item.id", primary_key=True
+        default=None, foreign_key="item.id", primary_key=True, index=True
     )
     count: int = Field(default=1, description="物品数量")
 
@@ -163,7 +176,7 @@ class Thread(SQLModel, table=True):
 
     __tablename__ = "thread"
     id: Optional[int] = Field(None, primary_key=True)
-    name: str = Field(..., alias="title")
+    name: str = Field(..., alias="title", unique=True, index=True)
     description: str = Field(..., description="描述")
 
     auths: List["ThreadAuth"] = Relationship(back_populates="thread")
@@ -177,8 +190,8 @@ class ThreadAuth(SQLModel, table=True):
 
     __tablename__ = "thread_auth"
     id: Optional[int] = Field(None, primary_key=True)
-    thread_id: Optional[int] = Field(None, foreign_key="thread.id")
-    item_id: int = Field(..., foreign_key="item.id")
+    thread_id: Optional[int] = Field(None, foreign_key="thread.id", index=True)
+    item_id: int = Field(..., foreign_key="item.id", index=True)
     count: int = Field(default=0, description="大于这个数才允许访问")
 
     thread: Thread = Relationship(back_populates="auths")
@@ -191,6 +204,9 @@ class Read(SQLModel, table=True):
     """
 
     __tablename__ = "read"
+    __table_args__ = (
+        Index("ix_read_thread_id_create_time", "thread_id", "create_time"),
+    )
     id: Optional[int] = Field(None, primary_key=True)
     user_id: int = Field(..., foreign_key="user.id", description="发帖人")
     thread_id: int = Field(..., foreign_key="thread.id", description="哪个板块的帖子")
@@ -203,6 +219,8 @@ class Read(SQLModel, table=True):
         description="更新时间",
         sa_column=Column(DateTime(), onupdate=partial(datetime.now, tz=tz)),
     )
+    views: int = Field(0, description="浏览数，pyforum.counters定期从redis写回，不含还没写回的")
+    visitors: int = Field(0, description="独立访客数，HyperLogLog估计的")
 
     user: User = Relationship(back_populates="reads")  # 发帖人
     thread: Thread = Relationship(back_populates="reads")  # 所属板块
@@ -216,14 +234,39 @@ class ReadAuth(SQLModel, table=True):
 
     __tablename__ = "read_auth"
     id: Optional[int] = Field(None, primary_key=True)
-    read_id: Optional[int] = Field(None, foreign_key="read.id")
-    item_id: int = Field(..., foreign_key="item.id")
+    read_id: Optional[int] = Field(None, foreign_key="read.id", index=True)
+    item_id: int = Field(..., foreign_key="item.id", index=True)
     count: int = Field(default=0, description="大于这个数才允许访问")
 
     read: Read = Relationship(back_populates="auths")
     item: Item = Relationship(back_populates="read_auths")
 
 
+class ThreadSeen(SQLModel, table=True):
+    """
+    用户{user_id}上次看板块{thread_id}时，板块里已经有{seen}个帖子，由pyforum.unread从redis写回
+    """
+
+    __tablename__ = "thread_seen"
+    user_id: int = Field(..., foreign_key="user.id", primary_key=True)
+    thread_id: int = Field(
+        ..., foreign_key="thread.id", ondelete="CASCADE", primary_key=True
+    )
+    seen: int = Field(0, description="板块的帖子序号，见pyforum.unread")
+
+
+class LoginHistory(SQLModel, table=True):
+    """
+    登录记录，由pyforum.loginlog批量写入
+    """
+
+    __tablename__ = "login_history"
+    id: Optional[int] = Field(None, primary_key=True)
+    user_id: int = Field(..., foreign_key="user.id", index=True)
+    ip: Optional[str] = Field(None, description="登录的ip")
+    login_time: datetime = Field(..., description="登录时间")
+
+
 class ViewAddress(SQLModel, table=True):
     """
     巡礼位置
@@ -231,7 +274,7 @@ class ViewAddress(SQLModel, table=True):
 
     __tablename__ = "address"
     id: Optional[int] = Field(None, primary_key=True)
-    name: str = Field(..., description="名字")
+    name: str = Field(..., description="名字", unique=True, index=True)
     author_id: Optional[int] = Field(None, foreign_key="user.id", description="上传者")
     position: str = Field(sa_column=Column(Geometry("POINT")), description="")
     description: str = Field(..., description="描述")
@@ -254,6 +297,8 @@ class ViewAddress(SQLModel, table=True):
 
 
 async def init_db():
+    from sqlalchemy.ext.asyncio import create_async_engine
+
     sqlite_file_name = "data.db"
     sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
     engine = create_async_engine(sqlite_url, echo=True)
@@ -263,7 +308,9 @@ async def init_db():
 
 
 async def test_query():
-    from sqlmodel import func, select
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel import select
+    from sqlmodel.ext.asyncio.session import AsyncSession
 
     sqlite_file_name = "data.db"
     sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn preload_app时，在master里fork之前预热，见gunicorn.conf.py
+
+目录缓存、验证码字体、bcrypt后端、openapi schema都在master里准备好，worker fork之后直接共享这些页面，
+最后gc.freeze()把它们移出gc的追踪，免得worker里的gc遍历时写引用计数导致copy-on-write。
+数据库连接池和redis连接都在worker的lifespan里才创建，这里用完的临时连接在fork之前全部关掉。
+"""
+import asyncio
+import gc
+import traceback
+
+from fastapi import FastAPI
+from redis.asyncio import from_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.catalog import get_version, load_catalog, set_catalog
+from pyforum.config import settings
+from pyforum.utils import get_image_captcha, pwd_context
+
+
+async def _load_catalog():
+    engine = create_async_engine(
+        settings.sqlite or str(settings.pg_dsn), poolclass=NullPool
+    )
+    redis = from_url(str(settings.redis_dsn))
+    try:
+        async with AsyncSession(engine) as session:
+            set_catalog(await load_catalog(session, await get_version(redis)))
+    finally:
+        await redis.close()
+        await engine.dispose()
+
+
+def warmup(app: FastAPI):
+    try:
+        asyncio.run(_load_catalog())
+    except Exception:  # 数据库暂时连不上也不影响启动，worker第一次用到时再加载
+        traceback.print_exc()
+    get_image_captcha()
+    pwd_context.load().handler("bcrypt").get_backend()
+    app.openapi()
+    gc.collect()
+    gc.freeze()
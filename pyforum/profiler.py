@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+慢请求采样分析
+
+按settings.profile_rate抽样请求，抽中的请求由一个后台线程每隔profile_interval毫秒
+看一眼事件循环线程的调用栈：正在运行的是这个请求的task就记下真实调用栈，
+挂起的话就记下它正在await的协程链，末尾加<await>（等数据库、redis的时间都在这里）。
+超过profile_threshold毫秒的请求把collapsed stacks写到profile_dir，可以直接喂给flamegraph.pl/speedscope，
+目录里最多留profile_keep份。没有请求被抽中时采样线程一直睡着，不占cpu。
+"""
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Dict, List, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from pyforum.config import settings
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _running_stack(frame, root) -> str:
+    """从栈顶往下走到task的最外层协程为止，root-first"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def _await_stack(task: asyncio.Task) -> str:
+    names = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        names.append(_frame_name(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    names.append("<await>")
+    return ";".join(names)
+
+
+class Sampler:
+    """只采样注册过的task，同一时刻可以有多个请求在被采样"""
+
+    def __init__(self):
+        self.active: Dict[asyncio.Task, Counter] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """在事件循环线程里调用"""
+        if self._thread is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._run, name="pyforum-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def register(self, task: asyncio.Task) -> Counter:
+        stacks = self.active[task] = Counter()
+        self._wakeup.set()
+        return stacks
+
+    def unregister(self, task: asyncio.Task) -> Counter:
+        return self.active.pop(task)
+
+    def _run(self):
+        while True:
+            if not self.active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(settings.profile_interval / 1000)
+            try:
+                self._sample()
+            except Exception:  # 和事件循环线程赛跑，偶尔读到一半的状态就丢掉这次采样
+                pass
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        running = asyncio.current_task(self.loop)
+        for task, stacks in list(self.active.items()):
+            if task is running and frame is not None:
+                stacks[_running_stack(frame, task.get_coro().cr_frame)] += 1
+            else:
+                stacks[_await_stack(task)] += 1
+
+
+sampler = Sampler()
+
+_unsafe = re.compile(r"[^0-9A-Za-z_.-]+")
+
+
+def _save(name: str, stacks: Counter):
+    directory = Path(settings.profile_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp = directory / (name + ".tmp")
+    tmp.write_text(
+        "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()),
+        encoding="utf-8",
+    )
+    tmp.rename(directory / name)  # 别让列表接口看到写了一半的文件
+    files = sorted(directory.glob("*.collapsed"), key=lambda p: p.stat().st_mtime)
+    for old in files[: max(len(files) - settings.profile_keep, 0)]:
+        old.unlink(missing_ok=True)  # 别的worker可能已经删了
+
+
+def list_profiles() -> List[dict]:
+    directory = Path(settings.profile_dir)
+    if not directory.is_dir():
+        return []
+    ret = []
+    for path in directory.glob("*.collapsed"):
+        stat = path.stat()
+        ret.append({"name": path.name, "size": stat.st_size, "time": stat.st_mtime})
+    ret.sort(key=lambda d: d["time"], reverse=True)
+    return ret
+
+
+def get_profile_path(name: str) -> Optional[Path]:
+    """只认目录里真实存在的文件名，防止../"""
+    if name != Path(name).name or not name.endswith(".collapsed"):
+        return None
+    path = Path(settings.profile_dir) / name
+    if path.is_file():
+        return path
+
+
+class ProfilerMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or random.random() >= settings.profile_rate:
+            await self.app(scope, receive, send)
+            return
+        sampler.start()
+        task = asyncio.current_task()
+        sampler.register(task)
+        start = perf_counter_ns()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stacks = sampler.unregister(task)
+            elapsed_ms = (perf_counter_ns() - start) // 1_000_000
+            if elapsed_ms >= settings.profile_threshold and stacks:
+                route = getattr(scope.get("route"), "path", scope["path"])
+                name = "{}-{}-{}-{}-{}ms.collapsed".format(
+                    time.time_ns(),
+                    os.getpid(),
+                    scope["method"],
+                    _unsafe.sub("_", route).strip("_") or "root",
+                    elapsed_ms,
+                )
+                await asyncio.to_thread(_save, name, stacks)
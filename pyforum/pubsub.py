@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+每个worker一条redis pub/sub连接，各模块在上面注册自己的频道
+
+    hub.subscribe("memory:command", handler)
+    hub.psubscribe("push:*", handler)  # 频道是动态的时候，handler多收一个频道名
+
+handler是普通函数，收到消息时在读消息的协程里直接调用，不能阻塞，耗时的工作自己create_task。
+连接断了会重连，重连之后调用注册时给的reset，断线期间的消息已经丢了，缓存之类的要自己清掉。
+lifespan里start/stop。
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[bytes], None]
+PatternHandler = Callable[[str, bytes], None]
+
+
+class Hub:
+    def __init__(self):
+        self.handlers: Dict[
+            str, List[Tuple[Handler, Optional[Callable[[], None]]]]
+        ] = {}
+        self.patterns: Dict[
+            str, List[Tuple[PatternHandler, Optional[Callable[[], None]]]]
+        ] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.redis: Optional[Redis] = None  # handler里要回复时用
+
+    def subscribe(
+        self, channel: str, handler: Handler, reset: Optional[Callable[[], None]] = None
+    ):
+        """在start之前注册"""
+        self.handlers.setdefault(channel, []).append((handler, reset))
+
+    def psubscribe(
+        self,
+        pattern: str,
+        handler: PatternHandler,
+        reset: Optional[Callable[[], None]] = None,
+    ):
+        """在start之前注册，匹配pattern的频道都交给handler"""
+        self.patterns.setdefault(pattern, []).append((handler, reset))
+
+    def start(self, redis: Redis):
+        self.redis = redis
+        self.task = asyncio.create_task(self._run(redis))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def _dispatch(self, message: dict):
+        channel = message["channel"].decode()
+        for handler, _ in self.handlers.get(channel, ()):
+            try:
+                handler(message["data"])
+            except Exception:
+                logger.exception("pubsub handler for %s failed", channel)
+
+    def _pdispatch(self, message: dict):
+        pattern = message["pattern"].decode()
+        channel = message["channel"].decode()
+        for handler, _ in self.patterns.get(pattern, ()):
+            try:
+                handler(channel, message["data"])
+            except Exception:
+                logger.exception("pubsub handler for %s failed", channel)
+
+    async def _serve(self, redis: Redis):
+        pubsub = redis.pubsub()
+        try:
+            if self.handlers:
+                await pubsub.subscribe(*self.handlers)
+            if self.patterns:
+                await pubsub.psubscribe(*self.patterns)
+            for handlers in (*self.handlers.values(), *self.patterns.values()):
+                for _, reset in handlers:
+                    if reset is not None:
+                        reset()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    self._dispatch(message)
+                elif message["type"] == "pmessage":
+                    self._pdispatch(message)
+        finally:
+            await pubsub.close()
+
+    async def _run(self, redis: Redis):
+        if not self.handlers and not self.patterns:
+            return
+        while True:
+            try:
+                await self._serve(redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("pubsub connection failed, reconnecting")
+                await asyncio.sleep(1)
+
+
+hub = Hub()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+实时推送
+
+频道：
+    {push_prefix}all          目录变了（板块、物品、用户组），客户端重新拉 /api/v1/thread/
+    {push_prefix}thread:{id}  板块里有新帖、板块被修改或删除
+    {push_prefix}user:{id}    用户的资料、物品、用户组变了；发完这条就断开，客户端重连时按新的权限订阅
+消息是json，publish时序列化一次，之后原样转发给每个连接。
+
+每个worker只有pyforum.pubsub里那一条redis连接，PSUBSCRIBE {push_prefix}*，连接多少都不会多占redis连接；
+本进程里按频道名找到订阅者，放进各自的队列。每个连接只有一个发送的协程，不另开任务也不占数据库连接，
+断线靠心跳或下一条消息发送失败发现。心跳由一个协程统一放进所有队列，不用每个连接一个定时器。
+    背压  队列超过push_queue_size条，或者一次发送超过push_send_timeout秒，就断开这个慢连接，客户端重连后重新拉
+    上限  每个worker最多push_max_connections个连接，再多的直接拒绝
+redis断线重连后，期间的消息已经丢了，给每个连接发一条reset，客户端自己重新拉。
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+import orjson
+from redis.asyncio import Redis
+
+from pyforum.config import settings
+from pyforum.pubsub import hub
+
+PING = b'{"type":"ping"}'
+RESET = b'{"type":"reset"}'
+
+
+class SlowConsumer(Exception):
+    """队列满了，或者是用户频道的消息，要断开"""
+
+
+class Subscriber:
+    __slots__ = ("channels", "queue", "event", "closing")
+
+    def __init__(self, channels: List[str]):
+        self.channels = channels
+        self.queue: Deque[bytes] = deque()
+        self.event = asyncio.Event()
+        self.closing = False  # 队列里剩下的发完就断开
+
+    def put(self, data: bytes, last: bool = False):
+        if self.closing and not self.queue:
+            return
+        if len(self.queue) >= settings.push_queue_size:
+            self.queue.clear()
+            self.closing = True  # 慢消费者，不用再发了
+        else:
+            self.queue.append(data)
+            self.closing = self.closing or last
+        self.event.set()
+
+    async def get(self) -> List[bytes]:
+        """取出队列里全部的消息，该断开的时候抛SlowConsumer"""
+        while not self.queue:
+            if self.closing:
+                raise SlowConsumer
+            self.event.clear()
+            await self.event.wait()
+        items = list(self.queue)
+        self.queue.clear()
+        return items
+
+
+_subscribers: Dict[str, Set[Subscriber]] = {}
+connections = 0
+
+
+def all_channel() -> str:
+    return f"{settings.push_prefix}all"
+
+
+def thread_channel(thread_id: int) -> str:
+    return f"{settings.push_prefix}thread:{thread_id}"
+
+
+def user_channel(user_id: int) -> str:
+    return f"{settings.push_prefix}user:{user_id}"
+
+
+def full() -> bool:
+    return connections >= settings.push_max_connections
+
+
+def add(channels: List[str]) -> Subscriber:
+    """注册一个连接，channels之外总是订阅all"""
+    global connections
+    sub = Subscriber([all_channel(), *channels])
+    for channel in sub.channels:
+        _subscribers.setdefault(channel, set()).add(sub)
+    connections += 1
+    return sub
+
+
+def remove(sub: Subscriber):
+    global connections
+    for channel in sub.channels:
+        subs = _subscribers.get(channel)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del _subscribers[channel]
+    connections -= 1
+
+
+def _on_message(channel: str, data: bytes):
+    subs = _subscribers.get(channel)
+    if not subs:
+        return
+    last = channel.startswith(f"{settings.push_prefix}user:")
+    for sub in subs:
+        sub.put(data, last)
+
+
+def _reset():
+    for sub in _subscribers.get(all_channel(), ()):  # 每个连接都订阅了all
+        sub.put(RESET)
+
+
+hub.psubscribe(f"{settings.push_prefix}*", _on_message, _reset)
+
+
+async def heartbeat_forever():
+    while True:
+        await asyncio.sleep(settings.push_heartbeat)
+        for sub in _subscribers.get(all_channel(), ()):
+            sub.put(PING)
+
+
+async def publish(redis: Redis, channel: str, event: dict):
+    await redis.publish(channel, orjson.dumps(event))
+
+
+async def publish_thread(redis: Redis, thread_id: int, event: dict):
+    await publish(redis, thread_channel(thread_id), {"thread_id": thread_id, **event})
+
+
+async def publish_user(redis: Redis, user_id: int, event: Optional[dict] = None):
+    await publish(redis, user_channel(user_id), {"type": "user", **(event or {})})
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+sql预算和N+1检测，开发/CI用，由settings.query_debug开启
+
+每个请求记录执行过的sql指纹，同一指纹重复出现就认为是N+1；
+路由可以用 @query_budget(n) 声明最多执行几条sql，超出时写日志，query_budget_strict时返回500让测试失败
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from pyforum.config import settings
+from pyforum.exceptions import QueryBudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# PostgreSQL的$1在_literal那一步已经变成了$?
+_placeholder_list = re.compile(r"\((?:\s*(?:\?|%s|\$\?|:\w+)\s*,?)+\)")
+_space = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """去掉字面量、把IN (?, ?, ?)合并，剩下的就是这条sql的形状"""
+    statement = _literal.sub("?", statement)
+    statement = _placeholder_list.sub("(...)", statement)
+    return _space.sub(" ", statement).strip()
+
+
+class QueryRecorder:
+    __slots__ = ("fingerprints",)
+
+    def __init__(self):
+        self.fingerprints: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def record(self, statement: str):
+        self.fingerprints.append(fingerprint(statement))
+
+    def repeated(self, threshold: Optional[int] = None) -> Dict[str, int]:
+        """出现次数不少于threshold的指纹"""
+        threshold = threshold or settings.query_repeat_threshold
+        return {
+            sql: n for sql, n in Counter(self.fingerprints).items() if n >= threshold
+        }
+
+    def summary(self) -> str:
+        lines = [f"{len(self)} queries"]
+        for sql, n in self.repeated().items():
+            lines.append(f"  N+1? {n}x {sql}")
+        return "\n".join(lines)
+
+
+_recorder: ContextVar[Optional[QueryRecorder]] = ContextVar(
+    "query_recorder", default=None
+)
+
+
+@contextmanager
+def record_queries() -> Iterator[QueryRecorder]:
+    """
+    记录with块内执行的sql，测试里也可以直接用
+        with record_queries() as rec:
+            await user_get_item(session, 1)
+        assert len(rec) <= 1
+    """
+    recorder = QueryRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def query_budget(count: int):
+    """
+    声明路由最多执行多少条sql（包括依赖里的），放在@router.xxx下面
+    """
+
+    def deco(func):
+        func.__query_budget__ = count
+        return func
+
+    return deco
+
+
+_SAVEPOINT = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _(conn, cursor, statement, parameters, context, executemany):
+        recorder = _recorder.get()
+        # sqlite生产模式下每个session都包在SAVEPOINT里，不算
+        if recorder is not None and not statement.startswith(_SAVEPOINT):
+            recorder.record(statement)
+
+
+def _over_budget(scope: Scope, recorder: QueryRecorder) -> Optional[str]:
+    route = scope.get("route")
+    budget = getattr(getattr(route, "endpoint", None), "__query_budget__", None)
+    if budget is None or len(recorder) <= budget:
+        return None
+    path = getattr(route, "path", scope["path"])
+    return f"{scope['method']} {path} 执行了{len(recorder)}条sql，超出预算{budget}\n{recorder.summary()}"
+
+
+async def _send_error(send: Send, msg: str):
+    body = msg.encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 500,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class QueryBudgetMiddleware:
+    """
+    响应头带上X-Query-Count，有N+1时带X-Query-Repeated，详细的写日志
+    query_budget_strict时在响应发出去之前检查预算，超出的换成500，客户端（测试）一定能看到
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rejected: Optional[str] = None
+        with record_queries() as recorder:
+
+            async def send_wrapper(message: Message):
+                nonlocal rejected
+                if rejected is not None:
+                    return  # 原来的响应不要了
+                if message["type"] == "http.response.start":
+                    if settings.query_budget_strict:
+                        rejected = _over_budget(scope, recorder)
+                        if rejected is not None:
+                            await _send_error(send, rejected)
+                            return
+                    headers = MutableHeaders(scope=message)
+                    headers["X-Query-Count"] = str(len(recorder))
+                    if repeated := recorder.repeated():
+                        headers["X-Query-Repeated"] = str(sum(repeated.values()))
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+        route = scope.get("route")
+        path = getattr(route, "path", scope["path"])
+        if recorder.repeated():
+            logger.warning("%s %s %s", scope["method"], path, recorder.summary())
+        if rejected is not None:
+            logger.error(rejected)
+            return
+        exceeded = _over_budget(scope, recorder)
+        if exceeded is not None:
+            if settings.query_budget_strict:  # 流式响应，开始发了之后才超出
+                raise QueryBudgetExceeded(exceeded)
+            logger.warning(exceeded)
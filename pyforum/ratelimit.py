@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+限流，防止被刷验证码、邮件、bcrypt
+
+每个路由的规则在settings.ratelimit_rules里配置，例如 "ip:30/60,account:10/600"
+表示同一个ip 60秒内最多30次，同一个账号600秒内最多10次。维度有ip、session、account。
+
+用的是滑动窗口计数：当前窗口的计数 + 上一个窗口的计数 * 上一个窗口还剩在滑动窗口里的比例。
+一个请求的全部规则在一个lua脚本里检查并计数，都通过才计数。
+被redis拒绝过的客户端在当前窗口结束前直接在本进程拒绝，不再访问redis。
+在路由的最开头调用，渲染验证码、发邮件、算bcrypt之前就拒绝掉。
+"""
+import hashlib
+import math
+from functools import lru_cache
+from time import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+
+from pyforum.config import settings
+
+# KEYS每条规则两个：当前窗口、上一个窗口
+# ARGV每条规则三个：上限、窗口秒数、上一个窗口的权重
+# 返回0表示通过，否则是第几条规则不通过
+_LUA = """
+local n = #KEYS / 2
+for i = 1, n do
+    local cur = tonumber(redis.call('GET', KEYS[2 * i - 1]) or '0')
+    local prev = tonumber(redis.call('GET', KEYS[2 * i]) or '0')
+    if cur + prev * tonumber(ARGV[3 * i]) + 1 > tonumber(ARGV[3 * i - 2]) then
+        return i
+    end
+end
+for i = 1, n do
+    redis.call('INCR', KEYS[2 * i - 1])
+    redis.call('EXPIRE', KEYS[2 * i - 1], tonumber(ARGV[3 * i - 1]) * 2)
+end
+return 0
+"""
+
+
+class Rule:
+    __slots__ = ("dim", "limit", "window")
+
+    def __init__(self, dim: str, limit: int, window: int):
+        self.dim = dim
+        self.limit = limit
+        self.window = window
+
+
+@lru_cache
+def rules_for(name: str) -> Tuple[Rule, ...]:
+    rules = []
+    for spec in settings.ratelimit_rules.get(name, "").split(","):
+        if not spec.strip():
+            continue
+        dim, _, rate = spec.strip().partition(":")
+        limit, _, window = rate.partition("/")
+        rules.append(Rule(dim, int(limit), int(window)))
+    return tuple(rules)
+
+
+_script: Optional[AsyncScript] = None
+_blocked: Dict[str, float] = {}  # key -> 本进程直接拒绝到什么时候
+
+
+def _reject(retry_after: float):
+    raise HTTPException(
+        status_code=429,
+        detail="too many requests",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+def _block(key: str, until: float):
+    if len(_blocked) >= settings.ratelimit_local_size:
+        now = time()
+        for k in [k for k, v in _blocked.items() if v <= now]:
+            del _blocked[k]
+        if len(_blocked) >= settings.ratelimit_local_size:
+            _blocked.clear()  # 全是还在封禁期的，说明被大量刷，清掉交给redis
+    _blocked[key] = until
+
+
+async def check_rate_limit(
+    request: Request, redis: Redis, name: str, account: Optional[str] = None
+):
+    """
+    超出限制时抛429
+    :param name: settings.ratelimit_rules里的路由名
+    :param account: 登录名或者邮箱，没有的话只按ip和session限制
+    """
+    global _script
+    if not settings.ratelimit_enabled or not (rules := rules_for(name)):
+        return
+    handler = request.scope.get("session_handler")
+    values = {
+        "ip": request.client.host if request.client else None,
+        "session": handler.session_id if handler is not None else None,
+        "account": hashlib.sha1(account.lower().encode()).hexdigest()[:16]
+        if account
+        else None,
+    }
+    now = time()
+    keys, args, active = [], [], []
+    for rule in rules:
+        value = values.get(rule.dim)
+        if value is None:
+            continue
+        base = f"{settings.ratelimit_prefix}{name}:{rule.dim}:{value}:{rule.window}"
+        until = _blocked.get(base)
+        if until is not None:
+            if until > now:
+                _reject(until - now)
+            del _blocked[base]
+        index, elapsed = divmod(int(now), rule.window)
+        keys += [f"{base}:{index}", f"{base}:{index - 1}"]
+        args += [rule.limit, rule.window, 1 - elapsed / rule.window]
+        active.append((base, (index + 1) * rule.window))
+    if not keys:
+        return
+    if _script is None:
+        _script = redis.register_script(_LUA)
+    violated = await _script(keys=keys, args=args, client=redis)
+    if violated:
+        base, until = active[violated - 1]
+        _block(base, until)
+        _reject(until - now)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+只读副本的路由
+
+配置了settings.replica_dsns时，只读的路由用pyforum.depends.get_read_session拿到的session：
+    每个session选一个健康的副本，轮流选
+    一旦flush、执行了写语句或者SELECT ... FOR UPDATE，这个session之后都走主库，能读到自己刚写的
+后台每replica_check_interval秒检查一次各副本，连不上或者复制延迟超过replica_max_lag秒的先不用，
+全部不可用时回到主库，给了fallback的话回到fallback（sqlite生产模式是只读连接池，写连接只给SQLiteWriter用）。
+要写的路由、先读后写的路由（读到副本的旧数据再写回会丢更新）继续用get_db_session，只连主库。
+本地可以用两个sqlite文件测试，sqlite没有复制延迟，只检查能不能连上。
+"""
+import asyncio
+import itertools
+import logging
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql.dml import UpdateBase
+from sqlmodel.orm.session import Session
+
+from pyforum.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 各数据库查复制延迟（秒）的sql，主库上执行也返回0
+_LAG_SQL = {
+    "postgresql": """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """,
+}
+
+
+class Replica:
+    __slots__ = ("engine", "healthy", "lag")
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.healthy = False  # 检查过一次才用
+        self.lag: Optional[float] = None
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        primary: AsyncEngine,
+        replicas: List[AsyncEngine],
+        fallback: Optional[AsyncEngine] = None,
+    ):
+        self.primary = primary
+        self.fallback = fallback or primary
+        self.replicas = [Replica(engine) for engine in replicas]
+        self.healthy: List[Replica] = []
+        self._counter = itertools.count()
+
+    def pick(self) -> AsyncEngine:
+        """轮流选一个健康的副本，没有就用fallback（默认是主库）"""
+        healthy = self.healthy
+        if not healthy:
+            return self.fallback
+        return healthy[next(self._counter) % len(healthy)].engine
+
+    async def _probe(self, replica: Replica):
+        sql = _LAG_SQL.get(replica.engine.dialect.name, "SELECT 0")
+        try:
+            async with replica.engine.connect() as conn:
+                replica.lag = float(
+                    await asyncio.wait_for(
+                        conn.scalar(text(sql)), settings.replica_check_timeout
+                    )
+                    or 0
+                )
+            replica.healthy = replica.lag <= settings.replica_max_lag
+        except Exception as e:
+            if replica.healthy:
+                logger.warning("replica %s is down: %r", replica.engine.url, e)
+            replica.healthy, replica.lag = False, None
+
+    async def check(self):
+        await asyncio.gather(*(self._probe(replica) for replica in self.replicas))
+        self.healthy = [replica for replica in self.replicas if replica.healthy]
+
+    async def check_forever(self):
+        while True:
+            await asyncio.sleep(settings.replica_check_interval)
+            await self.check()
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+class RoutingSession(Session):
+    """AsyncSession(sync_session_class=RoutingSession, router=router)"""
+
+    def __init__(self, *args, router: ReplicaRouter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self.pinned = router is None  # 写过之后一直用主库
+        self.replica: Optional[Engine] = None  # 同一个session的查询都发给同一个副本
+
+    def get_bind(self, mapper=None, clause=None, **kwargs) -> Engine:
+        if not self.pinned and (
+            self._flushing
+            or isinstance(clause, UpdateBase)
+            or getattr(clause, "_for_update_arg", None) is not None
+        ):
+            self.pinned = True
+        if self.pinned:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        if self.replica is None:
+            self.replica = self.router.pick().sync_engine
+        return self.replica
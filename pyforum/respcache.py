@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+GET接口的响应缓存，主要给匿名用户用
+
+路由用 @cache_response("tag", ...) 声明可以缓存，中间件把最终的响应字节存在redis和本进程里，
+key是 路径 + 排好序的query + 权限类别 + 各tag的版本号：
+    权限类别  匿名用户是anon，登录用户是他拥有的物品(item_id, count)的哈希，物品一样的人看到的内容一样；
+             算一次要查一次数据库，按session记住respcache_check_interval秒，给用户发的物品最多晚这么久生效
+    tag版本  管理员改了东西就invalidate_tags(redis, tag)，INCR版本号，旧的key自然用不上了；
+             各worker最多每respcache_check_interval秒看一次版本号，和目录缓存一样
+过期后respcache_stale秒内先返回旧的，后台刷新（redis锁保证只有一个worker去刷）；
+完全没有缓存时同一个worker里同样的请求只有一个真正去执行，其他的等它的结果。
+响应带ETag，If-None-Match对上了直接304。
+路由的第一个请求照常执行，执行完才知道这个路径对应哪个路由，之后的才走缓存。
+"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+from time import monotonic, time
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import orjson
+from redis.asyncio import Redis
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from pyforum.config import settings
+from pyforum.models import UserItemLink
+from pyforum.replicas import RoutingSession
+from pyforum.sessions import read_session
+from pyforum.singleflight import SingleFlight
+
+
+class CachePolicy:
+    __slots__ = ("tags", "permission")
+
+    def __init__(self, tags: Tuple[str, ...], permission: bool):
+        self.tags = tags
+        self.permission = permission
+
+
+def cache_response(*tags: str, permission: bool = True):
+    """
+    声明路由的响应可以缓存，放在@router.get下面
+    :param tags: 哪些数据变了之后要失效
+    :param permission: 内容是否和用户的物品（权限）有关，无关的话所有人共用一份
+    """
+
+    def deco(func):
+        func.__cache_policy__ = CachePolicy(tags, permission)
+        return func
+
+    return deco
+
+
+class Entry:
+    __slots__ = ("status", "headers", "body", "etag", "created")
+
+    def __init__(
+        self,
+        status: int,
+        headers: List[Tuple[bytes, bytes]],
+        body: bytes,
+        etag: Optional[str],
+        created: float,
+    ):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.created = created
+
+    def age(self) -> float:
+        return time() - self.created
+
+
+_local: "OrderedDict[str, Entry]" = OrderedDict()
+_tag_versions: Dict[str, int] = {}
+_tags_checked_at = 0.0
+# session_id -> (user_id, 权限类别, 算的时间)
+_perms: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+
+
+def _tag_key(tag: str) -> str:
+    return f"{settings.respcache_prefix}tag:{tag}"
+
+
+async def get_tag_versions(redis: Redis, tags: Tuple[str, ...]) -> List[int]:
+    global _tags_checked_at
+    if not tags:
+        return []
+    if (
+        any(tag not in _tag_versions for tag in tags)
+        or monotonic() - _tags_checked_at >= settings.respcache_check_interval
+    ):
+        names = sorted(set(_tag_versions) | set(tags))
+        values = await redis.mget([_tag_key(tag) for tag in names])
+        _tag_versions.update(zip(names, (int(v or 0) for v in values)))
+        _tags_checked_at = monotonic()
+    return [_tag_versions[tag] for tag in tags]
+
+
+async def invalidate_tags(redis: Redis, *tags: str):
+    """数据变了之后调用，本worker立刻失效，其他worker最多respcache_check_interval秒后失效"""
+    async with redis.pipeline(transaction=False) as pipe:
+        for tag in tags:
+            pipe.incr(_tag_key(tag))
+        versions = await pipe.execute()
+    _tag_versions.update(zip(tags, versions))
+
+
+async def permission_class(scope: Scope) -> str:
+    user_id = (await read_session(scope)).get("user_id")
+    if user_id is None:
+        return "anon"
+    session_id = scope["session_handler"].session_id
+    cached = _perms.get(session_id)
+    if (
+        cached is not None
+        and cached[0] == user_id
+        and monotonic() - cached[2] < settings.respcache_check_interval
+    ):
+        return cached[1]
+    async with AsyncSession(
+        scope["state"]["sqla"],
+        sync_session_class=RoutingSession,
+        router=scope["state"]["replicas"],
+    ) as session:
+        owned = (
+            await session.exec(
+                select(UserItemLink.item_id, UserItemLink.count)
+                .where(UserItemLink.user_id == user_id)
+                .order_by(UserItemLink.item_id)
+            )
+        ).all()
+    perm = hashlib.sha1(orjson.dumps([tuple(o) for o in owned])).hexdigest()[:16]
+    _perms[session_id] = (user_id, perm, monotonic())
+    _perms.move_to_end(session_id)
+    while len(_perms) > settings.respcache_local_size:
+        _perms.popitem(last=False)
+    return perm
+
+
+def _local_get(key: str) -> Optional[Entry]:
+    entry = _local.get(key)
+    if entry is not None:
+        _local.move_to_end(key)
+    return entry
+
+
+def _local_set(key: str, entry: Entry):
+    _local[key] = entry
+    _local.move_to_end(key)
+    while len(_local) > settings.respcache_local_size:
+        _local.popitem(last=False)
+
+
+async def _load(redis: Redis, key: str) -> Optional[Entry]:
+    entry = _local_get(key)
+    if entry is not None:
+        return entry
+    data = await redis.get(key)
+    if data is None:
+        return None
+    meta, body = data.split(b"\n", 1)  # orjson的输出里不会有换行
+    status, headers, etag, created = orjson.loads(meta)
+    entry = Entry(
+        status,
+        [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        body,
+        etag,
+        created,
+    )
+    _local_set(key, entry)
+    return entry
+
+
+async def _store(redis: Redis, key: str, entry: Entry):
+    _local_set(key, entry)
+    meta = orjson.dumps(
+        [
+            entry.status,
+            [(k.decode("latin-1"), v.decode("latin-1")) for k, v in entry.headers],
+            entry.etag,
+            entry.created,
+        ]
+    )
+    data = meta + b"\n" + entry.body
+    await redis.set(
+        key, data, ex=int(settings.respcache_ttl + settings.respcache_stale) + 1
+    )
+
+
+async def _empty_receive() -> Message:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+class ResponseCacheMiddleware:
+    """放在session中间件里面，要用session判断是不是匿名用户，缓存的路由应该声明session_policy("read")"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # path -> (route, policy) 路由执行过一次才知道，只支持没有路径参数的路由
+        self.routes: Dict[str, tuple] = {}
+        self.flight = SingleFlight("respcache")
+        self.refreshing: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        matched = self.routes.get(scope["path"])
+        if matched is None:
+            await self.app(scope, receive, send)
+            self.learn(scope)
+            return
+        route, policy = matched
+        redis: Redis = scope["state"]["redis"]
+        perm = await permission_class(scope) if policy.permission else "all"
+        versions = await get_tag_versions(redis, policy.tags)
+        query = urlencode(sorted(parse_qsl(scope["query_string"].decode("latin-1"))))
+        raw = f"{scope['path']}?{query}|{perm}|{versions}"
+        key = f"{settings.respcache_prefix}{hashlib.sha1(raw.encode()).hexdigest()}"
+
+        scope["route"] = route  # 给指标用，命中缓存时不会进路由
+        entry = await _load(redis, key)
+        if (
+            entry is None
+            or entry.age() > settings.respcache_ttl + settings.respcache_stale
+        ):
+            state = b"MISS"
+            entry = await self.fill(scope, redis, key)
+        elif entry.age() > settings.respcache_ttl:
+            state = b"STALE"
+            self.refresh(scope, redis, key)
+        else:
+            state = b"HIT"
+        await self.respond(scope, send, entry, state)
+
+    def learn(self, scope: Scope):
+        route = scope.get("route")
+        policy = getattr(getattr(route, "endpoint", None), "__cache_policy__", None)
+        if policy is not None and route.path == scope["path"]:
+            self.routes[scope["path"]] = (route, policy)
+
+    async def render(self, scope: Scope) -> Entry:
+        """执行一遍真正的路由，把响应收集起来"""
+        start: Message = {}
+        chunks: List[bytes] = []
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(dict(scope), _empty_receive, send_wrapper)
+        body = b"".join(chunks)
+        headers = [
+            (k, v)
+            for k, v in start.get("headers", [])
+            if k.lower() not in (b"content-length", b"set-cookie")
+        ]
+        etag = None
+        if start["status"] == 200:
+            etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        return Entry(start["status"], headers, body, etag, time())
+
+    async def fill(self, scope: Scope, redis: Redis, key: str) -> Entry:
+        """同一个key同时只有一个请求真正执行"""
+
+        async def run():
+            entry = await self.render(scope)
+            if entry.etag is not None:
+                await _store(redis, key, entry)
+            return entry
+
+        return await self.flight.do(key, run)
+
+    def refresh(self, scope: Scope, redis: Redis, key: str):
+        """后台刷新过期的缓存，各worker之间用redis锁去重"""
+        if key in self.refreshing:
+            return
+
+        async def run():
+            try:
+                if await redis.set(
+                    f"{key}:lock", 1, nx=True, ex=max(int(settings.respcache_ttl), 1)
+                ):
+                    entry = await self.render(scope)
+                    if entry.etag is not None:
+                        await _store(redis, key, entry)
+            finally:
+                self.refreshing.discard(key)
+
+        self.refreshing.add(key)
+        task = asyncio.create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    @staticmethod
+    async def respond(scope: Scope, send: Send, entry: Entry, state: bytes):
+        headers = list(entry.headers)
+        headers.append((b"x-cache", state))
+        body = entry.body
+        status = entry.status
+        if entry.etag is not None:
+            headers.append((b"etag", entry.etag.encode()))
+            if _etag_matches(scope, entry.etag):
+                status, body = 304, b""
+                headers = [(k, v) for k, v in headers if k.lower() != b"content-type"]
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def _etag_matches(scope: Scope, etag: str) -> bool:
+    for k, v in scope["headers"]:
+        if k == b"if-none-match":
+            tags = [t.strip() for t in v.decode("latin-1").split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+    return False
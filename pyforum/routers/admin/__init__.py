@@ -1,17 +1,26 @@
 """
 管理endpoint
 """
-import gc
 from typing import List, Literal, Optional
 
-import orjson
 from fastapi import APIRouter, Body, Depends, HTTPException, Query
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from redis.asyncio import Redis
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from pyforum import push
+from pyforum.catalog import get_catalog, invalidate_catalog
 from pyforum.config import settings
-from pyforum.depends import check_admin_or_raise, get_db_session, get_groups, get_redis
+from pyforum.depends import (
+    check_admin_or_raise,
+    get_db_session,
+    get_groups,
+    get_read_session,
+    get_redis,
+)
+from pyforum.memory import broadcast
+from pyforum.profiler import get_profile_path, list_profiles
+from pyforum.querybudget import query_budget
 from pyforum.routers.admin.crud import (
     add_item_class,
     add_thread,
@@ -43,6 +52,7 @@ from pyforum.routers.admin.models import (
     AddThread,
     AddUser,
     DelItemClass,
+    MemoryCommand,
     PatchGroup,
     PatchItemClass,
     PatchThread,
@@ -54,6 +64,13 @@ from pyforum.routers.admin.models import (
     UserDelGroup,
     UserDelItem,
 )
+from pyforum.rows import dump_rows
+from pyforum.sessions import (
+    decode_session,
+    invalidate_sessions,
+    session_id_of,
+    session_policy,
+)
 
 router = APIRouter(
     prefix="/api/v1/admin", tags=["admin"], dependencies=[Depends(check_admin_or_raise)]
@@ -66,37 +83,50 @@ router = APIRouter(
     response_class=ORJSONResponse,
     summary="如果id和name都没有则返回全部",
 )
+@session_policy("read")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
     id: Optional[int] = Query(None, description="group_id"),
     name: Optional[str] = Query(None, description="group_name"),
 ):
-    groups = await get_user_groups(session, id, name)
-    return {"msg": "ok", "groups": [g.model_dump() for g in groups]}
+    if id is None and name is None:
+        groups = list((await get_catalog(session, redis)).groups.values())
+    else:
+        groups = await get_user_groups(session, id, name)
+    return {"msg": "ok", "groups": dump_rows(groups)}
 
 
 @router.post("/user_group", description="添加用户组", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: AddGroup = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: AddGroup = Body(...),
 ):
     await add_user_group(session, body.name, body.description)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
 @router.delete("/user_group", description="删除用户组", response_class=ORJSONResponse)
 async def _(
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
     id: int = Query(..., description="group_id"),
 ):
     await del_user_groups(session, id)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
 @router.patch("/user_group", description="修改用户组", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: PatchGroup = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: PatchGroup = Body(...),
 ):
     await patch_user_group(session, body.id, body.name, body.description)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
@@ -109,15 +139,18 @@ async def _(session: AsyncSession = Depends(get_db_session), body: AddUser = Bod
 @router.delete("/user", description="删除用户", response_class=ORJSONResponse)
 async def _(
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
     id: int = Query(..., description="user_id"),
 ):
     await del_user(session, id)
+    await push.publish_user(redis, id, {"action": "delete"})
     return {"msg": "ok"}
 
 
 @router.get("/user", description="查询用户", response_class=ORJSONResponse)
+@session_policy("read")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     id: Optional[int] = Query(None, description="user_id"),
     name: Optional[str] = Query(None, description="user name"),
 ):
@@ -129,16 +162,20 @@ async def _(
 
 
 @router.patch("/user", description="修改用户", response_class=ORJSONResponse)
+@query_budget(2)  # 管理员检查 update
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: PatchUser = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: PatchUser = Body(...),
 ):
     await patch_user(session, body)
+    await push.publish_user(redis, body.id)
     return {"msg": "ok"}
 
 
 @router.post("/search", description="搜索用户或用户组", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     type: Literal["user", "group"] = Query(..., description="查询类型"),
     op: Literal["and", "or"] = Query(..., description="操作类型"),
     body: Search = Body(...),
@@ -152,15 +189,19 @@ async def _(
 
 @router.post("/user/group", description="添加用户所属的组", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: UserAddGroup = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: UserAddGroup = Body(...),
 ):
     await user_add_group(session, body.user_id, body.group_id)
+    await push.publish_user(redis, body.user_id)
     return {"msg": "ok"}
 
 
 @router.get("/user/group", description="获取用户所属的组", response_class=ORJSONResponse)
+@session_policy("read")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     id: int = Query(..., description=""),
 ):
     groups = await user_get_group(session, id)
@@ -169,9 +210,12 @@ async def _(
 
 @router.delete("/user/group", description="删除用户所属的组", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: UserDelGroup = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: UserDelGroup = Body(...),
 ):
     await user_del_group(session, body.user_id, body.group_id)
+    await push.publish_user(redis, body.user_id)
     return {"msg": "ok"}
 
 
@@ -180,10 +224,13 @@ async def _(redis: Redis = Depends(get_redis), body: UserDelCookie = Body(...)):
     find = []
     async for key in redis.scan_iter(settings.session_prefix + "*", 10):
         cookie = await redis.get(key)
-        cookie_dict = orjson.loads(cookie)
-        if cookie_dict["user_id"] == body.id:
+        cookie_dict = decode_session(cookie)
+        if cookie_dict.get("user_id") == body.id:
             find.append(key)
-    await redis.delete(*find)
+    if find:
+        await redis.delete(*find)
+        await invalidate_sessions(redis, map(session_id_of, find))
+    await push.publish_user(redis, body.id, {"action": "logout"})  # 推送连接也断开
     return {"msg": "ok"}
 
 
@@ -192,64 +239,89 @@ async def _(redis: Redis = Depends(get_redis)):
     find = []
     async for key in redis.scan_iter(settings.session_prefix + "*", 10):
         cookie = await redis.get(key)
-        cookie_dict = orjson.loads(cookie)
+        cookie_dict = decode_session(cookie)
         if "user_id" not in cookie_dict:
             find.append(key)
-    await redis.delete(*find)
+    if find:
+        await redis.delete(*find)
+        await invalidate_sessions(redis, map(session_id_of, find))
     return {"msg": "ok"}
 
 
 @router.post("/item", description="增加一种物品", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: AddItemClass = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: AddItemClass = Body(...),
 ):
     await add_item_class(session, body.name, body.description)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
 @router.delete("/item", description="删除一种物品", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: DelItemClass = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: DelItemClass = Body(...),
 ):
     await del_item_class(session, body.id, body.delete_user)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
 @router.get("/item", description="查看全部物品种类", response_class=ORJSONResponse)
+@session_policy("read")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
     id: Optional[int] = Query(None, description="item_id"),
 ):
-    items = await get_item_class(session, id)
-    return {"msg": "ok", "items": [i.model_dump() for i in items]}
+    if id is None:
+        items = list((await get_catalog(session, redis)).items.values())
+    else:
+        items = await get_item_class(session, id)
+    return {"msg": "ok", "items": dump_rows(items)}
 
 
 @router.patch("/item", description="修改物品类", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: PatchItemClass = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: PatchItemClass = Body(...),
 ):
     await patch_item_class(session, body.id, body.name, body.description)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
 @router.post("/user/item", description="给用户发物品", response_class=ORJSONResponse)
+@query_budget(5)  # 管理员检查 用户 物品 已有数量 写入
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: UserAddItem = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: UserAddItem = Body(...),
 ):
     await user_add_item(session, body.user_id, body.item_id, body.count)
+    await push.publish_user(redis, body.user_id)
     return {"msg": "ok"}
 
 
 @router.delete("/user/item", description="给用户删除物品", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: UserDelItem = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: UserDelItem = Body(...),
 ):
     await user_del_item(session, body.user_id, body.item_id, body.count)
+    await push.publish_user(redis, body.user_id)
     return {"msg": "ok"}
 
 
 @router.get("/user/item", description="查看用户有哪些物品", response_class=ORJSONResponse)
-async def _(session: AsyncSession = Depends(get_db_session), id: int = Query(...)):
+@query_budget(2)
+@session_policy("read")
+async def _(session: AsyncSession = Depends(get_read_session), id: int = Query(...)):
     items = await user_get_item(session, id)
     return {"msg": "ok", "items": items}
 
@@ -257,46 +329,75 @@ async def _(session: AsyncSession = Depends(get_db_session), id: int = Query(...
 #### thread帖子相关
 @router.post("/thread", description="新增板块", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: AddThread = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: AddThread = Body(...),
 ):
     await add_thread(session, body.name, body.description)
+    await invalidate_catalog(redis)
     return {"msg": "ok"}
 
 
 @router.delete("/thread", description="删除板块", response_class=ORJSONResponse)
 async def _(
     session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
     id: int = Query(..., description="thread_id"),
 ):
     await del_thread(session, id)
+    await invalidate_catalog(redis)
+    await push.publish_thread(redis, id, {"type": "thread", "action": "delete"})
     return {"msg": "ok"}
 
 
 @router.get("/thread", description="查看有哪些板块", response_class=ORJSONResponse)
+@session_policy("read")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     id: Optional[int] = Query(None, description="thread_id"),
     name: Optional[str] = Query(None, description="thread_name"),
 ):
     threads = await get_thread(session, id, name)
-    return {
-        "msg": "ok",
-        "threads": [
-            thread.model_dump(exclude_none=True, exclude={"auths"})
-            for thread in threads
-        ],
-    }
+    return {"msg": "ok", "threads": dump_rows(threads, exclude_none=True)}
 
 
 @router.patch("/thread", description="修改板块", response_class=ORJSONResponse)
 async def _(
-    session: AsyncSession = Depends(get_db_session), body: PatchThread = Body(...)
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    body: PatchThread = Body(...),
 ):
     await patch_thread(session, body.id, body.name, body.description)
+    await invalidate_catalog(redis)
+    await push.publish_thread(redis, body.id, {"type": "thread", "action": "update"})
     return {"msg": "ok"}
 
 
-@router.post("/gc", description="垃圾回收 降低内存占用", response_class=ORJSONResponse)
+@router.post("/gc", description="所有worker垃圾回收 降低内存占用", response_class=ORJSONResponse)
+async def _(redis: Redis = Depends(get_redis)):
+    return {"msg": "ok", "workers": await broadcast(redis, "collect")}
+
+
+@router.post(
+    "/memory",
+    description="所有worker的内存情况：rss、gc、tracemalloc分配热点",
+    response_class=ORJSONResponse,
+    summary="命令通过redis广播给每个worker，超时没回复的worker不在结果里",
+)
+async def _(redis: Redis = Depends(get_redis), body: MemoryCommand = Body(...)):
+    return {"msg": "ok", "workers": await broadcast(redis, body.action, body.top)}
+
+
+@router.get("/profile", description="慢请求的采样调用栈列表", response_class=ORJSONResponse)
+@session_policy("read")
 async def _():
-    gc.collect()
-    return {"msg": "ok"}
+    return {"msg": "ok", "profiles": list_profiles()}
+
+
+@router.get("/profile/{name}", description="下载collapsed stacks，可直接用于flamegraph")
+@session_policy("read")
+async def _(name: str):
+    path = get_profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"profile {name} not found")
+    return FileResponse(path, media_type="text/plain", filename=name)
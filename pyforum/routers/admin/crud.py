@@ -5,26 +5,28 @@ Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
 from typing import List, Literal, Optional
 
 from fastapi import HTTPException
+from sqlalchemy import Row
 from sqlalchemy.exc import IntegrityError, NoResultFound
-from sqlmodel import and_, func, or_, select
+from sqlmodel import and_, or_, select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from pyforum.models import Group, Item, Thread, User, UserGroupLink, UserItemLink
 from pyforum.routers.admin.models import PatchUser, Search
+from pyforum.rows import columns
+from pyforum.upsert import on_conflict
 from pyforum.utils import pwd_context
 
 
 async def get_user_groups(
     session: AsyncSession, group_id: Optional[int] = None, name: Optional[str] = None
-) -> List[Group]:
+) -> List[Row]:
+    stmt = select(*columns(Group))
     if group_id is not None:
-        group = (await session.exec(select(Group).where(Group.id == group_id))).all()
+        stmt = stmt.where(Group.id == group_id)
     elif name is not None:
-        group = (await session.exec(select(Group).where(Group.name == name))).all()
-    else:
-        # 全部group
-        group = (await session.exec(select(Group))).all()
-    return group
+        stmt = stmt.where(Group.name == name)
+    # 否则全部group
+    return (await session.exec(stmt)).all()
 
 
 async def del_user_groups(session: AsyncSession, group_id: int):
@@ -34,13 +36,24 @@ async def del_user_groups(session: AsyncSession, group_id: int):
     # 让NoResultFound抛出
 
 
+async def _patch(session: AsyncSession, model, id: int, values: dict, detail: str):
+    """和patch_user一样，一条UPDATE，重名由唯一索引判断"""
+    values = {k: v for k, v in values.items() if v is not None}
+    if not values:
+        (await session.exec(select(model.id).where(model.id == id))).one()
+        return
+    async with on_conflict(session, detail):
+        result = await session.exec(
+            update(model).where(model.id == id).values(**values)
+        )
+        if not result.rowcount:
+            raise NoResultFound
+        await session.commit()
+
+
 async def add_user_group(session: AsyncSession, name: str, description: str):
-    try:
-        group = (await session.exec(select(Group).where(Group.name == name))).one()
-        raise HTTPException(status_code=409, detail=f"group {name} already exists")
-    except NoResultFound:
-        group = Group(name=name, description=description)
-        session.add(group)
+    async with on_conflict(session, f"group {name} already exists"):
+        session.add(Group(name=name, description=description))
         await session.commit()
 
 
@@ -50,22 +63,13 @@ async def patch_user_group(
     name: Optional[str] = None,
     description: Optional[str] = None,
 ):
-    group: Group = (await session.exec(select(Group).where(Group.id == id))).one()
-    if name is not None:
-        group_count = (
-            await session.exec(
-                func.count(
-                    select(Group.id).where(and_(Group.id != id, Group.name == name))
-                )
-            )
-        ).one()[0]
-        if group_count:
-            raise HTTPException(status_code=409, detail=f"group {name} already exists")
-        group.name = name
-    if description is not None:
-        group.description = description
-    session.add(group)
-    await session.commit()
+    await _patch(
+        session,
+        Group,
+        id,
+        {"name": name, "description": description},
+        f"group {name} already exists",
+    )
 
 
 async def add_user(session: AsyncSession, name: str, email: str, password: str):
@@ -77,18 +81,9 @@ async def add_user(session: AsyncSession, name: str, email: str, password: str):
     :param password:
     :return:
     """
-    user_count = (
-        await session.exec(
-            func.count(
-                select(User.id).where(or_(User.name == name, User.email == email))
-            )
-        )
-    ).one()[0]
-    if user_count:
-        raise HTTPException(status_code=409, detail="user name or email already exists")
-    user: User = User(name=name, email=email, password=pwd_context.hash(password))
-    session.add(user)
-    await session.commit()
+    async with on_conflict(session, "user name or email already exists"):
+        session.add(User(name=name, email=email, password=pwd_context.hash(password)))
+        await session.commit()
 
 
 async def del_user(session: AsyncSession, id: int):
@@ -111,50 +106,26 @@ async def get_user(
         return user
 
 
-async def patch_user(session: AsyncSession, body: PatchUser):  # todo 判断重名
-    user = (await session.exec(select(User).where(User.id == body.id))).one()
-    if body.name is not None:
-        user_count = (
-            await session.exec(
-                func.count(
-                    select(User.id).where(
-                        and_(User.name == body.name, User.id != body.id)
-                    )
-                )
-            )
-        ).one()[
-            0
-        ]  # 是否有重名的
-        if user_count:
-            raise HTTPException(
-                status_code=409, detail=f"user {body.name} already exists"
-            )
-        user.name = body.name
-    if body.email is not None:
-        user_count = (
-            await session.exec(
-                func.count(
-                    select(User.id).where(
-                        and_(User.email == body.email, User.id != body.id)
-                    )
-                )
-            )
-        ).one()[
-            0
-        ]  # 是否有重email的
-        if user_count:
-            raise HTTPException(status_code=409, detail="email already exists")
-        user.email = body.email
+async def patch_user(session: AsyncSession, body: PatchUser):
+    """一条UPDATE，重名和重email由唯一索引判断"""
+    values = body.model_dump(
+        include={"name", "email", "logo", "sign", "activated"}, exclude_none=True
+    )
     if body.password is not None:
-        user.password = pwd_context.hash(body.password)
-    if body.logo is not None:
-        user.logo = body.logo
-    if body.sign is not None:
-        user.sign = body.sign
-    if body.activate is not None:
-        user.activate = body.activated
-    session.add(user)
-    await session.commit()
+        values["password"] = pwd_context.hash(body.password)
+    if not values:
+        (await session.exec(select(User.id).where(User.id == body.id))).one()
+        return
+    async with on_conflict(
+        session,
+        {"name": f"user {body.name} already exists", "email": "email already exists"},
+    ):
+        result = await session.exec(
+            update(User).where(User.id == body.id).values(**values)
+        )
+        if not result.rowcount:
+            raise NoResultFound
+        await session.commit()
 
 
 async def search_user_or_group(
@@ -236,14 +207,9 @@ async def user_get_group(
 
 
 async def add_item_class(session: AsyncSession, name: str, description: str):
-    item_count = (
-        await session.exec(func.count(select(Item.id).where(Item.name == name)))
-    ).one()[0]
-    if item_count:
-        raise HTTPException(status_code=409, detail=f"item {name} already exists")
-    item = Item(name=name, description=description)
-    session.add(item)
-    await session.commit()
+    async with on_conflict(session, f"item {name} already exists"):
+        session.add(Item(name=name, description=description))
+        await session.commit()
 
 
 async def del_item_class(session: AsyncSession, id: int, deluser: bool = False) -> None:
@@ -260,11 +226,10 @@ async def del_item_class(session: AsyncSession, id: int, deluser: bool = False)
 
 
 async def get_item_class(session: AsyncSession, id: Optional[int] = None):
+    stmt = select(*columns(Item))
     if id is not None:
-        items = (await session.exec(select(Item).where(Item.id == id))).all()
-    else:
-        items = (await session.exec(select(Item))).all()
-    return items
+        stmt = stmt.where(Item.id == id)
+    return (await session.exec(stmt)).all()
 
 
 async def patch_item_class(
@@ -273,22 +238,13 @@ async def patch_item_class(
     name: Optional[str] = None,
     description: Optional[str] = None,
 ):
-    item = (await session.exec(select(Item).where(Item.id == id))).one()
-    if name is not None:
-        item_count = (
-            await session.exec(
-                func.count(
-                    select(Item.id).where(and_(Item.id != id, Item.name == name))
-                )
-            )
-        ).one()[0]
-        if item_count:
-            raise HTTPException(status_code=409, detail=f"item {name} already exists")
-        item.name = name
-    if description is not None:
-        item.description = description
-    session.add(item)
-    await session.commit()
+    await _patch(
+        session,
+        Item,
+        id,
+        {"name": name, "description": description},
+        f"item {name} already exists",
+    )
 
 
 async def user_add_item(
@@ -351,25 +307,23 @@ async def user_del_item(
 
 async def user_get_item(session: AsyncSession, user_id: int) -> list:
     ret = []
-    links = (
-        await session.exec(select(UserItemLink).where(UserItemLink.user_id == user_id))
+    rows = (
+        await session.exec(
+            select(Item, UserItemLink.count)
+            .join(UserItemLink, UserItemLink.item_id == Item.id)
+            .where(UserItemLink.user_id == user_id)
+        )
     ).all()
-    # await session.ref
-    for link in links:
-        await session.refresh(link, ["count", "item"])
-        d = link.item.model_dump()
-        d["count"] = link.count
+    for item, count in rows:
+        d = item.model_dump()
+        d["count"] = count
         ret.append(d)
     return ret
 
 
 async def add_thread(session: AsyncSession, name: str, description: str):
-    try:
-        thread = (await session.exec(select(Thread).where(Thread.name == name))).one()
-        raise HTTPException(status_code=409, detail=f"thread {name} already exists")
-    except NoResultFound:
-        thread = Thread(name=name, description=description)
-        session.add(thread)
+    async with on_conflict(session, f"thread {name} already exists"):
+        session.add(Thread(name=name, description=description))
         await session.commit()
 
 
@@ -381,15 +335,14 @@ async def del_thread(session: AsyncSession, id: int) -> None:
 
 async def get_thread(
     session: AsyncSession, id: Optional[int] = None, name: Optional[str] = None
-) -> List[Thread]:
+) -> List[Row]:
+    stmt = select(*columns(Thread))
     if id is not None:
-        threads = (await session.exec(select(Thread).where(Thread.id == id))).all()
+        stmt = stmt.where(Thread.id == id)
     elif name is not None:
-        threads = (await session.exec(select(Thread).where(Thread.name == name))).all()
-    else:
-        # 全部group
-        threads = (await session.exec(select(Thread))).all()
-    return threads
+        stmt = stmt.where(Thread.name == name)
+    # 否则全部thread
+    return (await session.exec(stmt)).all()
 
 
 async def patch_thread(
@@ -398,19 +351,10 @@ async def patch_thread(
     name: Optional[str] = None,
     description: Optional[str] = None,
 ):
-    thread: Thread = (await session.exec(select(Thread).where(Thread.id == id))).one()
-    if name is not None:
-        thread_count = (
-            await session.exec(
-                func.count(
-                    select(Thread.id).where(and_(Thread.id != id, Thread.name == name))
-                )
-            )
-        ).one()[0]
-        if thread_count:
-            raise HTTPException(status_code=409, detail=f"thread {name} already exists")
-        thread.name = name
-    if description is not None:
-        thread.description = description
-    session.add(thread)
-    await session.commit()
+    await _patch(
+        session,
+        Thread,
+        id,
+        {"name": name, "description": description},
+        f"thread {name} already exists",
+    )
@@ -2,7 +2,7 @@
 """
 Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
 """
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field, model_validator
 
@@ -94,3 +94,10 @@ class PatchThread(BaseModel):
     id: int = Field(...)
     name: Optional[str] = Field(..., max_length=200)
     description: Optional[str] = Field(..., max_length=200)
+
+
+class MemoryCommand(BaseModel):
+    action: Literal["stats", "collect", "snapshot", "stop"] = Field(
+        "stats", description="snapshot第一次调用会开启tracemalloc，之后每次返回top和与上次的差值"
+    )
+    top: Optional[int] = Field(20, gt=0, le=200, description="返回前多少个分配位置")
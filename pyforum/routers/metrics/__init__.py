@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+prometheus指标
+只给prometheus抓取：带settings.metrics_token，或者来自settings.metrics_allow里的地址
+"""
+import secrets
+from ipaddress import ip_address, ip_network
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from redis.asyncio import Redis
+
+from pyforum.config import settings
+from pyforum.depends import get_redis
+from pyforum.metrics import collect
+from pyforum.sessions import session_policy
+
+router = APIRouter(tags=["metrics"])
+
+
+def check_scraper(request: Request):
+    token = settings.metrics_token
+    if token and secrets.compare_digest(
+        request.headers.get("authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        return
+    try:
+        host = ip_address(request.client.host) if request.client else None
+    except ValueError:
+        host = None
+    if host is not None and any(
+        host in ip_network(net, strict=False) for net in settings.metrics_allow
+    ):
+        return
+    raise HTTPException(status_code=403, detail="forbidden")
+
+
+@router.get(
+    "/metrics",
+    description="prometheus文本格式的指标，汇总了全部worker",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(check_scraper)],
+)
+@session_policy("none")
+async def _(redis: Redis = Depends(get_redis)):
+    return PlainTextResponse(
+        await collect(redis), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
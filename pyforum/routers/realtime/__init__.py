@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+实时推送，WebSocket和Server-Sent Events两种，见pyforum.push
+"""
+import asyncio
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import State
+from starlette.websockets import WebSocketDisconnect
+
+from pyforum import push
+from pyforum.config import settings
+from pyforum.depends import get_user
+from pyforum.replicas import RoutingSession
+from pyforum.routers.thread.crud import get_threads
+from pyforum.sessions import session_policy
+
+router = APIRouter(prefix="/api/v1/push", tags=["realtime"])
+
+
+async def _channels(
+    state: State, user_id: Optional[int], thread_ids: List[int]
+) -> List[str]:
+    """只能订阅看得到的板块。查完就关掉数据库会话，长连接不占数据库连接"""
+    async with AsyncSession(
+        state.sqla, sync_session_class=RoutingSession, router=state.replicas
+    ) as session:
+        threads = await get_threads(session, state.redis, user_id)
+    visible = {thread.id for thread in threads}
+    channels = [push.thread_channel(id) for id in set(thread_ids) if id in visible]
+    if user_id is not None:
+        channels.append(push.user_channel(user_id))
+    return channels
+
+
+class EventStreamResponse(StreamingResponse):
+    """发送超时算慢连接；不管怎么结束都关掉生成器，把订阅去掉"""
+
+    async def stream_response(self, send):
+        async def send_with_timeout(message):
+            await asyncio.wait_for(send(message), settings.push_send_timeout)
+
+        try:
+            await super().stream_response(send_with_timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await self.body_iterator.aclose()
+
+
+async def _events(channels: List[str]):
+    sub = push.add(channels)
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            yield b"".join(b"data: " + data + b"\n\n" for data in await sub.get())
+    except push.SlowConsumer:
+        pass
+    finally:
+        push.remove(sub)
+
+
+@router.get("/events", description="Server-Sent Events推送")
+@session_policy("read")
+async def _(
+    request: Request,
+    user_id: int = Depends(get_user),
+    thread_id: List[int] = Query([], description="要订阅的板块"),
+):
+    if push.full():
+        raise HTTPException(status_code=503, detail="too many connections")
+    channels = await _channels(request.state, user_id, thread_id)
+    return EventStreamResponse(
+        _events(channels),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+@session_policy("read")
+async def _(
+    websocket: WebSocket,
+    user_id: int = Depends(get_user),
+    thread_id: List[int] = Query([], description="要订阅的板块"),
+):
+    if push.full():
+        await websocket.close(code=1013)  # try again later
+        return
+    channels = await _channels(websocket.state, user_id, thread_id)
+    await websocket.accept()
+    sub = push.add(channels)
+    try:
+        while True:
+            for data in await sub.get():
+                await asyncio.wait_for(
+                    websocket.send_text(data.decode()), settings.push_send_timeout
+                )
+    except push.SlowConsumer:
+        await websocket.close(code=4000, reason="reconnect")
+    except (asyncio.TimeoutError, WebSocketDisconnect, OSError, RuntimeError):
+        pass  # 断开了或者太慢
+    finally:
+        push.remove(sub)
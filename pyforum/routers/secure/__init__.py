@@ -2,15 +2,14 @@
 安全相关 验证码等
 """
 import secrets
-from typing import cast
 
 from fastapi import APIRouter, Body, Depends, Request
 from fastapi.responses import ORJSONResponse, StreamingResponse
 from redis.asyncio import Redis
-from starlette.templating import Jinja2Templates
 
 from pyforum.config import settings
 from pyforum.depends import get_redis
+from pyforum.ratelimit import check_rate_limit
 from pyforum.routers.secure.models import RequestSendEmail
 from pyforum.utils import generate_captcha, generate_token, send_email
 
@@ -19,6 +18,7 @@ router = APIRouter(prefix="/api/v1/secure", tags=["secure"])
 
 @router.get("/captcha")
 async def captcha(request: Request, redis: Redis = Depends(get_redis)):
+    await check_rate_limit(request, redis, "captcha")
     captcha_id: str = secrets.token_hex(16)
     request.session.update({"captcha_id": captcha_id})
     image, answer = generate_captcha(settings.captcha_num)
@@ -43,6 +43,7 @@ async def email(
     email: RequestSendEmail = Body(...),
     redis: Redis = Depends(get_redis),
 ):
+    await check_rate_limit(request, redis, "email", email.email)
     email_id: str = secrets.token_hex(16)
     request.session.update({"email_id": email_id})
     token = generate_token(settings.email_token_num)
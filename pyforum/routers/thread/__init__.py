@@ -4,27 +4,126 @@
 """
 from typing import Optional
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Body, Depends, Query, Request
 from fastapi.responses import ORJSONResponse
+from redis.asyncio import Redis
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from pyforum.depends import get_db_session, get_user
-from pyforum.routers.thread.crud import get_threads
+from pyforum import hot, unread
+from pyforum.config import settings
+from pyforum.counters import dump_with_counts, record_view, visitor
+from pyforum.depends import (
+    get_db_session,
+    get_read_session,
+    get_redis,
+    get_user,
+    get_user_or_jump,
+)
+from pyforum.querybudget import query_budget
+from pyforum.respcache import cache_response
+from pyforum.routers.thread.crud import (
+    add_read,
+    get_hot_reads,
+    get_read,
+    get_reads,
+    get_threads,
+)
+from pyforum.routers.thread.models import AddRead
+from pyforum.rows import dump_rows
+from pyforum.sessions import session_policy
 
 router = APIRouter(prefix="/api/v1/thread", tags=["thread"])
 
 
 @router.get("/", description="查看有那些版块", response_class=ORJSONResponse)
+@query_budget(5)  # 平时只查用户物品，目录缓存重新加载时多4条
+@cache_response("catalog")
+@session_policy("read")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
     user_id: int = Depends(get_user),
     id: Optional[int] = Query(None, description="thread_id"),
 ):
-    threads = await get_threads(session, user_id, id)
+    threads = await get_threads(session, redis, user_id, id)
+    return {"msg": "ok", "threads": dump_rows(threads, exclude_none=True)}
+
+
+@router.get(
+    "/reads", description="板块里的帖子，带浏览数，登录了的话标记为已读", response_class=ORJSONResponse
+)
+@query_budget(10)  # 用户物品 帖子 帖子权限，有帖子权限时再查物品；未读状态加载时多2条，目录缓存重新加载时多4条
+@session_policy("read")
+async def _(
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
+    user_id: int = Depends(get_user),
+    thread_id: int = Query(..., description="thread_id"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+):
+    reads = await get_reads(session, redis, user_id, thread_id, offset, limit)
+    if user_id is not None and reads:
+        await unread.mark_seen(session, redis, user_id, thread_id)
+    return {"msg": "ok", "reads": await dump_with_counts(redis, reads)}
+
+
+@router.get("/read", description="查看帖子，计一次浏览", response_class=ORJSONResponse)
+@query_budget(8)  # 同上
+@session_policy("read")
+async def _(
+    request: Request,
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
+    user_id: int = Depends(get_user),
+    id: int = Query(..., description="read_id"),
+):
+    read = await get_read(session, redis, user_id, id)
+    pending, visitors = await record_view(redis, read.id, visitor(request, user_id))
+    await hot.record(redis, read.id, read.thread_id, settings.hot_view_weight)
+    data = dump_rows([read])[0]
+    data["views"], data["visitors"] = read.views + pending, max(read.visitors, visitors)
+    return {"msg": "ok", "read": data}
+
+
+@router.post("/read", description="发帖", response_class=ORJSONResponse)
+async def _(
+    session: AsyncSession = Depends(get_db_session),
+    redis: Redis = Depends(get_redis),
+    user_id: int = Depends(get_user_or_jump),
+    body: AddRead = Body(...),
+):
+    read_id = await add_read(session, redis, user_id, body.thread_id, body.name)
+    return {"msg": "ok", "id": read_id}
+
+
+@router.get("/hot", description="热门帖子", response_class=ORJSONResponse)
+@query_budget(8)  # 用户物品 帖子 帖子权限，有帖子权限时再查物品；目录缓存重新加载时多4条
+@session_policy("read")
+async def _(
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
+    user_id: int = Depends(get_user),
+    thread_id: Optional[int] = Query(None, description="thread_id，不传是全站的"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    reads = await get_hot_reads(session, redis, user_id, thread_id, limit)
+    return {"msg": "ok", "reads": await dump_with_counts(redis, reads)}
+
+
+@router.get("/unread", description="各个看得到的板块的未读帖子数", response_class=ORJSONResponse)
+@query_budget(7)  # 用户物品；未读状态加载时多2条，目录缓存重新加载时多4条
+@session_policy("read")
+async def _(
+    session: AsyncSession = Depends(get_read_session),
+    redis: Redis = Depends(get_redis),
+    user_id: int = Depends(get_user_or_jump),
+):
+    threads = await get_threads(session, redis, user_id)
+    counts = await unread.get_unread(
+        session, redis, user_id, [thread.id for thread in threads]
+    )
     return {
         "msg": "ok",
-        "threads": [
-            thread.model_dump(exclude_none=True, exclude={"auths"})
-            for thread in threads
-        ],
+        "unread": [{"id": id, "unread": count} for id, count in counts.items()],
     }
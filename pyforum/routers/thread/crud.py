@@ -1,30 +1,127 @@
 # -*- coding: utf-8 -*-
 from typing import List, Optional, Union
 
+from redis.asyncio import Redis
+from sqlalchemy import Row
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlmodel import and_, func, or_, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from pyforum.depends import check_user_auth_for_threads
-from pyforum.models import Thread, ThreadAuth
+from pyforum import hot, push, unread
+from pyforum.catalog import get_catalog
+from pyforum.config import settings
+from pyforum.depends import check_user_auth_for_reads, check_user_auth_for_threads
+from pyforum.models import Read, Thread, ThreadAuth
+from pyforum.rows import columns, pack_rows, unpack_rows
+from pyforum.singleflight import singleflight
 
 
+@singleflight(
+    redis_lock=settings.singleflight_redis, encode=pack_rows, decode=unpack_rows
+)
 async def get_threads(
-    session: AsyncSession, user_id: Optional[int] = None, id: Optional[int] = None
-) -> List[Thread]:
+    session: AsyncSession,
+    redis: Redis,
+    user_id: Optional[int] = None,
+    id: Optional[int] = None,
+) -> List[Row]:
     """
 
     :param session:
+    :param redis: 检查目录缓存的版本
     :param user_id: None就是没登录
     :param id: thread_id
     :return:
     """
-    # todo 对不同的user限制返回的内容
+    catalog = await get_catalog(session, redis)
     if id is not None:
-        threads: list = (
-            await session.exec(select(Thread).where(Thread.id == id))
-        ).all()
+        threads = [catalog.threads[id]] if id in catalog.threads else []
     else:
-        threads: list = (await session.exec(select(Thread))).all()
-    threads = await check_user_auth_for_threads(session, threads, user_id)
+        threads = list(catalog.threads.values())
+    threads = await check_user_auth_for_threads(
+        session, threads, user_id, catalog.auths_for(threads)
+    )
     return threads
+
+
+async def get_reads(
+    session: AsyncSession,
+    redis: Redis,
+    user_id: Optional[int],
+    thread_id: int,
+    offset: int = 0,
+    limit: int = 20,
+) -> List[Row]:
+    """板块里的帖子，新的在前；板块不存在或者没权限看时是空的"""
+    if not await get_threads(session, redis, user_id, thread_id):
+        return []
+    reads = (
+        await session.exec(
+            select(*columns(Read))
+            .where(Read.thread_id == thread_id)
+            .order_by(Read.create_time.desc())
+            .offset(offset)
+            .limit(limit)
+        )
+    ).all()
+    return await check_user_auth_for_reads(session, reads, user_id)
+
+
+async def get_read(
+    session: AsyncSession, redis: Redis, user_id: Optional[int], id: int
+) -> Row:
+    read = (await session.exec(select(*columns(Read)).where(Read.id == id))).one()
+    if not await get_threads(
+        session, redis, user_id, read.thread_id
+    ) or not await check_user_auth_for_reads(session, [read], user_id):
+        raise NoResultFound  # 没权限看的当作不存在
+    return read
+
+
+async def add_read(
+    session: AsyncSession, redis: Redis, user_id: int, thread_id: int, name: str
+) -> int:
+    """发帖，没权限看的板块当作不存在"""
+    if not await get_threads(session, redis, user_id, thread_id):
+        raise NoResultFound
+    read = Read(user_id=user_id, thread_id=thread_id, name=name)
+    session.add(read)
+    await session.flush()
+    read_id = read.id
+    await session.commit()
+    await unread.on_post(redis, thread_id)
+    await push.publish_thread(
+        redis,
+        thread_id,
+        {"type": "read", "id": read_id, "user_id": user_id, "name": name},
+    )
+    await hot.record(redis, read_id, thread_id, settings.hot_post_weight)
+    return read_id
+
+
+async def get_hot_reads(
+    session: AsyncSession,
+    redis: Redis,
+    user_id: Optional[int],
+    thread_id: Optional[int] = None,
+    limit: int = 20,
+) -> List[Row]:
+    """
+    最热的帖子，按热度排好
+    :param thread_id: None就是全站的
+    :return: 先取limit个再过滤权限，没权限看的不补，可能不到limit个
+    """
+    threads = await get_threads(session, redis, user_id, thread_id)
+    if not threads:
+        return []
+    ids = await hot.top(redis, thread_id, limit)
+    if not ids:
+        return []
+    reads = (await session.exec(select(*columns(Read)).where(Read.id.in_(ids)))).all()
+    await hot.discard(redis, thread_id, set(ids) - {read.id for read in reads})
+    visible = {thread.id for thread in threads}
+    reads = await check_user_auth_for_reads(
+        session, [read for read in reads if read.thread_id in visible], user_id
+    )
+    order = {read_id: i for i, read_id in enumerate(ids)}
+    return sorted(reads, key=lambda read: order[read.id])
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+from pydantic import BaseModel, Field
+
+
+class AddRead(BaseModel):
+    thread_id: int = Field(...)
+    name: str = Field(..., max_length=200, description="标题")
@@ -10,8 +10,17 @@ from fastapi.responses import ORJSONResponse
 from redis.asyncio import Redis
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from pyforum import push
 from pyforum.config import settings
-from pyforum.depends import get_db_session, get_redis, get_user, get_user_or_jump
+from pyforum.depends import (
+    get_db_session,
+    get_read_session,
+    get_redis,
+    get_user,
+    get_user_or_jump,
+)
+from pyforum.querybudget import query_budget
+from pyforum.ratelimit import check_rate_limit
 from pyforum.routers.user.crud import (
     get_user_by_email,
     get_user_by_name,
@@ -30,19 +39,22 @@ from pyforum.routers.user.models import (
     UserResetPasswordEmail,
     UserSetProfile,
 )
+from pyforum.sessions import session_policy
 from pyforum.utils import ensure_str, generate_token, send_email
 
 router = APIRouter(prefix="/api/v1/user", tags=["user"])
 
 
 @router.post("/login", description="用户登录,返回200的正常，其余的detail字段是错误信息")
+@query_budget(1)  # last_login由后台批量更新
 async def login(
     request: Request,
     body: UserLogin = Body(),
     user_id: int = Depends(get_user),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     redis: Redis = Depends(get_redis),
 ):
+    await check_rate_limit(request, redis, "login", body.name or body.email)
     if user_id is not None:
         return ORJSONResponse(status_code=403, content={"msg": "already login"})
     if settings.use_captcha:
@@ -153,13 +165,15 @@ async def set_profile(
     if current_email:
         request.session.pop("email_id", None)
     await handle_setprofile(session, user_id, body, current_email)
+    await push.publish_user(redis, user_id, {"action": "profile"})
     return ORJSONResponse(status_code=200, content={"msg": "ok"})  # todo logo
 
 
 @router.get("/profile", response_class=ORJSONResponse)
+@session_policy("read")
 async def get_profile(
     user_id: int = Depends(get_user_or_jump),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     return await handle_getprofile(session, user_id)
 
@@ -177,9 +191,10 @@ async def hande_sign_(
 
 
 @router.get("/sign", description="查看签到")
+@session_policy("read")
 async def get_sign(
     user_id: int = Depends(get_user_or_jump),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     year: Optional[int] = Query(None, description="年份，用于补签"),
     month: Optional[int] = Query(None, description="月份，用于补签"),
 ):
@@ -200,10 +215,13 @@ email_template = """
 async def handle_reset_password_sendemail(
     request: Request,
     body: UserResetPasswordEmail = Body(...),
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     redis: Redis = Depends(get_redis),
     user_id: int = Depends(get_user),
 ):
+    await check_rate_limit(
+        request, redis, "reset_password_email", body.name or body.email
+    )
     if user_id is not None:
         return ORJSONResponse(status_code=403, content={"msg": "already login"})
     if body.name is not None:
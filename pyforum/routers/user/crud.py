@@ -9,12 +9,15 @@ from fastapi import HTTPException
 from fastapi.requests import Request
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import noload, selectinload
-from sqlmodel import and_, func, or_, select
+from sqlmodel import and_, select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from pyforum.config import settings
+from pyforum.loginlog import record_login
 from pyforum.models import Sign, User
 from pyforum.routers.user.models import UserGetProfile, UserSetProfile
+from pyforum.signs import read_month
+from pyforum.upsert import insert_for, on_conflict
 from pyforum.utils import pwd_context
 
 
@@ -49,14 +52,8 @@ async def verify_password_login(
         return False  # 已经注销了
     if not pwd_context.verify(password, user.password):
         return False  # 密码不对
-    # 只有登录才会检查，因此此处更新last_login
-    user.last_login = datetime.now(
-        tz=timezone(timedelta(hours=settings.timezone_offset))
-    )
-    user.last_ip = request.client.host
-    session.add(user)
-    await session.commit()
-    await session.refresh(user)  # ["link", "id"]
+    # 只有登录才会检查，last_login和last_ip由后台批量更新
+    record_login(user.id, request.client.host if request.client else None)
     return user.id
 
 
@@ -69,59 +66,32 @@ async def handle_signup(session: AsyncSession, name: str, email: str, password:
     :param password:
     :return:
     """
-    user_count = (
-        await session.exec(
-            func.count(
-                select(User.id).where(or_(User.name == name, User.email == email))
-            )
-        )
-    ).one()[0]
-    if user_count:
-        raise HTTPException(status_code=409, detail="user name or email already exists")
-    session.add(User(name=name, email=email, password=pwd_context.hash(password)))
-    await session.commit()
+    async with on_conflict(session, "user name or email already exists"):
+        session.add(User(name=name, email=email, password=pwd_context.hash(password)))
+        await session.commit()
 
 
 async def handle_setprofile(
     session: AsyncSession, user_id: int, body: UserSetProfile, email: str
 ):
-    user: User = (await session.exec(select(User).where(User.id == user_id))).one()
-    if body.name is not None:
-        user_count = (
-            await session.exec(
-                func.count(
-                    select(User.id).where(
-                        and_(User.name == body.name, User.id != user_id)
-                    )
-                )
-            )
-        ).one()[
-            0
-        ]  # 是否有重名的
-        if user_count:
-            raise HTTPException(status_code=409, detail="user name already exists")
-        user.name = body.name
+    values = body.model_dump(include={"name", "logo", "sign"}, exclude_none=True)
     if email:
-        user_count = (
-            await session.exec(
-                func.count(
-                    select(User.id).where(and_(User.email == email, User.id != user_id))
-                )
-            )
-        ).one()[
-            0
-        ]  # 是否有重email的
-        if user_count:
-            raise HTTPException(status_code=409, detail="email already exists")
-        user.email = email
+        values["email"] = email
     if body.password is not None:
-        user.password = pwd_context.hash(body.password)
-    if body.logo is not None:
-        user.logo = body.logo
-    if body.sign is not None:
-        user.sign = body.sign
-    session.add(user)
-    await session.commit()
+        values["password"] = pwd_context.hash(body.password)
+    if not values:
+        return
+    # 重名和重email由唯一索引判断
+    async with on_conflict(
+        session,
+        {"name": "user name already exists", "email": "email already exists"},
+    ):
+        result = await session.exec(
+            update(User).where(User.id == user_id).values(**values)
+        )
+        if not result.rowcount:
+            raise NoResultFound
+        await session.commit()
 
 
 async def handle_getprofile(session: AsyncSession, user_id: int):
@@ -167,22 +137,16 @@ async def handle_sign(
         now = datetime(year=year, month=month, day=day)
     else:
         now = datetime.now(tz=timezone(timedelta(hours=settings.timezone_offset)))
-    try:
-        sign: Sign = (
-            await session.exec(
-                select(Sign).where(
-                    and_(
-                        Sign.user_id == user_id,
-                        Sign.year == now.year,
-                        Sign.month == now.month,
-                    )
-                )
-            )
-        ).one()
-    except NoResultFound:  # 本月第一次
-        sign: Sign = Sign(user_id=user_id, year=now.year, month=now.month)
-    sign.set_sign(now.day)
-    session.add(sign)
+    # 本月第一次就插入，否则把那一天的位或上去，和Sign.set_sign一样
+    stmt = insert_for(session)(Sign).values(
+        user_id=user_id, year=now.year, month=now.month, data=1 << (now.day - 1)
+    )
+    await session.exec(
+        stmt.on_conflict_do_update(
+            index_elements=[Sign.user_id, Sign.year, Sign.month],
+            set_={"data": Sign.data.op("|")(stmt.excluded.data)},
+        )
+    )
     await session.commit()
 
 
@@ -200,29 +164,14 @@ async def handle_get_sign(
     :param user_id:
     :return:
     """
+    now = datetime.now(tz=timezone(timedelta(hours=settings.timezone_offset)))
     if year is not None and month is not None:
-        now = datetime(year=year, month=month, day=1)
-        if now > datetime.now(tz=timezone(timedelta(hours=settings.timezone_offset))):
+        if (year, month) > (now.year, now.month):
             raise HTTPException(
                 status_code=403, detail="can't get sign data of future"
             )  # 不能查看未来的签到数据
     else:
-        now = datetime.now(tz=timezone(timedelta(hours=settings.timezone_offset)))
-    try:
-        sign: Sign = (
-            await session.exec(
-                select(Sign).where(
-                    and_(
-                        Sign.user_id == user_id,
-                        Sign.year == now.year,
-                        Sign.month == now.month,
-                    )
-                )
-            )
-        ).one()
-    except NoResultFound:  # 本月第一次 todo 用户乱查看未来的数据岂不是数据库爆炸 因此非特权用户不得查看
-        sign: Sign = Sign(user_id=user_id, year=now.year, month=now.month)
-        session.add(sign)
-        await session.commit()
-        await session.refresh(sign)
-    return sign.to_list()
+        year, month = now.year, now.month
+    # 热表和归档一起查，没有签到过就是全0，不再插入空行
+    data = await read_month(session, user_id, year, month)
+    return Sign(user_id=user_id, year=year, month=month, data=data).to_list()
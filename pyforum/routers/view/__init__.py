@@ -7,20 +7,29 @@ from typing import Optional
 from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from pyforum.depends import get_db_session, get_redis, get_user, get_user_or_jump
+from pyforum.depends import (
+    get_db_session,
+    get_read_session,
+    get_redis,
+    get_user,
+    get_user_or_jump,
+)
 from pyforum.routers.view.crud import (
     add_viewaddress,
+    dump_viewaddress,
     get_viewaddress,
     patch_viewaddress,
 )
 from pyforum.routers.view.models import AddViewAddress, PatchViewAddress
+from pyforum.sessions import session_policy
 
 router = APIRouter(prefix="/api/v1/view", tags=["admin"])
 
 
 @router.get("/", description="查看有哪些地点")
+@session_policy("none")
 async def _(
-    session: AsyncSession = Depends(get_db_session),
+    session: AsyncSession = Depends(get_read_session),
     name: Optional[str] = Query(None, description=""),
     offset: Optional[int] = Query(0),
     limit: Optional[int] = Query(10),
@@ -28,7 +37,7 @@ async def _(
     if limit > 20:
         raise HTTPException(403, "limit is too large")
     data = await get_viewaddress(session, name, offset, limit)
-    return {"msg": "ok", "address": [i.dump() for i in data]}
+    return {"msg": "ok", "address": dump_viewaddress(data)}
 
 
 @router.post("/", description="添加地点")
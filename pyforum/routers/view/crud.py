@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 from fastapi import HTTPException
+from sqlalchemy import Row
 from sqlalchemy.exc import IntegrityError, NoResultFound
-from sqlmodel import and_, func, or_, select
+from sqlmodel import and_, func, or_, select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from pyforum.models import ViewAddress
+from pyforum.upsert import on_conflict
+
+_address_columns = (
+    ViewAddress.id,
+    ViewAddress.name,
+    ViewAddress.author_id,
+    func.ST_X(ViewAddress.position).label("x"),
+    func.ST_Y(ViewAddress.position).label("y"),
+    ViewAddress.description,
+    ViewAddress.status,
+)
 
 
 async def get_viewaddress(
@@ -14,30 +26,33 @@ async def get_viewaddress(
     name: Optional[str] = None,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
-) -> List[ViewAddress]:
+) -> List[Row]:
+    stmt = select(*_address_columns)
     if name is not None:
-        addrs = (
-            await session.exec(
-                select(ViewAddress)
-                .where(ViewAddress.name.like(f"%{name}%"))
-                .offset(offset)
-                .limit(limit)
-            )
-        ).all()
-    else:
-        addrs = (
-            await session.exec(select(ViewAddress).offset(offset).limit(limit))
-        ).all()
-    return addrs
+        stmt = stmt.where(ViewAddress.name.like(f"%{name}%"))
+    return (await session.exec(stmt.offset(offset).limit(limit))).all()
+
+
+def dump_viewaddress(rows: Sequence[Row]) -> List[dict]:
+    """和ViewAddress.dump()一样的结构，坐标直接由数据库算出来，不用再解析WKT"""
+    ret = []
+    for id, name, author_id, x, y, description, status in rows:
+        data = {
+            "id": id,
+            "name": name,
+            "author_id": author_id,
+            "position": (x, y),
+            "description": description,
+            "status": status,
+        }
+        ret.append({k: v for k, v in data.items() if v is not None})
+    return ret
 
 
 async def add_viewaddress(
     session: AsyncSession, name: str, uid: int, position: tuple, des: str
 ):
-    try:
-        (await session.exec(select(ViewAddress).where(ViewAddress.name == name))).one()
-        raise HTTPException(status_code=409, detail=f"address {name} already exists")
-    except NoResultFound:
+    async with on_conflict(session, f"address {name} already exists"):
         addr = ViewAddress(
             name=name,
             author_id=uid,
@@ -62,14 +77,21 @@ async def patch_viewaddress(
     position: Optional[tuple] = None,
     des: Optional[str] = None,
 ):
-    addr: ViewAddress = (
-        await session.exec(select(ViewAddress).where(ViewAddress.id == id))
-    ).one()
+    """一条UPDATE，重名由唯一索引ix_address_name判断"""
+    values = {}
     if name is not None:
-        addr.name = name
+        values["name"] = name
     if position is not None:
-        addr.pos = position
+        values["position"] = f"POINT({position[0]} {position[1]})"
     if des is not None:
-        addr.description = des
-    session.add(addr)
-    await session.commit()
+        values["description"] = des
+    if not values:
+        (await session.exec(select(ViewAddress.id).where(ViewAddress.id == id))).one()
+        return
+    async with on_conflict(session, f"address {name} already exists"):
+        result = await session.exec(
+            update(ViewAddress).where(ViewAddress.id == id).values(**values)
+        )
+        if not result.rowcount:
+            raise NoResultFound
+        await session.commit()
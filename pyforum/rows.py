@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+只读列表用的轻量行
+
+列表接口只是把数据原样吐出去，没必要构造orm对象（identity map、关系描述符、pydantic校验）再model_dump。
+直接select列，拿到的Row本身就是带__slots__的具名元组，再按字段名拼成dict交给orjson。
+要跨worker传（见pyforum.singleflight）时用pack_rows/unpack_rows，另一边拿到的是同样字段的namedtuple。
+"""
+from collections import namedtuple
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Sequence, Type
+
+from sqlalchemy import Column, Row
+from sqlmodel import SQLModel
+
+
+def columns(model: Type[SQLModel], exclude: Iterable[str] = ()) -> List[Column]:
+    """表的全部列，顺序和model_dump一致"""
+    return [c for c in model.__table__.columns if c.name not in exclude]
+
+
+def dump_rows(rows: Sequence[Row], exclude_none: bool = False) -> List[dict]:
+    """和model_dump(exclude_none=...)同样的结果"""
+    if not rows:
+        return []
+    fields = rows[0]._fields
+    if exclude_none:
+        return [{k: v for k, v in zip(fields, row) if v is not None} for row in rows]
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def pack_rows(rows: Sequence[Row]) -> dict:
+    """转成orjson能序列化的结构"""
+    return {
+        "fields": list(rows[0]._fields) if rows else [],
+        "rows": [list(row) for row in rows],
+    }
+
+
+@lru_cache(maxsize=None)
+def _row_type(fields: tuple) -> Type[NamedTuple]:
+    return namedtuple("Row", fields)
+
+
+def unpack_rows(data: dict) -> List[NamedTuple]:
+    """pack_rows的逆操作，datetime之类orjson转成了字符串的不会转回来"""
+    row_type = _row_type(tuple(data["fields"]))
+    return [row_type(*row) for row in data["rows"]]
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+session存储
+
+RedisStore每个请求都GET一次，rolling=True时每个请求还要SET一次。这里在它前面加一层进程内缓存：
+    读  本进程最近读过/写过的session在session_local_ttl秒内直接用
+    写  除了__metadata__.last_access以外内容没变就不写，只是最多每session_touch_interval秒EXPIRE一次续期
+内容变了或者删除时通过pyforum.pubsub通知其他worker丢掉本地的副本，
+管理员直接删redis里的session时也要调用invalidate_sessions。
+
+存进redis的格式见SessionCodec，旧的json格式也能读。
+
+路由用session_policy声明要不要session，不声明的是read-write：
+    none   不加载，不访问redis，也不会Set-Cookie
+    read   只读，有cookie才访问redis（通常命中本地缓存），不写回也不Set-Cookie
+    write  和原来一样，请求结束时写回并续期cookie
+加载在pyforum.depends.load_session里做，路由匹配之后才知道策略。
+"""
+import logging
+import struct
+from collections import OrderedDict
+from time import monotonic
+from types import MappingProxyType
+from typing import Any, Iterable, Literal, Mapping, Optional
+
+import orjson
+from redis.asyncio import Redis
+from starlette.types import Scope
+from starsessions.middleware import LoadGuard
+from starsessions.serializers import Serializer
+from starsessions.stores.redis import RedisStore
+
+from pyforum.config import settings
+from pyforum.metrics import worker_id
+from pyforum.pubsub import hub
+
+logger = logging.getLogger(__name__)
+
+_VERSION = 1
+_TAG_EXTRA, _TAG_USER_ID, _TAG_CAPTCHA_ID, _TAG_EMAIL_ID, _TAG_METADATA = range(5)
+_TOKENS = {"captcha_id": _TAG_CAPTCHA_ID, "email_id": _TAG_EMAIL_ID}
+_TOKEN_KEYS = {v: k for k, v in _TOKENS.items()}
+_int64 = struct.Struct("<q")
+_uint32 = struct.Struct("<I")
+_metadata = struct.Struct("<Idd")  # lifetime created last_access
+
+
+def _token(value: Any) -> Optional[bytes]:
+    """secrets.token_hex(16)生成的id存成16字节"""
+    if isinstance(value, str) and len(value) == 32:
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            return None
+        if raw.hex() == value:  # 大写的hex还原不回来
+            return raw
+    return None
+
+
+class SessionCodec(Serializer):
+    """
+    紧凑的二进制格式，常见的键用1字节的tag代替，不用每个session都存一遍键名
+        版本号 1字节
+        若干个字段 tag 1字节 + 内容
+            1 user_id       int64
+            2 captcha_id    16字节
+            3 email_id      16字节
+            4 __metadata__  uint32 lifetime, double created, double last_access
+            0 其余的键      uint32长度 + json
+    以"{"开头的是迁移前的json格式，照样能读；settings.session_codec为json时仍然写json，用来回滚
+    """
+
+    def serialize(self, data: Any) -> bytes:
+        if settings.session_codec == "json":
+            return orjson.dumps(data)
+        out = bytearray((_VERSION,))
+        extra = {}
+        for key, value in data.items():
+            if (
+                key == "user_id"
+                and type(value) is int
+                and -(2**63) <= value < 2**63
+            ):
+                out.append(_TAG_USER_ID)
+                out += _int64.pack(value)
+            elif key in _TOKENS and (raw := _token(value)) is not None:
+                out.append(_TOKENS[key])
+                out += raw
+            elif (
+                key == "__metadata__"
+                and value.keys() == {"lifetime", "created", "last_access"}
+                and type(value["lifetime"]) is int
+                and 0 <= value["lifetime"] < 2**32
+            ):
+                out.append(_TAG_METADATA)
+                out += _metadata.pack(
+                    value["lifetime"], value["created"], value["last_access"]
+                )
+            else:
+                extra[key] = value
+        if extra:
+            payload = orjson.dumps(extra)
+            out.append(_TAG_EXTRA)
+            out += _uint32.pack(len(payload))
+            out += payload
+        return bytes(out)
+
+    def deserialize(self, data: bytes) -> dict:
+        if not data:
+            return {}
+        if data[:1] == b"{":
+            return orjson.loads(data)
+        try:
+            return self._decode(data)
+        except (ValueError, struct.error) as e:
+            logger.warning("broken session %r: %s", data[:32], e)
+            return {}  # 当作没有session，重新登录
+
+    @staticmethod
+    def _decode(data: bytes) -> dict:
+        if data[0] != _VERSION:
+            raise ValueError(f"unknown session version {data[0]}")
+        result = {}
+        pos, end = 1, len(data)
+        while pos < end:
+            tag = data[pos]
+            pos += 1
+            if tag == _TAG_USER_ID:
+                (result["user_id"],) = _int64.unpack_from(data, pos)
+                pos += _int64.size
+            elif tag in _TOKEN_KEYS:
+                result[_TOKEN_KEYS[tag]] = data[pos : pos + 16].hex()
+                pos += 16
+            elif tag == _TAG_METADATA:
+                lifetime, created, last_access = _metadata.unpack_from(data, pos)
+                result["__metadata__"] = {
+                    "lifetime": lifetime,
+                    "created": created,
+                    "last_access": last_access,
+                }
+                pos += _metadata.size
+            elif tag == _TAG_EXTRA:
+                (length,) = _uint32.unpack_from(data, pos)
+                pos += _uint32.size
+                result.update(orjson.loads(data[pos : pos + length]))
+                pos += length
+            else:
+                raise ValueError(f"unknown session field tag {tag}")
+        if pos != end:
+            raise ValueError("truncated session")
+        return result
+
+
+codec = SessionCodec()
+
+
+def decode_session(data: bytes) -> dict:
+    """管理员直接扫redis时用，新旧格式都能解"""
+    return codec.deserialize(data)
+
+
+SessionPolicy = Literal["none", "read", "write"]
+
+
+def session_policy(policy: SessionPolicy):
+    """
+    声明路由怎么用session，放在@router.xxx下面
+    """
+
+    def deco(func):
+        func.__session_policy__ = policy
+        return func
+
+    return deco
+
+
+async def read_session(scope: Scope) -> Mapping[str, Any]:
+    """只读地加载session，结果放进scope["session"]，改它会抛TypeError"""
+    session = scope.get("session")
+    if type(session) is not LoadGuard:  # 已经加载过了
+        return session
+    handler = scope["session_handler"]
+    data = {}
+    if handler.session_id:  # 没有cookie的匿名用户不访问redis
+        data = handler.serializer.deserialize(
+            await handler.store.read(handler.session_id, handler.lifetime)
+        )
+        data.pop("__metadata__", None)
+    # handler没有标记为已加载，SessionMiddleware不会写回也不会Set-Cookie
+    scope["session"] = MappingProxyType(data)
+    return scope["session"]
+
+
+class _Entry:
+    __slots__ = ("data", "loaded_at", "touched_at")
+
+    def __init__(self, data: bytes, touched_at: float):
+        self.data = data
+        self.loaded_at = monotonic()
+        self.touched_at = touched_at
+
+
+class TieredRedisStore(RedisStore):
+    def __init__(self, connection: Redis, prefix: str, serializer: Serializer):
+        super().__init__(connection=connection, prefix=prefix)
+        self.serializer = serializer
+        self.local: "OrderedDict[str, _Entry]" = OrderedDict()
+        hub.subscribe(settings.session_channel, self._on_message, self.local.clear)
+
+    def _on_message(self, data: bytes):
+        sender, _, ids = data.partition(b"|")
+        if sender != worker_id().encode():  # 自己发出的不用管
+            for session_id in ids.decode().split(","):
+                self.local.pop(session_id, None)
+
+    def _remember(self, session_id: str, data: bytes, touched_at: float):
+        self.local[session_id] = _Entry(data, touched_at)
+        self.local.move_to_end(session_id)
+        while len(self.local) > settings.session_local_size:
+            self.local.popitem(last=False)
+
+    def _content(self, data: bytes) -> dict:
+        content = self.serializer.deserialize(data)
+        content.get("__metadata__", {}).pop("last_access", None)  # 每个请求都会变
+        return content
+
+    async def read(self, session_id: str, lifetime: int) -> bytes:
+        entry = self.local.get(session_id)
+        if (
+            entry is not None
+            and monotonic() - entry.loaded_at < settings.session_local_ttl
+        ):
+            return entry.data
+        data = await super().read(session_id, lifetime)
+        if data:
+            # redis里的ttl不知道，当作刚续过期，最多晚session_touch_interval秒续期
+            self._remember(session_id, data, monotonic())
+        return data
+
+    async def write(self, session_id: str, data: bytes, lifetime: int, ttl: int) -> str:
+        entry = self.local.get(session_id)
+        if entry is not None and self._content(entry.data) == self._content(data):
+            if monotonic() - entry.touched_at >= settings.session_touch_interval:
+                await self._connection.expire(self.prefix(session_id), max(1, ttl))
+                entry.touched_at = monotonic()
+            return session_id
+        session_id = await super().write(session_id, data, lifetime, ttl)
+        self._remember(session_id, data, monotonic())
+        await self._notify([session_id])
+        return session_id
+
+    async def remove(self, session_id: str) -> None:
+        await super().remove(session_id)
+        self.local.pop(session_id, None)
+        await self._notify([session_id])
+
+    async def _notify(self, session_ids: Iterable[str]):
+        await self._connection.publish(
+            settings.session_channel, f"{worker_id()}|{','.join(session_ids)}"
+        )
+
+
+async def invalidate_sessions(redis: Redis, session_ids: Iterable[str]):
+    """直接删了redis里的session之后调用，让所有worker丢掉本地的副本"""
+    session_ids = [i for i in session_ids if i]
+    if session_ids:
+        await redis.publish(settings.session_channel, f"-|{','.join(session_ids)}")
+
+
+def session_id_of(key: bytes) -> Optional[str]:
+    """redis key -> session id"""
+    key = key.decode()
+    if key.startswith(settings.session_prefix):
+        return key[len(settings.session_prefix) :]
+    return None
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+签到的冷热分层
+
+    热  sign表，每个用户每月一行，data的第n位是第n+1天。PostgreSQL上按year分区，sign_y2024这样命名，外加sign_default
+    冷  sign_archive表，每个用户每年一行，366位，第n位是这一年的第n+1天
+
+每sign_maintain_interval秒，拿到redis锁的那个worker：
+    PostgreSQL上建好今年和以后sign_partitions_ahead年的分区，sign_default里已有的这些年的数据先挪过去
+    sign_hot_years年以前的签到按用户压进sign_archive，每sign_archive_batch个用户一个事务。
+    DELETE ... RETURNING读和删是同一条语句，归档时有人补签也不会丢。一年归档完之后DROP掉它的分区
+read_month用一条UNION ALL同时查两层再按位或起来，调用的地方不用管数据在哪一层。
+"""
+import asyncio
+import calendar
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from bitarray import bitarray
+from redis.asyncio import Redis
+from sqlalchemy import Integer, LargeBinary, cast, delete, null, text, union_all
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.config import settings
+from pyforum.models import Sign, SignArchive, tz
+from pyforum.upsert import insert_for
+
+logger = logging.getLogger(__name__)
+
+YEAR_BITS = 366
+
+
+def _month_span(year: int, month: int) -> Tuple[int, int]:
+    """这个月的第一天是一年中的第几天（从0开始），这个月有几天"""
+    return (
+        date(year, month, 1).timetuple().tm_yday - 1,
+        calendar.monthrange(year, month)[1],
+    )
+
+
+def _bits(data: bytes) -> bitarray:
+    a = bitarray(endian="little")
+    a.frombytes(data)
+    return a
+
+
+def pack_year(year: int, months: Dict[int, int], blob: Optional[bytes] = None) -> bytes:
+    """
+    把一年里各个月的data压成366位
+    :param months: {月份: Sign.data}
+    :param blob: 已经归档的，合并进去
+    """
+    a = bitarray(YEAR_BITS, endian="little")
+    a.setall(0)
+    if blob:
+        a |= _bits(blob)[:YEAR_BITS]
+    for month, data in months.items():
+        start, days = _month_span(year, month)
+        a[start : start + days] |= _bits(data.to_bytes(4, "little"))[:days]
+    return a.tobytes()
+
+
+def unpack_month(blob: bytes, year: int, month: int) -> int:
+    """从366位里取出一个月，和Sign.data一样的格式"""
+    start, days = _month_span(year, month)
+    return int.from_bytes(_bits(blob)[start : start + days].tobytes(), "little")
+
+
+async def read_month(session: AsyncSession, user_id: int, year: int, month: int) -> int:
+    """两层合起来的这个月的签到，没有就是0"""
+    hot = select(Sign.data, cast(null(), LargeBinary)).where(
+        Sign.user_id == user_id, Sign.year == year, Sign.month == month
+    )
+    cold = select(cast(null(), Integer), SignArchive.data).where(
+        SignArchive.user_id == user_id, SignArchive.year == year
+    )
+    data = 0
+    for month_data, blob in (await session.exec(union_all(hot, cold))).all():
+        if month_data:
+            data |= month_data
+        if blob:
+            data |= unpack_month(blob, year, month)
+    return data
+
+
+async def ensure_partitions(conn: AsyncConnection, year: int) -> List[str]:
+    """PostgreSQL上建好year往后的分区，返回新建的分区名；别的数据库什么也不做"""
+    if conn.dialect.name != "postgresql":
+        return []
+    await conn.execute(
+        text("CREATE TABLE IF NOT EXISTS sign_default PARTITION OF sign DEFAULT")
+    )
+    created = []
+    for y in range(year, year + settings.sign_partitions_ahead + 1):
+        name = f"sign_y{y}"
+        if await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}):
+            continue
+        # 提前补签到以后的会落在sign_default里，挪出来才能ATTACH
+        await conn.execute(
+            text(
+                f"CREATE TABLE {name} (LIKE sign INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+        )
+        await conn.execute(
+            text(
+                f"WITH moved AS (DELETE FROM sign_default WHERE year = {y} RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            )
+        )
+        await conn.execute(
+            text(
+                f"ALTER TABLE sign ATTACH PARTITION {name} FOR VALUES FROM ({y}) TO ({y + 1})"
+            )
+        )
+        created.append(name)
+    return created
+
+
+async def archive_year(engine: AsyncEngine, year: int) -> int:
+    """把这一年的热数据压进sign_archive，返回归档了多少个用户"""
+    total = last = 0
+    while True:
+        async with engine.begin() as conn:
+            users = (
+                select(Sign.user_id)
+                .where(Sign.year == year, Sign.user_id > last)
+                .distinct()
+                .order_by(Sign.user_id)
+                .limit(settings.sign_archive_batch)
+            )
+            rows = (
+                await conn.execute(
+                    delete(Sign)
+                    .where(Sign.year == year, Sign.user_id.in_(users))
+                    .returning(Sign.user_id, Sign.month, Sign.data)
+                )
+            ).all()
+            if not rows:
+                break
+            months: Dict[int, Dict[int, int]] = {}
+            for user_id, month, data in rows:
+                months.setdefault(user_id, {})[month] = data or 0
+            blobs = dict(
+                (
+                    await conn.execute(
+                        select(SignArchive.user_id, SignArchive.data).where(
+                            SignArchive.year == year,
+                            SignArchive.user_id.in_(list(months)),
+                        )
+                    )
+                ).all()
+            )
+            stmt = insert_for(conn)(SignArchive)
+            await conn.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[SignArchive.user_id, SignArchive.year],
+                    set_={"data": stmt.excluded.data},
+                ),
+                [
+                    {
+                        "user_id": u,
+                        "year": year,
+                        "data": pack_year(year, m, blobs.get(u)),
+                    }
+                    for u, m in months.items()
+                ],
+            )
+        total += len(months)
+        last = max(months)
+    if engine.dialect.name == "postgresql":
+        async with engine.begin() as conn:
+            name = f"sign_y{year}"
+            if await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}):
+                await conn.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+                # 刚才又有人补签的话留到下次
+                if not await conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {name})")):
+                    await conn.execute(text(f"DROP TABLE {name}"))
+    return total
+
+
+async def archive_cold(engine: AsyncEngine) -> int:
+    """归档sign_hot_years年以前的，返回归档了多少个用户"""
+    cutoff = datetime.now(tz=tz).year - settings.sign_hot_years
+    async with engine.connect() as conn:
+        years = (
+            await conn.scalars(select(Sign.year).where(Sign.year <= cutoff).distinct())
+        ).all()
+    total = 0
+    for year in sorted(years):
+        total += await archive_year(engine, year)
+    return total
+
+
+async def maintain(engine: AsyncEngine, redis: Redis) -> bool:
+    """每sign_maintain_interval秒只有一个worker做，没拿到锁返回False"""
+    if not await redis.set(
+        settings.sign_maintain_key,
+        1,
+        nx=True,
+        ex=max(int(settings.sign_maintain_interval), 1),
+    ):
+        return False
+    async with engine.begin() as conn:
+        created = await ensure_partitions(conn, datetime.now(tz=tz).year)
+    if created:
+        logger.info("created sign partitions %s", created)
+    archived = await archive_cold(engine)
+    if archived:
+        logger.info("archived signs of %d users", archived)
+    return True
+
+
+async def maintain_forever(engine: AsyncEngine, redis: Redis):
+    while True:
+        try:
+            await maintain(engine, redis)
+        except Exception:  # 数据库临时不可用时不要让后台任务退出
+            logger.exception("failed to maintain sign tables")
+        await asyncio.sleep(settings.sign_maintain_interval)
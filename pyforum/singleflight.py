@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+合并同时发生的相同调用（single-flight）
+
+热门板块一更新，几百个请求同一时刻做同样的查询。同一个key正在执行时，后来的调用直接等第一个的结果，
+不再重复执行。结果是共享的同一个对象，调用方不要修改它。
+
+    @singleflight()
+    async def get_threads(session, redis, user_id=None, id=None): ...
+
+key由除session、redis以外的参数组成。redis_lock=True时再用redis锁在worker之间合并：
+拿到锁的worker执行并把结果用orjson写进redis（不用pickle，redis里的东西不能当代码执行），
+其他worker轮询结果，锁没了还没等到就自己执行。结果不是orjson能直接处理的类型时传encode/decode，
+比如Row的列表用pyforum.rows.pack_rows/unpack_rows。
+合并了多少次记在指标pyforum_singleflight_calls_total里。
+"""
+import asyncio
+import hashlib
+import inspect
+import secrets
+from functools import partial, wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+import orjson
+from redis.asyncio import Redis
+
+from pyforum.config import settings
+from pyforum.metrics import registry
+
+
+def _freeze(value: Any) -> Hashable:
+    """参数转成可以当dict key的样子，不可哈希的对象按身份区分"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    try:
+        hash(value)
+    except TypeError:
+        return ("id", id(value))  # 执行期间参数一直被引用着，id不会被复用
+    return value
+
+
+def _same(value: Any) -> Any:
+    return value
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        name: str,
+        encode: Callable[[Any], Any] = _same,
+        decode: Callable[[Any], Any] = _same,
+    ):
+        self.name = name
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.encode = encode
+        self.decode = decode
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        future = self.inflight.get(key)
+        if future is not None:
+            registry.observe_singleflight(self.name, "merged")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            return await fn()  # 执行的那个被取消了，自己来
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        registry.observe_singleflight(self.name, "leader")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有人等的时候别报never retrieved
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.inflight[key]
+
+    async def do_remote(self, redis: Redis, key: Hashable, fn: Callable[[], Awaitable]):
+        """worker之间合并，配合do使用，每个worker只有一个调用会走到这里"""
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        lock = f"{settings.singleflight_prefix}{self.name}:{digest}"
+        ttl = settings.singleflight_lock_ttl
+        token = secrets.token_hex(8)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ttl / 1000
+        while loop.time() < deadline:
+            if await redis.set(lock, token, nx=True, px=ttl):
+                try:
+                    result = await fn()
+                    await redis.set(
+                        f"{lock}:{token}", orjson.dumps(self.encode(result)), px=ttl
+                    )
+                    return result
+                finally:
+                    if await redis.get(lock) == token.encode():
+                        await redis.delete(lock)
+            holder = await redis.get(lock)
+            while holder is not None:
+                # 先看锁再看结果，锁释放之前结果一定已经写进去了
+                released = await redis.get(lock) != holder
+                data = await redis.get(f"{lock}:{holder.decode()}")
+                if data is not None:
+                    registry.observe_singleflight(self.name, "remote")
+                    return self.decode(orjson.loads(data))
+                if released or loop.time() >= deadline:
+                    break  # 执行的worker失败了或者锁过期了，重新抢锁
+                await asyncio.sleep(settings.singleflight_poll_interval / 1000)
+        return await fn()
+
+
+def singleflight(
+    name: str = None,
+    ignore: Iterable[str] = ("session", "redis"),
+    redis_lock: bool = False,
+    encode: Optional[Callable[[Any], Any]] = None,
+    decode: Optional[Callable[[Any], Any]] = None,
+):
+    """
+    装饰async函数，同样参数的并发调用合并成一次
+    :param name: 指标里的名字，默认是函数名
+    :param ignore: 不算进key的参数，session这类每个请求都不一样的
+    :param redis_lock: 是否在worker之间也合并，函数要有redis参数，结果要能orjson序列化
+    :param encode: 写进redis之前转成orjson能处理的结构
+    :param decode: 从redis读出来之后转回去
+    """
+    ignore = frozenset(ignore)
+
+    def deco(func):
+        sig = inspect.signature(func)
+        flight = SingleFlight(
+            name or func.__qualname__, encode or _same, decode or _same
+        )
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(
+                (k, _freeze(v)) for k, v in bound.arguments.items() if k not in ignore
+            )
+            call = partial(func, *args, **kwargs)
+            if redis_lock:
+                call = partial(flight.do_remote, bound.arguments["redis"], key, call)
+            return await flight.do(key, call)
+
+        wrapper.flight = flight
+        return wrapper
+
+    return deco
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+sqlite的生产模式，settings.sqlite_production_mode打开
+
+    每个连接建立时设置WAL、synchronous=NORMAL、mmap_size、cache_size、busy_timeout
+    读  只读连接池（mode=ro），作为pyforum.replicas里的副本，只读的路由用；副本不可用时也不回到写连接
+    写  每个worker只有一个写连接，由SQLiteWriter排队轮流使用，别的地方不要直接从写的engine拿连接
+
+get_db_session拿到的是WriterSession：第一次访问数据库时排队拿到写连接，在外层事务里开一个SAVEPOINT，
+commit()只是释放SAVEPOINT，然后把写连接交给下一个排队的session，等这一批一起COMMIT之后才返回（group commit）。
+排队的没有了或者攒够sqlite_group_commit_size个就提交一次，不忙的时候不增加延迟。
+一个session的SAVEPOINT失败只回滚自己，外层COMMIT失败时这一批的commit()都抛异常。
+crud里的代码不用改，commit之后再访问数据库会重新排队。
+后台任务（loginlog、signs、counters、unread）拿到的是SQLiteWriter本身，它的begin()/connect()和AsyncEngine一样用，
+也是排队拿到写连接后开SAVEPOINT，和请求的写一起提交。
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Dialect, make_url
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.config import settings
+
+
+def _set_pragmas(engine: AsyncEngine, wal: bool):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal:  # 写在数据库文件里，只读连接改不了
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+        cursor.close()
+
+
+def read_only_dsn(dsn: str) -> str:
+    """同一个文件的只读连接"""
+    url = make_url(dsn)
+    if not url.database or url.database == ":memory:":
+        raise ValueError("sqlite production mode needs a database file")
+    return url.set(
+        database=f"file:{url.database}?mode=ro", query={**url.query, "uri": "true"}
+    ).render_as_string(hide_password=False)
+
+
+def setup_engines(writer: AsyncEngine, reader: AsyncEngine):
+    """writer要用pool_size=1, max_overflow=0创建"""
+    _set_pragmas(writer, True)
+    _set_pragmas(reader, False)
+
+
+class Turn:
+    __slots__ = ("granted", "released", "committed")
+
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.granted: asyncio.Future = loop.create_future()  # 拿到写连接
+        self.released: asyncio.Future = loop.create_future()  # 用完了，结果是要不要提交
+        self.committed: asyncio.Future = loop.create_future()  # 这一批提交了
+
+
+class SQLiteWriter:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.queue: "asyncio.Queue[Turn]" = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.commits = 0  # 一共COMMIT了几次，测试和压测看合并的效果
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def acquire(self) -> Tuple[Turn, AsyncConnection]:
+        turn = Turn()
+        self.queue.put_nowait(turn)
+        try:
+            conn = await turn.granted
+        except asyncio.CancelledError:
+            if turn.granted.done() and not turn.granted.cancelled():
+                turn.released.set_result(False)  # 刚拿到就被取消了，还回去
+            raise
+        return turn, conn
+
+    @property
+    def dialect(self) -> Dialect:
+        return self.engine.dialect
+
+    @asynccontextmanager
+    async def begin(self) -> AsyncIterator[AsyncConnection]:
+        """代替AsyncEngine.begin()，正常退出时等这一批提交完，异常时只回滚自己的SAVEPOINT"""
+        turn, conn = await self.acquire()
+        commit = False
+        try:
+            async with conn.begin_nested():
+                yield conn
+            commit = True
+        finally:
+            turn.released.set_result(commit)
+        await turn.committed
+
+    connect = begin  # 只读的查询也只能用写连接，同样排队
+
+    async def _run(self):
+        while True:
+            turn = await self.queue.get()
+            try:
+                async with self.engine.connect() as conn:
+                    await conn.begin()
+                    batch = []
+                    while True:
+                        if not turn.granted.cancelled():  # 排队时被取消了的跳过
+                            turn.granted.set_result(conn)
+                            if await turn.released:
+                                batch.append(turn)
+                        if (
+                            len(batch) >= settings.sqlite_group_commit_size
+                            or self.queue.empty()
+                        ):
+                            break
+                        turn = self.queue.get_nowait()
+                    try:
+                        await conn.commit()
+                        self.commits += 1
+                    except Exception as e:
+                        for t in batch:
+                            t.committed.set_exception(e)
+                    else:
+                        for t in batch:
+                            t.committed.set_result(None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # 连不上数据库
+                if not turn.granted.done():
+                    turn.granted.set_exception(e)
+
+
+class WriterSession(AsyncSession):
+    """
+    AsyncSession的替代，访问数据库前先排队拿到写连接，见模块说明
+    """
+
+    def __init__(self, writer: SQLiteWriter, **kwargs):
+        super().__init__(join_transaction_mode="create_savepoint", **kwargs)
+        self.writer = writer
+        self._turn: Optional[Turn] = None
+
+    async def _acquire(self):
+        if self._turn is None:
+            self._turn, conn = await self.writer.acquire()
+            self.sync_session.bind = conn.sync_connection
+
+    def get_bind(self, *args, **kwargs):
+        if self._turn is None:  # 还没排到，只是看看是什么数据库
+            return self.writer.engine.sync_engine
+        return super().get_bind(*args, **kwargs)
+
+    async def _release(self, commit: bool):
+        turn, self._turn = self._turn, None
+        if turn is not None:
+            turn.released.set_result(commit)
+            if commit:
+                await turn.committed
+
+    async def commit(self) -> None:
+        await self._acquire()
+        await super().commit()
+        await self._release(True)
+
+    async def rollback(self) -> None:
+        await super().rollback()
+        await self._release(False)
+
+    async def close(self) -> None:
+        try:
+            await super().close()
+        finally:
+            await self._release(False)
+
+
+def _with_turn(name: str):
+    method = getattr(AsyncSession, name)
+
+    async def wrapper(self: WriterSession, *args, **kwargs):
+        await self._acquire()
+        return await method(self, *args, **kwargs)
+
+    wrapper.__name__ = wrapper.__qualname__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in (
+    "exec",
+    "execute",
+    "scalar",
+    "scalars",
+    "get",
+    "get_one",
+    "refresh",
+    "merge",
+    "delete",
+    "flush",
+    "stream",
+    "stream_scalars",
+    "connection",
+    "run_sync",
+):
+    setattr(WriterSession, _name, _with_turn(_name))
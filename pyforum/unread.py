@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+板块的未读帖子数
+
+redis里：
+    {prefix}total       hash，板块 -> 帖子序号，发帖时HINCRBY，是每个板块的高水位
+    {prefix}loaded      total从数据库加载过，redis清空过的话没有这个key，第一个发现的按read表COUNT重新加载
+    {prefix}user:{id}   hash，板块 -> 用户上次看这个板块时的帖子序号，"_"字段表示从thread_seen加载过；
+                        unread_ttl秒没访问就过期，下次从数据库加载
+    {prefix}dirty       set，看过板块、还没写回thread_seen的用户
+未读数 = 高水位 - 看过的序号，所有板块一个pipeline算完。看板块时一个lua脚本把高水位抄进用户的hash，
+每unread_flush_interval秒把dirty的用户写回thread_seen。
+删帖不减序号，未读数是个上限；加载total时正好有人发帖的话可能多算一个。
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence
+
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.config import settings
+from pyforum.models import Read, Thread, ThreadSeen, User
+from pyforum.upsert import insert_for
+
+logger = logging.getLogger(__name__)
+
+# KEYS total、loaded、用户的hash、dirty
+# ARGV thread_id、user_id、ttl
+# 返回 -1 total没加载，-2 用户没加载，否则是看到的序号
+_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then return -1 end
+if redis.call('EXISTS', KEYS[3]) == 0 then return -2 end
+local total = redis.call('HGET', KEYS[1], ARGV[1]) or '0'
+redis.call('HSET', KEYS[3], ARGV[1], total)
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+redis.call('SADD', KEYS[4], ARGV[2])
+return tonumber(total)
+"""
+
+_script: Optional[AsyncScript] = None
+
+
+def _key(name: str) -> str:
+    return f"{settings.unread_prefix}{name}"
+
+
+def _user_key(user_id: int) -> str:
+    return f"{settings.unread_prefix}user:{user_id}"
+
+
+async def _load_totals(session: AsyncSession, redis: Redis):
+    if not await redis.set(_key("loaded"), 1, nx=True):
+        return  # 别的请求在加载
+    try:
+        counts = (
+            await session.exec(
+                select(Read.thread_id, func.count()).group_by(Read.thread_id)
+            )
+        ).all()
+        async with redis.pipeline(transaction=False) as pipe:
+            for thread_id, count in counts:
+                pipe.hincrby(_key("total"), thread_id, count)
+            await pipe.execute()
+    except Exception:
+        await redis.delete(_key("loaded"))
+        raise
+
+
+async def _load_user(session: AsyncSession, redis: Redis, user_id: int):
+    rows = (
+        await session.exec(
+            select(ThreadSeen.thread_id, ThreadSeen.seen).where(
+                ThreadSeen.user_id == user_id
+            )
+        )
+    ).all()
+    key = _user_key(user_id)
+    async with redis.pipeline(transaction=False) as pipe:
+        # 加载的时候用户又看了别的板块的话，不要拿数据库里旧的盖掉
+        for thread_id, seen in rows:
+            pipe.hsetnx(key, thread_id, seen)
+        pipe.hsetnx(key, "_", 1)
+        pipe.expire(key, settings.unread_ttl)
+        await pipe.execute()
+
+
+async def on_post(redis: Redis, thread_id: int):
+    """发帖之后调用，抬高板块的高水位"""
+    await redis.hincrby(_key("total"), thread_id, 1)
+
+
+async def get_unread(
+    session: AsyncSession, redis: Redis, user_id: int, thread_ids: Sequence[int]
+) -> Dict[int, int]:
+    """各个板块的未读数，从没看过的板块全都算未读"""
+    if not thread_ids:
+        return {}
+    key = _user_key(user_id)
+    for _ in range(2):
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.exists(_key("loaded"))
+            pipe.hmget(_key("total"), thread_ids)
+            pipe.hmget(key, ["_", *thread_ids])
+            pipe.expire(key, settings.unread_ttl)
+            loaded, totals, seen, _ = await pipe.execute()
+        if loaded and seen[0] is not None:
+            break
+        if not loaded:
+            await _load_totals(session, redis)
+        if seen[0] is None:
+            await _load_user(session, redis, user_id)
+    return {
+        thread_id: max(int(total or 0) - int(s or 0), 0)
+        for thread_id, total, s in zip(thread_ids, totals, seen[1:])
+    }
+
+
+async def mark_seen(
+    session: AsyncSession, redis: Redis, user_id: int, thread_id: int
+) -> int:
+    """用户看了这个板块，返回板块当前的序号"""
+    global _script
+    if _script is None:
+        _script = redis.register_script(_LUA)
+    keys = [_key("total"), _key("loaded"), _user_key(user_id), _key("dirty")]
+    for _ in range(3):
+        ret = await _script(
+            keys=keys, args=[thread_id, user_id, settings.unread_ttl], client=redis
+        )
+        if ret == -1:
+            await _load_totals(session, redis)
+        elif ret == -2:
+            await _load_user(session, redis, user_id)
+        else:
+            break
+    return ret
+
+
+async def flush(redis: Redis, engine: AsyncEngine) -> int:
+    """把看过的板块写回thread_seen，返回写了多少个用户"""
+    total = 0
+    while True:
+        user_ids = [
+            int(i) for i in await redis.spop(_key("dirty"), settings.unread_flush_batch)
+        ]
+        if not user_ids:
+            return total
+        async with redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(_user_key(user_id))
+            results = await pipe.execute()
+        rows: List[dict] = [
+            {"user_id": user_id, "thread_id": int(thread_id), "seen": int(seen)}
+            for user_id, hash_ in zip(user_ids, results)
+            for thread_id, seen in hash_.items()
+            if thread_id != b"_"
+        ]
+        try:
+            if rows:
+                async with engine.begin() as conn:
+                    # 删掉的板块和用户写不进去，跳过
+                    threads = set(
+                        (
+                            await conn.scalars(
+                                select(Thread.id).where(
+                                    Thread.id.in_({r["thread_id"] for r in rows})
+                                )
+                            )
+                        ).all()
+                    )
+                    users = set(
+                        (
+                            await conn.scalars(
+                                select(User.id).where(User.id.in_(user_ids))
+                            )
+                        ).all()
+                    )
+                    rows = [
+                        r
+                        for r in rows
+                        if r["thread_id"] in threads and r["user_id"] in users
+                    ]
+                    if rows:
+                        stmt = insert_for(conn)(ThreadSeen)
+                        await conn.execute(
+                            stmt.on_conflict_do_update(
+                                index_elements=[
+                                    ThreadSeen.user_id,
+                                    ThreadSeen.thread_id,
+                                ],
+                                set_={"seen": stmt.excluded.seen},
+                            ),
+                            rows,
+                        )
+        except Exception:
+            await redis.sadd(_key("dirty"), *user_ids)  # 下次再试
+            raise
+        total += len(user_ids)
+
+
+async def flush_forever(redis: Redis, engine: AsyncEngine):
+    while True:
+        await asyncio.sleep(settings.unread_flush_interval)
+        try:
+            await flush(redis, engine)
+        except Exception:  # 数据库临时不可用时不要让后台任务退出
+            logger.exception("failed to flush unread markers")
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+靠数据库的唯一约束判重，不再先SELECT/COUNT一遍再写
+
+    on_conflict  直接INSERT/UPDATE，唯一约束冲突时回滚并变成409，少一次查询，也没有先查后写的竞争
+    insert_for   当前数据库的insert()，带on_conflict_do_update，sqlite和PostgreSQL都支持
+
+用到的唯一索引见pyforum.models和alembic里的迁移
+"""
+import re
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+# PostgreSQL的DETAIL：Key (name, email)=(...) already exists.
+_KEY = re.compile(r"Key \((.+?)\)=\(")
+
+
+def insert_for(bind: Union[AsyncSession, AsyncConnection]):
+    if isinstance(bind, AsyncConnection):
+        name = bind.dialect.name
+    else:
+        name = bind.get_bind().dialect.name
+    try:
+        return _INSERTS[name]
+    except KeyError:
+        raise NotImplementedError(f"upsert is not supported on {name}") from None
+
+
+def unique_violation(e: IntegrityError) -> Optional[List[str]]:
+    """唯一约束冲突时返回冲突的列名（认不出来时是空列表）；外键、非空之类的返回None"""
+    orig = e.orig
+    if "23505" in (getattr(orig, "sqlstate", None), getattr(orig, "pgcode", None)):
+        # psycopg的信息在orig.diag，asyncpg的在orig.__cause__
+        source = getattr(orig, "diag", None) or orig.__cause__ or orig
+        constraint = getattr(source, "constraint_name", None)
+        if constraint and (columns := _constraint_columns(constraint)):
+            return columns
+        detail = getattr(source, "message_detail", None) or getattr(
+            source, "detail", None
+        )
+        if detail and (m := _KEY.match(detail)):
+            return [c.strip() for c in m.group(1).split(",")]
+        return []
+    message = str(orig)
+    if message.startswith("UNIQUE constraint failed: "):  # sqlite: 表.列, 表.列
+        columns = message[len("UNIQUE constraint failed: ") :].split(", ")
+        return [c.rsplit(".", 1)[-1] for c in columns]
+    return None
+
+
+def _constraint_columns(name: str) -> List[str]:
+    """按pyforum.models里的索引和唯一约束名找列"""
+    for table in SQLModel.metadata.tables.values():
+        for item in (*table.indexes, *table.constraints):
+            if item.name == name:
+                return [c.name for c in item.columns]
+    return []
+
+
+@asynccontextmanager
+async def on_conflict(session: AsyncSession, detail: Union[str, Dict[str, str]]):
+    """
+    里面的语句违反唯一约束时回滚，抛409
+    :param detail: 409的说明；{列名: 说明}时按冲突的列选，都对不上就用第一个
+    """
+    try:
+        yield
+    except IntegrityError as e:
+        columns = unique_violation(e)
+        if columns is None:
+            raise
+        await session.rollback()
+        if isinstance(detail, dict):
+            detail = next(
+                (d for column, d in detail.items() if column in columns),
+                next(iter(detail.values())),
+            )
+        raise HTTPException(status_code=409, detail=detail) from e
@@ -2,21 +2,38 @@
 """
 Copyright (c) 2008-2023 synodriver <diguohuangjiajinweijun@gmail.com>
 """
-import asyncio
 import random
-from email.header import Header
-from email.mime.text import MIMEText
-from email.utils import formataddr, parseaddr
+from functools import lru_cache
 from io import BytesIO
-from typing import Tuple
-
-import aiosmtplib
-from captcha.image import ImageCaptcha
-from passlib.context import CryptContext
+from typing import TYPE_CHECKING, Tuple
 
 from pyforum.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# captcha(PIL) passlib aiosmtplib 都比较重，第一次用到的时候才import，worker启动更快
+if TYPE_CHECKING:
+    from captcha.image import ImageCaptcha
+    from passlib.context import CryptContext
+
+
+class LazyCryptContext:
+    """第一次hash/verify的时候才创建CryptContext"""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._context = None
+
+    def load(self) -> "CryptContext":
+        if self._context is None:
+            from passlib.context import CryptContext
+
+            self._context = CryptContext(**self._kwargs)
+        return self._context
+
+    def __getattr__(self, name: str):
+        return getattr(self.load(), name)
+
+
+pwd_context = LazyCryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 def ensure_str(data):
@@ -40,6 +57,10 @@ async def send_email(
     if settings.debug:
         print(content)
     else:
+        from email.mime.text import MIMEText
+
+        import aiosmtplib
+
         msg = MIMEText(content, "plain", "utf-8")
         msg["From"] = fromaddr
         msg["To"] = to
@@ -54,13 +75,22 @@ async def send_email(
             await smtp.send_message(msg)
 
 
-image = ImageCaptcha()
 seed = "1234567890abcdefghijkmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 
+@lru_cache(maxsize=None)
+def get_image_captcha() -> "ImageCaptcha":
+    """整个进程共用一个ImageCaptcha，字体只加载一次"""
+    from captcha.image import ImageCaptcha
+
+    image = ImageCaptcha()
+    image.truefonts  # 字体是第一次用到时才读文件的，这里一起加载
+    return image
+
+
 def generate_captcha(num: int) -> Tuple[BytesIO, str]:
     captcha_str = "".join(random.choice(seed) for _ in range(num))
-    image = ImageCaptcha().generate_image(captcha_str)
+    image = get_image_captcha().generate_image(captcha_str)
     buffer = BytesIO()
     image.save(buffer, "jpeg")
     buffer.seek(0, 0)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import counters
+from pyforum.config import settings
+from pyforum.models import Read, Thread, User
+from pyforum.rows import columns
+
+
+class TestCounters(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [SQLModel.metadata.tables[n] for n in ("user", "thread", "read")]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(User(id=1, name="1", password=""))
+            session.add(Thread(id=1, name="1", description=""))
+            await session.flush()
+            for i in range(1, 4):
+                session.add(Read(id=i, user_id=1, thread_id=1, name=str(i)))
+            await session.commit()
+        self.redis = fakeredis.FakeAsyncRedis()
+
+    async def asyncTearDown(self):
+        await self.redis.aclose()
+        await self.engine.dispose()
+
+    async def reads(self):
+        async with AsyncSession(self.engine) as session:
+            return (await session.exec(select(*columns(Read)).order_by(Read.id))).all()
+
+    async def test_record_and_flush(self):
+        for v in ("u1", "u1", "u2", "ip1.2.3.4"):
+            pending, visitors = await counters.record_view(self.redis, 1, v)
+        self.assertEqual((pending, visitors), (4, 3))
+        await counters.record_view(self.redis, 2, "u1")
+        before = await self.reads()
+        self.assertEqual(
+            await counters.get_counts(self.redis, before), [(4, 3), (1, 1), (0, 0)]
+        )
+
+        with patch.object(settings, "counter_flush_batch", 1):
+            self.assertEqual(await counters.flush(self.redis, self.engine), 2)
+        after = await self.reads()
+        self.assertEqual(
+            [(r.views, r.visitors) for r in after], [(4, 3), (1, 1), (0, 0)]
+        )
+        self.assertEqual(
+            [r.update_time for r in after], [r.update_time for r in before]
+        )
+        # 写回之后redis里只剩HLL，总数不变，再写一次也不会重复加
+        self.assertEqual(
+            await counters.get_counts(self.redis, after), [(4, 3), (1, 1), (0, 0)]
+        )
+        self.assertEqual(await counters.flush(self.redis, self.engine), 0)
+
+        await counters.record_view(self.redis, 1, "u3")
+        await counters.flush(self.redis, self.engine)
+        read = (await self.reads())[0]
+        self.assertEqual((read.views, read.visitors), (5, 4))
+
+    async def test_hll_lost(self):
+        """redis清空过，HLL变小了，不能把数据库里的独立访客数盖小"""
+        for v in ("u1", "u2", "u3"):
+            await counters.record_view(self.redis, 1, v)
+        await counters.flush(self.redis, self.engine)
+        await self.redis.delete(counters._visitors_key(1))
+        await counters.record_view(self.redis, 1, "u4")
+        self.assertEqual(await counters.flush(self.redis, self.engine), 1)
+        read = (await self.reads())[0]
+        self.assertEqual((read.views, read.visitors), (4, 3))
+
+    async def test_flush_failed(self):
+        await counters.record_view(self.redis, 1, "u1")
+        with patch.object(counters, "_write", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                await counters.flush(self.redis, self.engine)
+        # 加回去了，下次还能写
+        self.assertEqual(await counters.flush(self.redis, self.engine), 1)
+        self.assertEqual((await self.reads())[0].views, 1)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import math
+import os
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+
+from pyforum import hot
+from pyforum.config import settings
+
+
+class TestHot(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis()
+        hot._script = None
+        self.now = settings.hot_epoch + 100 * settings.hot_half_life
+
+    async def asyncTearDown(self):
+        hot._script = None
+        await self.redis.aclose()
+
+    async def test_decay(self):
+        h = settings.hot_half_life
+        # 1号一个半衰期之前有4次浏览，现在相当于2次；2号现在3次
+        for _ in range(4):
+            await hot.record(self.redis, 1, 1, 1, self.now - h)
+        for _ in range(3):
+            await hot.record(self.redis, 2, 2, 1, self.now)
+        self.assertEqual(await hot.top(self.redis, None, 10), [2, 1])
+        self.assertEqual(await hot.top(self.redis, 1, 10), [1])
+        score = await self.redis.zscore(hot._key(None), 1)
+        self.assertAlmostEqual(score, hot.score_of(2, self.now), places=6)
+        # 1号再来2次就超过了
+        for _ in range(2):
+            await hot.record(self.redis, 1, 1, 1, self.now)
+        self.assertEqual(await hot.top(self.redis, None, 10), [1, 2])
+        self.assertAlmostEqual(
+            2 ** (await self.redis.zscore(hot._key(None), 1) - 100), 4, places=6
+        )
+        self.assertFalse(math.isinf(hot.score_of(1, self.now + 10**6 * h)))
+
+    async def test_prune(self):
+        with patch.object(settings, "hot_size", 3):
+            for i in range(1, 6):
+                await hot.record(self.redis, i, 1, i, self.now)
+        self.assertEqual(await hot.top(self.redis, 1, 10), [5, 4, 3])
+        self.assertEqual(await self.redis.zcard(hot._key(None)), 3)
+        await hot.discard(self.redis, 1, [4])
+        self.assertEqual(await hot.top(self.redis, 1, 10), [5, 3])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+
+用 -X importtime 检查 import pyforum 的耗时，每个gunicorn worker启动都要付这笔钱
+预算可以用环境变量 PYFORUM_IMPORT_BUDGET_MS 调整
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+from unittest import TestCase
+
+# 只在第一次用到时才加载的模块
+LAZY_MODULES = ("captcha", "PIL", "passlib", "aiosmtplib", "jinja2")
+BUDGET_MS = int(os.getenv("PYFORUM_IMPORT_BUDGET_MS", "2000"))
+
+
+def import_report(module: str = "pyforum") -> Dict[str, Tuple[int, int]]:
+    """module -> (self us, cumulative us)"""
+    env = dict(os.environ)
+    env.setdefault("sqlite", "sqlite+aiosqlite://")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent.parent,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        report[name.strip()] = (int(self_us), int(cumulative_us))
+    return report
+
+
+def slowest(report: Dict[str, Tuple[int, int]], n: int = 15) -> List[str]:
+    items = sorted(report.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+    return [f"{self_us / 1000:8.1f}ms {name}" for name, (self_us, _) in items]
+
+
+class TestImportTime(TestCase):
+    def test_heavy_modules_are_lazy(self):
+        report = import_report()
+        loaded = [name for name in report if name.split(".")[0] in LAZY_MODULES]
+        self.assertEqual(loaded, [], "these should be imported on first use")
+
+    def test_import_budget(self):
+        report = import_report()
+        total_ms = report["pyforum"][1] / 1000
+        self.assertLess(
+            total_ms,
+            BUDGET_MS,
+            "import pyforum took {:.0f}ms, slowest:\n{}".format(
+                total_ms, "\n".join(slowest(report))
+            ),
+        )
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+import re
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import loginlog
+from pyforum.depends import check_user_auth_for_reads, check_user_auth_for_threads
+from pyforum.models import (
+    Group,
+    Item,
+    Read,
+    ReadAuth,
+    Sign,
+    Thread,
+    ThreadAuth,
+    User,
+    UserGroupLink,
+    UserItemLink,
+)
+from pyforum.routers.admin import crud as admin
+from pyforum.routers.admin.models import PatchUser
+from pyforum.routers.user import crud as user
+from pyforum.routers.user.models import UserSetProfile
+from pyforum.utils import pwd_context
+
+N = 200
+
+
+class TestIndexes(IsolatedAsyncioTestCase):
+    """
+    在有数据的库里跑一遍crud，每条带WHERE的语句都EXPLAIN，不能有全表扫描
+    view的crud要PostGIS，search_user_or_group是LIKE '%x%'，本来就用不了索引，不在这里
+    """
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [t for n, t in SQLModel.metadata.tables.items() if n != "address"]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        password = pwd_context.hash("password")
+        async with AsyncSession(self.engine) as session:
+            for i in range(1, N + 1):
+                session.add(
+                    User(id=i, name=f"user{i}", email=f"{i}@a.com", password=password)
+                )
+                session.add(Group(id=i, name=f"group{i}"))
+                session.add(Item(id=i, name=f"item{i}"))
+                session.add(Thread(id=i, name=f"thread{i}", description=""))
+            await session.flush()
+            for i in range(1, N):  # 第N个没有关联的数据，用来测删除
+                session.add(ThreadAuth(thread_id=i, item_id=i, count=1))
+                session.add(UserItemLink(user_id=i, item_id=i, count=1))
+                session.add(UserGroupLink(user_id=i, group_id=i))
+                session.add(Sign(user_id=i, year=2024, month=1))
+                session.add(Read(id=i, user_id=i, thread_id=i, name=f"read{i}"))
+            await session.flush()
+            for i in range(1, N, 2):
+                session.add(ReadAuth(read_id=i, item_id=i, count=1))
+            await session.commit()
+        self.statements = []
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and re.search(r"\bWHERE\b", statement):
+            self.statements.append((statement, parameters))
+
+    async def asyncTearDown(self):
+        loginlog._buffer.clear()
+        await self.engine.dispose()
+
+    async def run_crud(self):
+        calls = [
+            lambda s: admin.get_user_groups(s, group_id=1),
+            lambda s: admin.get_user_groups(s, name="group1"),
+            lambda s: admin.add_user_group(s, "newgroup", ""),
+            lambda s: admin.patch_user_group(s, 2, name="group2x", description=""),
+            lambda s: admin.add_user(s, "newuser", "new@a.com", "password"),
+            lambda s: admin.get_user(s, id=1),
+            lambda s: admin.get_user(s, name="user1"),
+            lambda s: admin.patch_user(
+                s, PatchUser(id=3, name="user3x", email="3x@a.com", activated=False)
+            ),
+            lambda s: admin.user_add_group(s, 1, 2),
+            lambda s: admin.user_del_group(s, 1, 2),
+            lambda s: admin.user_get_group(s, 1),
+            lambda s: admin.add_item_class(s, "newitem", ""),
+            lambda s: admin.get_item_class(s, 1),
+            lambda s: admin.patch_item_class(s, 2, name="item2x", description=""),
+            lambda s: admin.user_add_item(s, 1, 1),
+            lambda s: admin.user_del_item(s, 1, 1),
+            lambda s: admin.user_get_item(s, 1),
+            lambda s: admin.add_thread(s, "newthread", ""),
+            lambda s: admin.get_thread(s, id=1),
+            lambda s: admin.get_thread(s, name="thread1"),
+            lambda s: admin.patch_thread(s, 2, name="thread2x", description=""),
+            lambda s: admin.del_thread(s, N),
+            lambda s: admin.del_item_class(s, N, deluser=True),
+            lambda s: admin.del_user_groups(s, N - 1),
+            lambda s: user.verify_password_login(
+                s, SimpleNamespace(client=None), "password", username="user7"
+            ),
+            lambda s: user.verify_password_login(
+                s, SimpleNamespace(client=None), "password", email="7@a.com"
+            ),
+            lambda s: user.handle_signup(s, "signup", "signup@a.com", "password"),
+            lambda s: user.handle_setprofile(
+                s, 8, UserSetProfile(name="user8x", sign=""), "8x@a.com"
+            ),
+            lambda s: user.handle_getprofile(s, 8),
+            lambda s: user.get_user_by_name(s, "user9"),
+            lambda s: user.get_user_by_email(s, "9@a.com"),
+            lambda s: user.handle_sign(s, 10, 2024, 1, 2),
+            lambda s: user.handle_get_sign(s, 10),
+            lambda s: check_user_auth_for_threads(
+                s, [SimpleNamespace(id=i) for i in (1, 2, 3)], 1
+            ),
+            lambda s: check_user_auth_for_reads(
+                s, [SimpleNamespace(id=i) for i in (1, 2, 3)], 1
+            ),
+        ]
+        for call in calls:
+            async with AsyncSession(self.engine) as session:
+                await call(session)
+
+    async def test_index_scan(self):
+        await self.run_crud()
+        event.remove(self.engine.sync_engine, "before_cursor_execute", self.record)
+        self.assertTrue(self.statements)
+        async with self.engine.connect() as conn:
+            for statement, parameters in self.statements:
+                plan = (
+                    await conn.exec_driver_sql(
+                        f"EXPLAIN QUERY PLAN {statement}", parameters
+                    )
+                ).all()
+                scans = [
+                    row[3]
+                    for row in plan
+                    if row[3].startswith("SCAN ") and row[3] != "SCAN CONSTANT ROW"
+                ]
+                with self.subTest(statement=statement):
+                    self.assertEqual(scans, [])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
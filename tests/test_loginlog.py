@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import loginlog
+from pyforum.models import LoginHistory, User
+
+
+class TestLoginLog(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [SQLModel.metadata.tables[n] for n in ("user", "login_history")]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(User(id=1, name="a", password=""))
+            session.add(User(id=2, name="b", password=""))
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_flush(self):
+        loginlog.record_login(1, "10.0.0.1")
+        loginlog.record_login(2, "10.0.0.2")
+        loginlog.record_login(1, "10.0.0.3")
+        self.assertEqual(await loginlog.flush(self.engine), 3)
+        self.assertEqual(await loginlog.flush(self.engine), 0)
+        async with AsyncSession(self.engine) as session:
+            history = (await session.exec(select(LoginHistory))).all()
+            users = {u.id: u for u in (await session.exec(select(User))).all()}
+        self.assertEqual([h.ip for h in history], ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+        self.assertEqual(users[1].last_ip, "10.0.0.3")  # 最新的一条
+        self.assertEqual(users[2].last_ip, "10.0.0.2")
+        self.assertEqual(
+            users[1].last_login.replace(tzinfo=None),
+            history[2].login_time.replace(tzinfo=None),
+        )
+
+    async def test_retry(self):
+        """写失败的下次再写"""
+        await self.engine.dispose()
+        broken = create_async_engine("sqlite+aiosqlite:///nonexistent/dir/x.db")
+        loginlog.record_login(1, "10.0.0.1")
+        with self.assertRaises(Exception):
+            await loginlog.flush(broken)
+        await broken.dispose()
+        self.assertEqual(len(loginlog._buffer), 1)
+        loginlog._buffer.clear()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+import sys
+import tracemalloc
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from pyforum.memory import rss, run_local
+
+
+class TestMemory(IsolatedAsyncioTestCase):
+    async def test_stats(self):
+        data = await run_local("stats")
+        self.assertGreater(data["rss"], 0)
+        self.assertEqual(len(data["gc_threshold"]), 3)
+        self.assertIn(":", data["worker"])
+
+    async def test_rss_fallback(self):
+        """没有/proc用ru_maxrss，连resource都没有时是None"""
+        with patch("builtins.open", side_effect=OSError):
+            self.assertGreater(rss(), 0)
+            with patch.dict(sys.modules, {"resource": None}):
+                self.assertIsNone(rss())
+
+    async def test_snapshot(self):
+        first = await run_local("snapshot")
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertNotIn("top", first)
+        self.keep = [bytearray(1024) for _ in range(100)]
+        second = await run_local("snapshot", 5)
+        self.assertLessEqual(len(second["top"]), 5)
+        third = await run_local("snapshot", 5)
+        self.assertIn("diff", third)
+        await run_local("stop")
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
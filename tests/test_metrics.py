@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from pyforum.config import settings
+from pyforum.metrics import (
+    MetricsMiddleware,
+    Registry,
+    RequestStats,
+    instrument_redis,
+    registry,
+    render,
+)
+from pyforum.routers import metrics
+
+
+class TestRegistry(TestCase):
+    def test_merge_workers(self):
+        a, b = Registry(), Registry()
+        stats = RequestStats()
+        stats.db_count, stats.db_time_ns = 3, 2_000_000
+        a.observe_request("GET", "/x", 200, 3_000_000, stats)
+        b.observe_request("GET", "/x", 500, 20_000_000, RequestStats())
+        b.observe_redis("GET", 100_000)
+        b.inflight = 2
+        merged = Registry()
+        merged.merge(a.snapshot())
+        merged.merge(b.snapshot())
+        self.assertEqual(merged.http_latency[("GET", "/x")].count, 2)
+        self.assertEqual(merged.http_requests[("GET", "/x", "500")], 1)
+        self.assertEqual(merged.http_errors[("GET", "/x")], 1)
+        self.assertEqual(merged.db_queries[("GET", "/x")], 3)
+        self.assertEqual(merged.inflight, 2)
+        text = render(merged)
+        self.assertIn(
+            'pyforum_http_request_duration_seconds_bucket{method="GET",route="/x",le="0.005"} 1',
+            text,
+        )
+        self.assertIn(
+            'pyforum_http_request_duration_seconds_count{method="GET",route="/x"} 2',
+            text,
+        )
+        self.assertIn(
+            'pyforum_redis_command_duration_seconds_count{command="GET"} 1', text
+        )
+
+
+class TestMiddleware(IsolatedAsyncioTestCase):
+    async def test_route_template(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get("/item/{id}")
+        async def _(id: int):
+            return {"id": id}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            await client.get("/item/1")
+            await client.get("/item/2")
+            await client.get("/nothing")
+        self.assertEqual(registry.http_requests[("GET", "/item/{id}", "200")], 2)
+        self.assertEqual(registry.http_requests[("GET", "unmatched", "404")], 1)
+        self.assertEqual(registry.inflight, 0)
+
+    async def test_redis(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+        redis = instrument_redis(fakeredis.FakeAsyncRedis())
+
+        @app.get("/redis")
+        async def _():
+            await redis.get("a")
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set("a", 1)
+                pipe.get("a")
+                await pipe.execute()
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            await client.get("/redis")
+        await redis.aclose()
+        self.assertEqual(registry.redis_commands[("GET", "/redis")], 3)
+        self.assertGreater(registry.redis_time_ns[("GET", "/redis")], 0)
+        self.assertEqual(registry.redis_latency[("PIPELINE",)].count, 1)
+        text = render(registry)
+        self.assertIn(
+            'pyforum_redis_commands_total{method="GET",route="/redis"} 3', text
+        )
+        self.assertIn('pyforum_redis_seconds_total{method="GET",route="/redis"}', text)
+
+
+class TestEndpoint(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis()
+        app = FastAPI()
+        app.include_router(metrics.router)
+
+        async def wrapped(scope, receive, send):
+            scope["state"] = {"redis": self.redis}
+            await app(scope, receive, send)
+
+        self.app = wrapped
+
+    async def asyncTearDown(self):
+        await self.redis.aclose()
+
+    async def get(self, host: str, **headers) -> int:
+        async with AsyncClient(
+            transport=ASGITransport(app=self.app, client=(host, 1234)),
+            base_url="http://test",
+        ) as client:
+            return (await client.get("/metrics", headers=headers)).status_code
+
+    async def test_access(self):
+        self.assertEqual(await self.get("127.0.0.1"), 200)
+        self.assertEqual(await self.get("10.0.0.1"), 403)
+        with patch.object(settings, "metrics_token", "secret"):
+            self.assertEqual(
+                await self.get("10.0.0.1", authorization="Bearer secret"), 200
+            )
+            self.assertEqual(
+                await self.get("10.0.0.1", authorization="Bearer wrong"), 403
+            )
+        with patch.object(settings, "metrics_allow", ["10.0.0.0/8"]):
+            self.assertEqual(await self.get("10.0.0.1"), 200)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import gc
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from fastapi import FastAPI
+from pydantic import AnyUrl
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import catalog, prefork
+from pyforum.config import settings
+from pyforum.models import Thread
+
+
+class TestWarmup(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dsn = f"sqlite+aiosqlite:///{self.dir.name}/data.db"
+
+        async def seed():
+            engine = create_async_engine(self.dsn)
+            async with engine.begin() as conn:
+                await conn.run_sync(
+                    SQLModel.metadata.create_all,
+                    tables=[
+                        SQLModel.metadata.tables[n]
+                        for n in ("thread", "item", "thread_auth", "group")
+                    ],
+                )
+            async with AsyncSession(engine) as session:
+                session.add(Thread(id=1, name="t", description=""))
+                await session.commit()
+            await engine.dispose()
+
+        asyncio.run(seed())
+
+    def tearDown(self):
+        gc.unfreeze()
+        catalog._catalog = None
+        self.dir.cleanup()
+
+    def test_dsn(self):
+        """pg_dsn是pydantic的Url对象，不是str"""
+        with patch.object(settings, "sqlite", None), patch.object(
+            settings, "pg_dsn", AnyUrl(self.dsn)
+        ), patch.object(
+            prefork, "from_url", lambda url: fakeredis.FakeAsyncRedis()
+        ), patch.object(
+            prefork.traceback, "print_exc", side_effect=AssertionError
+        ):
+            prefork.warmup(FastAPI())
+        self.assertIsNotNone(catalog._catalog)
+        self.assertEqual(list(catalog._catalog.threads), [1])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from pyforum.config import settings
+from pyforum.profiler import ProfilerMiddleware, get_profile_path, list_profiles
+
+
+def burn_cpu(seconds: float):
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
+
+
+async def wait_io(seconds: float):
+    await asyncio.sleep(seconds)
+
+
+class TestProfiler(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            patch.object(settings, "profile_rate", 1.0),
+            patch.object(settings, "profile_threshold", 50),
+            patch.object(settings, "profile_interval", 1),
+            patch.object(settings, "profile_dir", self.dir.name),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.dir.cleanup()
+
+    async def test_slow_handler(self):
+        app = FastAPI()
+        app.add_middleware(ProfilerMiddleware)
+
+        @app.get("/slow")
+        async def slow_handler():
+            burn_cpu(0.1)
+            await wait_io(0.1)
+            return {}
+
+        @app.get("/fast")
+        async def _():
+            return {}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            await client.get("/fast")
+            await client.get("/slow")
+
+        profiles = list_profiles()
+        self.assertEqual(len(profiles), 1)  # 快的请求不保存
+        name = profiles[0]["name"]
+        self.assertIn("-GET-slow-", name)
+        path = get_profile_path(name)
+        self.assertIsNotNone(path)
+        stacks = path.read_text(encoding="utf-8").splitlines()
+        # 跑着的时候是真实调用栈，挂起的时候是await链
+        self.assertTrue(
+            any("slow_handler" in s and "burn_cpu" in s for s in stacks), stacks
+        )
+        self.assertTrue(
+            any(
+                "wait_io" in s and s.rsplit(" ", 1)[0].endswith("<await>")
+                for s in stacks
+            ),
+            stacks,
+        )
+        self.assertIsNone(get_profile_path("../" + name))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
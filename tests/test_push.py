@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import os
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+
+from pyforum import push
+from pyforum.config import settings
+from pyforum.pubsub import Hub
+
+
+class TestFanout(IsolatedAsyncioTestCase):
+    def tearDown(self):
+        push._subscribers.clear()
+        push.connections = 0
+
+    async def test_channels(self):
+        a = push.add([push.thread_channel(1), push.user_channel(1)])
+        b = push.add([push.thread_channel(2)])
+        push._on_message(push.thread_channel(1), b"1")
+        push._on_message(push.all_channel(), b"all")
+        self.assertEqual(await a.get(), [b"1", b"all"])
+        self.assertEqual(await b.get(), [b"all"])
+        # 用户频道的消息发完就断开
+        push._on_message(push.user_channel(1), b"user")
+        self.assertEqual(await a.get(), [b"user"])
+        with self.assertRaises(push.SlowConsumer):
+            await a.get()
+        push.remove(a)
+        push.remove(b)
+        self.assertEqual((push._subscribers, push.connections), ({}, 0))
+
+    async def test_slow_consumer(self):
+        sub = push.add([])
+        with patch.object(settings, "push_queue_size", 3):
+            for i in range(4):
+                sub.put(b"%d" % i)
+        with self.assertRaises(push.SlowConsumer):
+            await sub.get()
+        push.remove(sub)
+
+    async def test_wait(self):
+        sub = push.add([push.thread_channel(1)])
+        task = asyncio.create_task(sub.get())
+        await asyncio.sleep(0)
+        self.assertFalse(task.done())
+        push._on_message(push.thread_channel(1), b"1")
+        self.assertEqual(await task, [b"1"])
+        push.remove(sub)
+
+
+class TestHubPattern(IsolatedAsyncioTestCase):
+    async def test_psubscribe(self):
+        redis = fakeredis.FakeAsyncRedis()
+        hub = Hub()
+        received, resets = [], []
+        hub.psubscribe(
+            "p:*", lambda c, d: received.append((c, d)), lambda: resets.append(1)
+        )
+        hub.start(redis)
+        for _ in range(100):  # 等订阅上
+            if resets:
+                break
+            await asyncio.sleep(0.01)
+        await redis.publish("p:1", b"x")
+        await redis.publish("q:1", b"y")
+        for _ in range(100):
+            if received:
+                break
+            await asyncio.sleep(0.01)
+        await hub.stop()
+        await redis.aclose()
+        self.assertEqual(received, [("p:1", b"x")])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
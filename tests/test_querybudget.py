@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.config import settings
+from pyforum.depends import check_user_auth_for_threads
+from pyforum.models import Item, Thread, ThreadAuth, User, UserItemLink
+from pyforum.querybudget import (
+    QueryBudgetMiddleware,
+    fingerprint,
+    instrument_engine,
+    query_budget,
+    record_queries,
+)
+from pyforum.routers.admin.crud import user_get_item
+
+
+class TestQueryBudget(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        instrument_engine(self.engine)
+        tables = [t for n, t in SQLModel.metadata.tables.items() if n != "address"]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(User(id=1, name="u", password="x"))
+            for i in range(1, 6):
+                session.add(Item(id=i, name=f"item{i}"))
+                session.add(UserItemLink(user_id=1, item_id=i, count=i))
+                session.add(Thread(id=i, name=f"thread{i}", description=""))
+                session.add(ThreadAuth(thread_id=i, item_id=i, count=3))
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT a FROM t WHERE id IN (?, ?, ?) AND b = 'x'  LIMIT 10"),
+            "SELECT a FROM t WHERE id IN (...) AND b = ? LIMIT ?",
+        )
+        # PostgreSQL，列表长短不同也是同一条
+        self.assertEqual(
+            fingerprint("SELECT a FROM t WHERE id IN ($1, $2, $3) AND b = $4"),
+            fingerprint("SELECT a FROM t WHERE id IN ($1, $2) AND b = $3"),
+        )
+        self.assertEqual(
+            fingerprint("SELECT a FROM t WHERE id IN ($1, $2, $3)"),
+            "SELECT a FROM t WHERE id IN (...)",
+        )
+
+    async def test_user_get_item(self):
+        async with AsyncSession(self.engine) as session:
+            with record_queries() as rec:
+                items = await user_get_item(session, 1)
+        self.assertEqual(len(items), 5)
+        self.assertEqual(sorted(i["count"] for i in items), [1, 2, 3, 4, 5])
+        self.assertEqual(len(rec), 1)
+
+    async def test_check_user_auth_for_threads(self):
+        async with AsyncSession(self.engine) as session:
+            threads = (await session.exec(select(Thread))).all()
+            with record_queries() as rec:
+                visible = await check_user_auth_for_threads(session, threads, 1)
+            self.assertEqual(sorted(t.id for t in visible), [3, 4, 5])
+            self.assertLessEqual(len(rec), 2)
+            self.assertFalse(rec.repeated())
+
+            with record_queries() as rec:
+                for thread in threads:  # 故意的N+1
+                    await session.refresh(thread, ["auths"])
+            self.assertIn(5, rec.repeated().values())
+
+    async def test_middleware(self):
+        app = FastAPI()
+        app.add_middleware(QueryBudgetMiddleware)
+
+        @app.get("/items")
+        @query_budget(1)
+        async def _():
+            async with AsyncSession(self.engine) as session:
+                for i in range(1, 4):  # 故意的N+1
+                    await session.get(Item, i)
+            return {"msg": "ok"}
+
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            with self.assertLogs("pyforum.querybudget", "WARNING"):
+                resp = await client.get("/items")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["x-query-count"], "3")
+            self.assertEqual(resp.headers["x-query-repeated"], "3")
+
+            with patch.object(settings, "query_budget_strict", True):
+                with self.assertLogs("pyforum.querybudget", "ERROR"):
+                    resp = await client.get("/items")
+            self.assertEqual(resp.status_code, 500)
+            self.assertIn("超出预算1", resp.text)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from time import time
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from pyforum import ratelimit
+from pyforum.config import settings
+from pyforum.ratelimit import _blocked, check_rate_limit, rules_for
+
+
+class TestRateLimit(IsolatedAsyncioTestCase):
+    def test_rules(self):
+        rules = rules_for("login")
+        self.assertEqual([r.dim for r in rules], ["ip", "session", "account"])
+        self.assertTrue(all(r.limit > 0 and r.window > 0 for r in rules))
+        self.assertEqual(rules_for("not-exists"), ())
+
+    async def test_local_block(self):
+        """被封禁的客户端不访问redis直接拒绝"""
+        request = Request({"type": "http", "client": ("10.0.0.1", 1), "headers": []})
+        window = rules_for("captcha")[0].window
+        _blocked[f"ratelimit:captcha:ip:10.0.0.1:{window}"] = time() + 30
+        with self.assertRaises(HTTPException) as ctx:
+            await check_rate_limit(request, None, "captcha")
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertEqual(ctx.exception.headers["Retry-After"], "30")
+
+
+class TestSlidingWindow(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis()
+        self.now = 600.0  # 窗口的开头
+        rules = {f"test-{dim}": f"{dim}:3/60" for dim in ("ip", "session", "account")}
+        self.patches = [
+            patch.object(settings, "ratelimit_rules", rules),
+            patch.object(ratelimit, "time", lambda: self.now),
+        ]
+        for p in self.patches:
+            p.start()
+        rules_for.cache_clear()
+
+    async def asyncTearDown(self):
+        for p in self.patches:
+            p.stop()
+        rules_for.cache_clear()
+        _blocked.clear()
+        ratelimit._script = None
+        await self.redis.aclose()
+
+    async def allowed(self, dim: str, value: str) -> bool:
+        scope = {"type": "http", "client": ("10.0.0.1", 1), "headers": []}
+        account = None
+        if dim == "ip":
+            scope["client"] = (value, 1)
+        elif dim == "session":
+            scope["session_handler"] = SimpleNamespace(session_id=value)
+        else:
+            account = value
+        try:
+            await check_rate_limit(Request(scope), self.redis, f"test-{dim}", account)
+        except HTTPException as e:
+            self.assertEqual(e.status_code, 429)
+            return False
+        return True
+
+    async def test_window(self):
+        for dim in ("ip", "session", "account"):
+            with self.subTest(dim=dim):
+                self.now = 600.0
+                for _ in range(3):
+                    self.assertTrue(await self.allowed(dim, "a"))
+                self.assertFalse(await self.allowed(dim, "a"))
+                self.assertTrue(await self.allowed(dim, "b"))  # 按key分开计数
+
+                # 本进程的封禁到窗口结束才解除，下面清掉，只看redis里的脚本
+                _blocked.clear()
+                # 下一个窗口刚开始，上一个窗口还全算
+                self.now = 660.0
+                self.assertFalse(await self.allowed(dim, "a"))
+                _blocked.clear()
+                # 滑过去一半，0 + 3 * 0.5 + 1 <= 3
+                self.now = 690.0
+                self.assertTrue(await self.allowed(dim, "a"))
+                self.assertFalse(await self.allowed(dim, "a"))
+                _blocked.clear()
+                # 600开始的窗口滑出去了，只剩690的那一次
+                self.now = 720.0
+                self.assertTrue(await self.allowed(dim, "a"))
+                self.assertTrue(await self.allowed(dim, "a"))
+                self.assertFalse(await self.allowed(dim, "a"))
+                _blocked.clear()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
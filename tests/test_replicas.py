@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.models import Thread
+from pyforum.replicas import ReplicaRouter, RoutingSession
+
+
+class TestReplicas(IsolatedAsyncioTestCase):
+    """主库和副本是两个sqlite文件，里面的数据不一样，看查询发到了哪个"""
+
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.primary = create_async_engine(
+            f"sqlite+aiosqlite:///{self.dir.name}/primary.db"
+        )
+        self.replica = create_async_engine(
+            f"sqlite+aiosqlite:///{self.dir.name}/replica.db"
+        )
+        for engine, name in ((self.primary, "primary"), (self.replica, "replica")):
+            async with engine.begin() as conn:
+                await conn.run_sync(
+                    SQLModel.metadata.create_all,
+                    tables=[SQLModel.metadata.tables["thread"]],
+                )
+            async with AsyncSession(engine) as session:
+                session.add(Thread(id=1, name=name, description=""))
+                await session.commit()
+
+    async def asyncTearDown(self):
+        await self.primary.dispose()
+        await self.replica.dispose()
+        self.dir.cleanup()
+
+    def session(self, router: ReplicaRouter) -> AsyncSession:
+        return AsyncSession(
+            self.primary, sync_session_class=RoutingSession, router=router
+        )
+
+    async def test_route(self):
+        router = ReplicaRouter(self.primary, [self.replica])
+        await router.check()
+        async with self.session(router) as session:
+            self.assertEqual((await session.get(Thread, 1)).name, "replica")
+            session.add(Thread(id=2, name="new", description=""))
+            await session.flush()
+            # 写过之后读主库，能读到自己刚写的
+            names = (await session.exec(select(Thread.name))).all()
+            self.assertEqual(sorted(names), ["new", "primary"])
+            await session.commit()
+
+    async def test_fallback(self):
+        broken = create_async_engine(f"sqlite+aiosqlite:///{self.dir.name}/no/x.db")
+        router = ReplicaRouter(self.primary, [broken])
+        await router.check()
+        self.assertEqual(router.healthy, [])
+        async with self.session(router) as session:
+            self.assertEqual((await session.get(Thread, 1)).name, "primary")
+        # sqlite生产模式不回到写连接
+        router = ReplicaRouter(self.primary, [broken], fallback=self.replica)
+        await router.check()
+        async with self.session(router) as session:
+            self.assertEqual((await session.get(Thread, 1)).name, "replica")
+        await broken.dispose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import os
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from fastapi import Depends, FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starsessions import SessionMiddleware
+from starsessions.stores.redis import RedisStore
+
+from pyforum import catalog, respcache
+from pyforum.config import settings
+from pyforum.depends import load_session
+from pyforum.models import (
+    Group,
+    Item,
+    Thread,
+    ThreadAuth,
+    User,
+    UserGroupLink,
+    UserItemLink,
+)
+from pyforum.querybudget import instrument_engine, record_queries
+from pyforum.replicas import ReplicaRouter
+from pyforum.routers import admin, thread
+from pyforum.sessions import SessionCodec
+
+SESSION_ID = "ab" * 16
+
+
+class TestResponseCache(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        instrument_engine(self.engine)
+        tables = [t for n, t in SQLModel.metadata.tables.items() if n != "address"]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(User(id=1, name="admin", password="x"))
+            session.add(Group(id=2, name="admin"))
+            session.add(Item(id=1, name="key"))
+            session.add(Thread(id=1, name="public", description=""))
+            session.add(Thread(id=2, name="private", description=""))
+            await session.flush()
+            session.add(UserGroupLink(user_id=1, group_id=2))
+            session.add(UserItemLink(user_id=1, item_id=1, count=1))
+            session.add(ThreadAuth(thread_id=2, item_id=1, count=1))
+            await session.commit()
+
+        self.redis = fakeredis.FakeAsyncRedis()
+        codec = SessionCodec()
+        store = RedisStore(connection=self.redis, prefix=settings.session_prefix)
+        await store.write(SESSION_ID, codec.serialize({"user_id": 1}), 3600, 3600)
+
+        app = FastAPI(dependencies=[Depends(load_session)])
+        app.include_router(admin.router)
+        app.include_router(thread.router)
+        app.add_middleware(respcache.ResponseCacheMiddleware)
+        app.add_middleware(SessionMiddleware, store=store, serializer=codec)
+        state = {
+            "redis": self.redis,
+            "sqla": self.engine,
+            "replicas": ReplicaRouter(self.engine, []),
+            "writer": None,
+        }
+        self.client = AsyncClient(
+            transport=ASGITransport(app=_with_state(app, state)),
+            base_url="http://test",
+        )
+        catalog._catalog = None
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        catalog._catalog = None
+        respcache._local.clear()
+        respcache._tag_versions.clear()
+        respcache._perms.clear()
+        await self.redis.aclose()
+        await self.engine.dispose()
+
+    async def get(self, cookie: bool = False, **headers):
+        if cookie:
+            headers["cookie"] = f"session={SESSION_ID}"
+        resp = await self.client.get("/api/v1/thread/", headers=headers)
+        self.assertIn(resp.status_code, (200, 304), resp.text)
+        return resp
+
+    async def test_hit_stale(self):
+        first = await self.get()
+        self.assertNotIn("x-cache", first.headers)  # 第一次才知道路由可以缓存
+        miss = await self.get()
+        self.assertEqual(miss.headers["x-cache"], "MISS")
+        self.assertEqual([t["id"] for t in miss.json()["threads"]], [1])
+        hit = await self.get()
+        self.assertEqual(hit.headers["x-cache"], "HIT")
+        self.assertEqual(hit.content, miss.content)
+
+        for entry in respcache._local.values():
+            entry.created -= settings.respcache_ttl + 1
+        stale = await self.get()
+        self.assertEqual(stale.headers["x-cache"], "STALE")
+        self.assertEqual(stale.content, miss.content)
+        for _ in range(100):  # 后台刷新完又是新鲜的
+            if (await self.get()).headers["x-cache"] == "HIT":
+                break
+            await asyncio.sleep(0.01)
+        else:
+            self.fail("stale entry was not refreshed")
+
+    async def test_etag(self):
+        await self.get()
+        resp = await self.get()
+        etag = resp.headers["etag"]
+        resp = await self.get(**{"if-none-match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b"")
+        self.assertEqual(resp.headers["etag"], etag)
+        resp = await self.get(**{"if-none-match": '"other"'})
+        self.assertEqual(resp.status_code, 200)
+
+    async def test_permission(self):
+        await self.get()
+        anon = await self.get()
+        self.assertEqual([t["id"] for t in anon.json()["threads"]], [1])
+        user = await self.get(cookie=True)
+        self.assertEqual(user.headers["x-cache"], "MISS")  # 不和匿名用户共用
+        self.assertEqual([t["id"] for t in user.json()["threads"]], [1, 2])
+        with record_queries() as rec:
+            user = await self.get(cookie=True)
+        self.assertEqual(user.headers["x-cache"], "HIT")
+        self.assertEqual(len(rec), 0)  # 权限类别按session记住了
+        self.assertEqual((await self.get()).json()["threads"], anon.json()["threads"])
+
+    async def test_invalidate(self):
+        await self.get()
+        await self.get()
+        self.assertEqual((await self.get()).headers["x-cache"], "HIT")
+        resp = await self.client.post(
+            "/api/v1/admin/thread",
+            json={"name": "new", "description": ""},
+            headers={"cookie": f"session={SESSION_ID}"},
+        )
+        self.assertEqual(resp.status_code, 200, resp.text)
+        resp = await self.get()
+        self.assertEqual(resp.headers["x-cache"], "MISS")
+        self.assertEqual([t["id"] for t in resp.json()["threads"]], [1, 3])
+
+
+def _with_state(app, state: dict):
+    """代替lifespan，把redis和数据库放进scope["state"]"""
+
+    async def wrapped(scope, receive, send):
+        scope["state"] = dict(state)
+        await app(scope, receive, send)
+
+    return wrapped
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
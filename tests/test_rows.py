@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.models import Item, Thread
+from pyforum.routers.admin.crud import get_item_class, get_thread
+from pyforum.rows import dump_rows
+
+
+class TestRows(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [SQLModel.metadata.tables[n] for n in ("item", "thread")]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(Item(id=1, name="item1"))
+            session.add(Item(id=2, name="item2", description="d"))
+            session.add(Thread(id=1, name="thread1", description=""))
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_same_as_model_dump(self):
+        """行的输出要和原来orm对象model_dump的一模一样"""
+        async with AsyncSession(self.engine) as session:
+            items = (await session.exec(select(Item))).all()
+            threads = (await session.exec(select(Thread))).all()
+            expected_items = [i.model_dump() for i in items]
+            expected_threads = [
+                t.model_dump(exclude_none=True, exclude={"auths"}) for t in threads
+            ]
+        async with AsyncSession(self.engine) as session:
+            self.assertEqual(dump_rows(await get_item_class(session)), expected_items)
+            self.assertEqual(
+                dump_rows(await get_thread(session, id=1), exclude_none=True),
+                expected_threads,
+            )
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
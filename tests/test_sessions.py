@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import os
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+import orjson
+from starsessions.middleware import LoadGuard
+from starsessions.session import SessionHandler
+
+from pyforum import sessions
+from pyforum.config import settings
+from pyforum.pubsub import Hub
+from pyforum.sessions import (
+    SessionCodec,
+    TieredRedisStore,
+    decode_session,
+    read_session,
+)
+
+METADATA = {"lifetime": 15552000, "created": 1700000000.5, "last_access": 1700000001.5}
+
+
+class TestSessionCodec(TestCase):
+    def test_roundtrip(self):
+        codec = SessionCodec()
+        for session in (
+            {},
+            {"__metadata__": METADATA},
+            {"user_id": 1, "captcha_id": "ab" * 16, "__metadata__": METADATA},
+            # 不认识的键和不合格式的值放进json部分
+            {"user_id": "1", "email_id": "AB" * 16, "other": [1, 2]},
+        ):
+            data = codec.serialize(session)
+            self.assertEqual(decode_session(data), session)
+        self.assertLess(
+            len(codec.serialize({"user_id": 1, "__metadata__": METADATA})),
+            len(orjson.dumps({"user_id": 1, "__metadata__": METADATA})),
+        )
+
+    def test_legacy_json(self):
+        session = {"user_id": 1, "__metadata__": METADATA}
+        self.assertEqual(decode_session(orjson.dumps(session)), session)
+
+    def test_broken(self):
+        self.assertEqual(decode_session(b""), {})
+        self.assertEqual(decode_session(b"\x09\x01"), {})  # 不认识的版本
+        self.assertEqual(decode_session(b"\x01\x01\x00"), {})  # 截断
+
+
+class TestReadSession(IsolatedAsyncioTestCase):
+    async def test_anonymous(self):
+        """没有cookie的不访问redis，store是None，访问了会报错"""
+        scope = {"type": "http", "headers": [], "session": LoadGuard()}
+        scope["session_handler"] = SessionHandler(None, None, None, None, 3600)
+        session = await read_session(scope)
+        self.assertEqual(dict(session), {})
+        self.assertIs(await read_session(scope), session)
+        with self.assertRaises(TypeError):
+            session["user_id"] = 1  # 只读
+        self.assertFalse(scope["session_handler"].is_loaded)  # 不会写回
+
+
+class TestTieredRedisStore(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis()
+        self.hub = Hub()
+        with patch.object(sessions, "hub", self.hub):
+            self.store = TieredRedisStore(
+                self.redis, settings.session_prefix, SessionCodec()
+            )
+        self.key = self.store.prefix("a" * 32)
+
+    async def asyncTearDown(self):
+        await self.hub.stop()
+        await self.redis.aclose()
+
+    def data(self, user_id: int, last_access: float) -> bytes:
+        metadata = {**METADATA, "last_access": last_access}
+        return SessionCodec().serialize({"user_id": user_id, "__metadata__": metadata})
+
+    async def test_skip_unchanged(self):
+        await self.store.write("a" * 32, self.data(1, 1.0), 3600, 3600)
+        self.assertEqual(await self.redis.get(self.key), self.data(1, 1.0))
+        # 只有last_access变了，不写
+        await self.store.write("a" * 32, self.data(1, 2.0), 3600, 3600)
+        self.assertEqual(await self.redis.get(self.key), self.data(1, 1.0))
+        # 内容变了，一定写
+        await self.store.write("a" * 32, self.data(2, 3.0), 3600, 3600)
+        self.assertEqual(await self.redis.get(self.key), self.data(2, 3.0))
+        self.assertEqual(await self.store.read("a" * 32, 3600), self.data(2, 3.0))
+
+    async def test_touch(self):
+        await self.store.write("a" * 32, self.data(1, 1.0), 3600, 3600)
+        await self.redis.persist(self.key)
+        await self.store.write("a" * 32, self.data(1, 2.0), 3600, 3600)
+        self.assertEqual(await self.redis.ttl(self.key), -1)  # 刚续过期，不EXPIRE
+        self.store.local["a" * 32].touched_at -= settings.session_touch_interval
+        await self.store.write("a" * 32, self.data(1, 3.0), 3600, 3600)
+        self.assertGreater(await self.redis.ttl(self.key), 0)
+        await self.redis.persist(self.key)
+        await self.store.write("a" * 32, self.data(1, 4.0), 3600, 3600)
+        self.assertEqual(await self.redis.ttl(self.key), -1)
+
+    async def test_invalidate(self):
+        """另一个worker改了session，本地的副本要丢掉"""
+        resets = []
+        self.hub.subscribe(
+            settings.session_channel, lambda _: None, lambda: resets.append(1)
+        )
+        self.hub.start(self.redis)
+        for _ in range(100):  # 等订阅上，订阅上时会清空本地缓存
+            if resets:
+                break
+            await asyncio.sleep(0.01)
+        await self.store.write("a" * 32, self.data(1, 1.0), 3600, 3600)
+        self.assertIn("a" * 32, self.store.local)
+
+        with patch.object(sessions, "hub", Hub()):
+            other = TieredRedisStore(
+                self.redis, settings.session_prefix, SessionCodec()
+            )
+        with patch.object(sessions, "worker_id", lambda: "other"):
+            await other.write("a" * 32, self.data(2, 2.0), 3600, 3600)
+        for _ in range(100):
+            if "a" * 32 not in self.store.local:
+                break
+            await asyncio.sleep(0.01)
+        else:
+            self.fail("local copy was not evicted")
+        self.assertEqual(await self.store.read("a" * 32, 3600), self.data(2, 2.0))
+
+        # 自己发出的通知不会丢掉自己的副本
+        await self.store.write("a" * 32, self.data(3, 3.0), 3600, 3600)
+        await asyncio.sleep(0.05)
+        self.assertIn("a" * 32, self.store.local)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from datetime import datetime
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import signs
+from pyforum.config import settings
+from pyforum.models import Sign, SignArchive, User, tz
+from pyforum.routers.user import crud
+
+
+class TestPack(TestCase):
+    def test_roundtrip(self):
+        months = {1: 1 << 30, 2: 0b101, 12: 1 << 30}
+        blob = signs.pack_year(2024, months)
+        self.assertEqual(len(blob), 46)
+        for month in range(1, 13):
+            self.assertEqual(
+                signs.unpack_month(blob, 2024, month), months.get(month, 0)
+            )
+        # 合并已经归档的
+        blob = signs.pack_year(2024, {2: 0b10}, blob)
+        self.assertEqual(signs.unpack_month(blob, 2024, 2), 0b111)
+
+
+class TestArchive(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [SQLModel.metadata.tables[n] for n in ("user", "sign", "sign_archive")]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            for uid in range(1, 6):
+                session.add(User(id=uid, name=str(uid), password=""))
+            await session.flush()
+            for uid in range(1, 6):
+                for month in (1, 2):
+                    session.add(Sign(user_id=uid, year=2020, month=month, data=uid))
+                session.add(Sign(user_id=uid, year=datetime.now(tz=tz).year, month=1))
+            await session.commit()
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_archive(self):
+        with patch.object(settings, "sign_archive_batch", 2):
+            self.assertEqual(await signs.archive_cold(self.engine), 5)
+        async with AsyncSession(self.engine) as session:
+            count = select(func.count()).select_from(Sign)
+            self.assertEqual((await session.exec(count)).one(), 5)  # 今年的还在
+            self.assertEqual(await signs.read_month(session, 3, 2020, 2), 3)
+            # 归档之后补签，两层一起读
+            await crud.handle_sign(session, 3, 2020, 2, 5)
+            self.assertEqual(await signs.read_month(session, 3, 2020, 2), 3 | 1 << 4)
+            self.assertEqual(
+                (await crud.handle_get_sign(session, 3, 2020, 2))[:5],
+                [True, True, False, False, True],
+            )
+        await signs.archive_year(self.engine, 2020)  # 再归档一次合并进去
+        async with AsyncSession(self.engine) as session:
+            archive = await session.get(SignArchive, (3, 2020))
+            self.assertEqual(signs.unpack_month(archive.data, 2020, 2), 3 | 1 << 4)
+            self.assertEqual(signs.unpack_month(archive.data, 2020, 1), 3)
+
+    async def test_get_sign(self):
+        now = datetime.now(tz=tz)
+        async with AsyncSession(self.engine) as session:
+            with self.assertRaises(HTTPException):
+                await crud.handle_get_sign(session, 1, now.year + 1, 1)
+            self.assertEqual(await crud.handle_get_sign(session, 1, 2019, 1), [0] * 32)
+            count = select(func.count()).select_from(Sign)
+            self.assertEqual((await session.exec(count)).one(), 15)  # 查询不会插入空行
+
+    async def test_maintain_lock(self):
+        redis = fakeredis.FakeAsyncRedis()
+        self.assertTrue(await signs.maintain(self.engine, redis))
+        self.assertFalse(await signs.maintain(self.engine, redis))  # 别的worker刚做过
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
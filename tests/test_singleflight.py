@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import os
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+import orjson
+from sqlalchemy import literal, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from pyforum.config import settings
+from pyforum.metrics import registry
+from pyforum.rows import dump_rows, pack_rows, unpack_rows
+from pyforum.singleflight import singleflight
+
+
+class TestSingleFlight(IsolatedAsyncioTestCase):
+    async def test_merge(self):
+        calls = []
+
+        @singleflight(name="test_merge")
+        async def load(session, id: int):
+            calls.append(id)
+            await asyncio.sleep(0.01)
+            return [id]
+
+        results = await asyncio.gather(
+            *[load(object(), 1) for _ in range(10)], load(object(), 2)
+        )
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(results[0], [1])
+        self.assertIs(results[0], results[9])  # 共享同一个结果
+        self.assertEqual(registry.singleflight[("test_merge", "merged")], 9)
+        await load(object(), 1)  # 执行完之后不再合并
+        self.assertEqual(calls, [1, 2, 1])
+
+    async def test_exception(self):
+        @singleflight(name="test_exception")
+        async def fail(id: int):
+            await asyncio.sleep(0.01)
+            raise ValueError(id)
+
+        results = await asyncio.gather(
+            fail(1), fail(1), fail(id=1), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(registry.singleflight[("test_exception", "merged")], 2)
+
+    async def test_leader_cancelled(self):
+        calls = []
+
+        @singleflight(name="test_cancel")
+        async def load(id: int):
+            calls.append(id)
+            await asyncio.sleep(0.05)
+            return id
+
+        leader = asyncio.create_task(load(1))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(load(1))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        self.assertEqual(await follower, 1)
+        self.assertEqual(calls, [1, 1])
+
+    async def test_remote(self):
+        """两个worker共用redis，结果用orjson传，Row的列表转回同样字段的具名元组"""
+        engine = create_async_engine("sqlite+aiosqlite://")
+        redis = fakeredis.FakeAsyncRedis()
+        calls = []
+
+        def worker():
+            @singleflight(
+                name="test_remote",
+                redis_lock=True,
+                encode=pack_rows,
+                decode=unpack_rows,
+            )
+            async def load(redis, id: int):
+                calls.append(id)
+                async with engine.connect() as conn:
+                    rows = (
+                        await conn.execute(
+                            select(literal(id).label("id"), literal("a").label("name"))
+                        )
+                    ).all()
+                await asyncio.sleep(0.05)
+                return rows
+
+            return load
+
+        first, second = await asyncio.gather(worker()(redis, 1), worker()(redis, 1))
+        self.assertEqual(calls, [1])
+        self.assertEqual(dump_rows(first), [{"id": 1, "name": "a"}])
+        self.assertEqual(dump_rows(second), dump_rows(first))
+        self.assertEqual(second[0].id, 1)
+        self.assertEqual(registry.singleflight[("test_remote", "remote")], 1)
+        (key,) = await redis.keys(f"{settings.singleflight_prefix}test_remote:*:*")
+        self.assertEqual(orjson.loads(await redis.get(key))["fields"], ["id", "name"])
+        await redis.aclose()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
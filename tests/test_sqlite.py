@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, func, select
+
+from pyforum.models import Thread
+from pyforum.sqlite import SQLiteWriter, WriterSession, read_only_dsn, setup_engines
+
+
+class TestSQLiteWriter(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        dsn = f"sqlite+aiosqlite:///{self.dir.name}/data.db"
+        self.engine = create_async_engine(dsn, pool_size=1, max_overflow=0)
+        self.reader = create_async_engine(read_only_dsn(dsn))
+        setup_engines(self.engine, self.reader)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(
+                SQLModel.metadata.create_all,
+                tables=[SQLModel.metadata.tables["thread"]],
+            )
+        self.writer = SQLiteWriter(self.engine)
+        self.writer.start()
+
+    async def asyncTearDown(self):
+        await self.writer.stop()
+        await self.engine.dispose()
+        await self.reader.dispose()
+        self.dir.cleanup()
+
+    async def test_group_commit(self):
+        async def add(i: int):
+            async with WriterSession(self.writer) as session:
+                session.add(Thread(id=i, name=str(i), description=""))
+                await session.commit()
+                await session.refresh(await session.get(Thread, i))  # commit之后重新排队
+
+        await asyncio.gather(*(add(i) for i in range(1, 21)))
+        self.assertLess(self.writer.commits, 20)  # 合并了
+        async with self.reader.connect() as conn:
+            self.assertEqual(
+                await conn.scalar(select(func.count()).select_from(Thread)), 20
+            )
+            self.assertEqual(await conn.scalar(text("PRAGMA journal_mode")), "wal")
+
+    async def test_savepoint(self):
+        """一个失败了只回滚自己"""
+
+        async def add(i: int):
+            async with WriterSession(self.writer) as session:
+                session.add(Thread(id=i, name=str(i), description=""))
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    await session.rollback()
+                    return False
+                return True
+
+        results = await asyncio.gather(add(1), add(1), add(2))
+        self.assertEqual(sorted(results), [False, True, True])
+        async with self.reader.connect() as conn:
+            ids = (await conn.scalars(select(Thread.id))).all()
+        self.assertEqual(sorted(ids), [1, 2])
+
+    async def test_background(self):
+        """后台任务用writer.begin()，和请求一起排队提交，失败只回滚自己"""
+
+        async def add(i: int):
+            async with WriterSession(self.writer) as session:
+                session.add(Thread(id=i, name=str(i), description=""))
+                await session.commit()
+
+        async def flush(i: int):
+            async with self.writer.begin() as conn:
+                await conn.execute(
+                    Thread.__table__.insert().values(id=i, name=str(i), description="")
+                )
+
+        async def fail():
+            with self.assertRaises(IntegrityError):
+                async with self.writer.begin() as conn:
+                    await conn.execute(
+                        Thread.__table__.insert().values(id=1, name="1", description="")
+                    )
+
+        self.assertEqual(self.writer.dialect.name, "sqlite")
+        await asyncio.gather(
+            *(add(i) for i in range(1, 11)), *(flush(i) for i in range(11, 21)), fail()
+        )
+        self.assertLess(self.writer.commits, 21)
+        async with self.writer.connect() as conn:
+            self.assertEqual(
+                await conn.scalar(select(func.count()).select_from(Thread)), 20
+            )
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
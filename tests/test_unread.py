@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+import fakeredis
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum import unread
+from pyforum.models import Read, Thread, ThreadSeen, User
+
+
+class TestUnread(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [
+            SQLModel.metadata.tables[n]
+            for n in ("user", "thread", "read", "thread_seen")
+        ]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(User(id=1, name="1", password=""))
+            for i in (1, 2):
+                session.add(Thread(id=i, name=str(i), description=""))
+            await session.flush()
+            for i in range(3):
+                session.add(Read(user_id=1, thread_id=1, name=str(i)))
+            await session.commit()
+        self.redis = fakeredis.FakeAsyncRedis()
+        unread._script = None
+
+    async def asyncTearDown(self):
+        unread._script = None
+        await self.redis.aclose()
+        await self.engine.dispose()
+
+    async def test_unread(self):
+        async with AsyncSession(self.engine) as session:
+            # 从数据库加载高水位
+            self.assertEqual(
+                await unread.get_unread(session, self.redis, 1, [1, 2]), {1: 3, 2: 0}
+            )
+            self.assertEqual(await unread.mark_seen(session, self.redis, 1, 1), 3)
+            await unread.on_post(self.redis, 1)
+            await unread.on_post(self.redis, 2)
+            self.assertEqual(
+                await unread.get_unread(session, self.redis, 1, [1, 2]), {1: 1, 2: 1}
+            )
+
+        self.assertEqual(await unread.flush(self.redis, self.engine), 1)
+        self.assertEqual(await unread.flush(self.redis, self.engine), 0)
+        async with AsyncSession(self.engine) as session:
+            rows = (await session.exec(select(ThreadSeen))).all()
+            self.assertEqual(
+                [(r.user_id, r.thread_id, r.seen) for r in rows], [(1, 1, 3)]
+            )
+
+            # redis清空了也能从数据库恢复
+            await self.redis.flushall()
+            self.assertEqual(
+                await unread.get_unread(session, self.redis, 1, [1, 2]), {1: 0, 2: 0}
+            )
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
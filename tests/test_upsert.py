@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import os
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+
+os.environ.setdefault("sqlite", "sqlite+aiosqlite://")
+
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pyforum.models import Group, Sign, Thread, ThreadAuth, User
+from pyforum.routers.admin import crud as admin
+from pyforum.routers.admin.models import PatchUser
+from pyforum.routers.user import crud as user
+from pyforum.upsert import on_conflict
+
+
+class TestUpsert(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        tables = [t for n, t in SQLModel.metadata.tables.items() if n != "address"]
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all, tables=tables)
+        async with AsyncSession(self.engine) as session:
+            session.add(User(id=1, name="a", email="a@a.com", password=""))
+            session.add(User(id=2, name="b", email="b@a.com", password=""))
+            session.add(Group(id=1, name="a"))
+            session.add(Group(id=2, name="b"))
+            session.add(Thread(id=1, name="a", description=""))
+            await session.commit()
+        self.statements = []
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_conflict(self):
+        async with AsyncSession(self.engine) as session:
+            with self.assertRaises(HTTPException) as cm:
+                await user.handle_signup(session, "a", "new@a.com", "password")
+            self.assertEqual(cm.exception.status_code, 409)
+            await user.handle_signup(session, "c", "c@a.com", "password")
+        self.assertEqual(sum(s.startswith("INSERT") for s in self.statements), 2)
+        self.assertFalse([s for s in self.statements if s.startswith("SELECT")])
+
+    async def test_patch_user(self):
+        async with AsyncSession(self.engine) as session:
+            with self.assertRaises(HTTPException) as cm:
+                await admin.patch_user(session, PatchUser(id=2, email="a@a.com"))
+            self.assertEqual(cm.exception.detail, "email already exists")
+            with self.assertRaises(HTTPException) as cm:
+                await admin.patch_user(session, PatchUser(id=2, name="a"))
+            self.assertEqual(cm.exception.detail, "user a already exists")
+            await admin.patch_user(session, PatchUser(id=2, activated=False))
+            self.assertFalse((await session.get(User, 2)).activated)
+
+    async def test_patch_name(self):
+        """group/item/thread也是一条UPDATE，不先COUNT"""
+        async with AsyncSession(self.engine) as session:
+            with self.assertRaises(HTTPException) as cm:
+                await admin.patch_user_group(session, 2, name="a")
+            self.assertEqual(cm.exception.detail, "group a already exists")
+            await admin.patch_user_group(session, 2, description="x")
+            with self.assertRaises(NoResultFound):
+                await admin.patch_thread(session, 2, name="b")
+        self.assertFalse([s for s in self.statements if s.startswith("SELECT")])
+        self.assertEqual(sum(s.startswith("UPDATE") for s in self.statements), 3)
+        async with AsyncSession(self.engine) as session:
+            group = await session.get(Group, 2)
+        self.assertEqual((group.name, group.description), ("b", "x"))
+
+    async def test_postgres_columns(self):
+        """按Key (...)或约束名选说明，不管值里有没有别的列名"""
+        details = {
+            "email": "email already exists",
+            "name": "name already exists",
+            "month": "already signed",
+        }
+        cases = [
+            # asyncpg
+            (_cause(detail="Key (name)=(email) already exists."), "name"),
+            (
+                _cause(
+                    detail="Key (user_id, year, month)=(1, 2024, 1) already exists."
+                ),
+                "month",
+            ),
+            (_cause(constraint_name="ix_user_email", detail="Key (x)=(name)"), "email"),
+            # psycopg
+            (
+                _PGError(
+                    diag=SimpleNamespace(
+                        constraint_name="unknown",
+                        message_detail="Key (email)=(name) already exists.",
+                    )
+                ),
+                "email",
+            ),
+        ]
+        async with AsyncSession(self.engine) as session:
+            for orig, column in cases:
+                with self.subTest(column=column):
+                    with self.assertRaises(HTTPException) as cm:
+                        async with on_conflict(session, details):
+                            raise IntegrityError("UPDATE", {}, orig)
+                    self.assertEqual(cm.exception.status_code, 409)
+                    self.assertEqual(cm.exception.detail, details[column])
+
+    async def test_other_errors(self):
+        """非空之类的不是409"""
+        async with AsyncSession(self.engine) as session:
+            with self.assertRaises(IntegrityError):
+                async with on_conflict(session, "conflict"):
+                    session.add(ThreadAuth(thread_id=1, item_id=None))
+                    await session.commit()
+
+    async def test_sign(self):
+        async with AsyncSession(self.engine) as session:
+            await user.handle_sign(session, 1, 2024, 1, 1)
+            await user.handle_sign(session, 1, 2024, 1, 3)
+            await user.handle_sign(session, 1, 2024, 1, 3)
+            sign = (await session.exec(select(Sign))).one()
+        self.assertEqual(sign.to_list()[:4], [1, 0, 1, 0])
+        self.assertEqual(sum(s.startswith("INSERT") for s in self.statements), 3)
+
+
+class _PGError(Exception):
+    sqlstate = "23505"
+
+    def __init__(self, diag=None):
+        super().__init__("duplicate key value violates unique constraint")
+        self.diag = diag
+
+
+def _cause(constraint_name=None, detail=None) -> _PGError:
+    """asyncpg经过SQLAlchemy包装后，原来的异常在__cause__"""
+    cause = Exception()
+    cause.constraint_name = constraint_name
+    cause.detail = detail
+    error = _PGError()
+    error.__cause__ = cause
+    return error
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()